@@ -1 +1,168 @@
-from .main import *
\ No newline at end of file
+from .main import (
+    Step,
+    StepIndex,
+    Task,
+    TaskConflictError,
+    TaskFilter,
+    TaskTransaction,
+    set_task_store,
+    get_task_store,
+    get_embedding_stats,
+    reset_embedding_stats,
+    enable_status_partitions,
+    disable_status_partitions,
+    migrate_to_status_partitions,
+    enable_task_cache,
+    disable_task_cache,
+    invalidate_task_cache,
+    transaction,
+    rebuild_recency_index,
+    rebuild_keyword_index,
+    rebuild_scheduler,
+    ready_tasks,
+    next_task,
+    enable_generation_cache,
+    disable_generation_cache,
+    get_generation_cache_stats,
+    enable_embedding_cache,
+    disable_embedding_cache,
+    get_embedding_cache_stats,
+    enable_plan_reuse,
+    disable_plan_reuse,
+    enable_step_records,
+    disable_step_records,
+    get_steps,
+    migrate_task_steps,
+    create_task,
+    create_tasks,
+    finish_tasks,
+    cancel_tasks,
+    delete_tasks,
+    archive_tasks,
+    load_archived_task,
+    search_archived_tasks,
+    update_steps,
+    list_tasks,
+    iter_tasks,
+    search_tasks,
+    find_similar_task,
+    get_task_id,
+    delete_task,
+    finish_task,
+    cancel_task,
+    get_last_created_task,
+    get_last_updated_task,
+    get_recent_tasks,
+    tasks_updated_since,
+    get_task_by_id,
+    claim_task,
+    claim_next_task,
+    renew_lease,
+    release_task,
+    get_current_task,
+    set_current_task,
+    create_plan,
+    create_plan_and_steps,
+    update_plan,
+    create_steps,
+    update_step,
+    add_step,
+    finish_step,
+    cancel_step,
+    get_next_step,
+    get_task_progress,
+    enable_render_cache,
+    disable_render_cache,
+    get_render_cache_stats,
+    estimate_tokens,
+    get_task_as_formatted_string,
+    list_tasks_as_formatted_string,
+    write_tasks_as_formatted_string,
+)
+from .store import TaskStore, AgentMemoryStore, InMemoryStore, SQLiteStore
+
+__all__ = [
+    "Step",
+    "StepIndex",
+    "Task",
+    "TaskConflictError",
+    "TaskFilter",
+    "TaskTransaction",
+    "set_task_store",
+    "get_task_store",
+    "get_embedding_stats",
+    "reset_embedding_stats",
+    "enable_status_partitions",
+    "disable_status_partitions",
+    "migrate_to_status_partitions",
+    "enable_task_cache",
+    "disable_task_cache",
+    "invalidate_task_cache",
+    "transaction",
+    "rebuild_recency_index",
+    "rebuild_keyword_index",
+    "rebuild_scheduler",
+    "ready_tasks",
+    "next_task",
+    "enable_generation_cache",
+    "disable_generation_cache",
+    "get_generation_cache_stats",
+    "enable_embedding_cache",
+    "disable_embedding_cache",
+    "get_embedding_cache_stats",
+    "enable_plan_reuse",
+    "disable_plan_reuse",
+    "enable_step_records",
+    "disable_step_records",
+    "get_steps",
+    "migrate_task_steps",
+    "create_task",
+    "create_tasks",
+    "finish_tasks",
+    "cancel_tasks",
+    "delete_tasks",
+    "archive_tasks",
+    "load_archived_task",
+    "search_archived_tasks",
+    "update_steps",
+    "list_tasks",
+    "iter_tasks",
+    "search_tasks",
+    "find_similar_task",
+    "get_task_id",
+    "delete_task",
+    "finish_task",
+    "cancel_task",
+    "get_last_created_task",
+    "get_last_updated_task",
+    "get_recent_tasks",
+    "tasks_updated_since",
+    "get_task_by_id",
+    "claim_task",
+    "claim_next_task",
+    "renew_lease",
+    "release_task",
+    "get_current_task",
+    "set_current_task",
+    "create_plan",
+    "create_plan_and_steps",
+    "update_plan",
+    "create_steps",
+    "update_step",
+    "add_step",
+    "finish_step",
+    "cancel_step",
+    "get_next_step",
+    "get_task_progress",
+    "enable_render_cache",
+    "disable_render_cache",
+    "get_render_cache_stats",
+    "estimate_tokens",
+    "get_task_as_formatted_string",
+    "list_tasks_as_formatted_string",
+    "write_tasks_as_formatted_string",
+    "TaskStore",
+    "AgentMemoryStore",
+    "InMemoryStore",
+    "SQLiteStore",
+]
@@ -0,0 +1,220 @@
+"""Async versions of the agentagenda API.
+
+Every function that talks to the task store runs on a small bounded thread pool
+so it doesn't block the event loop, and LLM calls run on a separate, larger
+pool so plan and step generation for many tasks can overlap.
+
+    from agentagenda import aio
+
+    tasks = await aio.create_tasks(["Write the docs", "Ship the release"])
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import functools
+
+from . import main
+
+_storage_executor = ThreadPoolExecutor(
+    max_workers=4, thread_name_prefix="agentagenda-storage"
+)
+_llm_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="agentagenda-llm")
+
+
+def set_executor_limits(storage_workers=4, llm_workers=32):
+    """Set how many blocking calls can run at once.
+
+    Args:
+        storage_workers (int, optional): Concurrent task store calls. Defaults to 4.
+        llm_workers (int, optional): Concurrent LLM calls. Defaults to 32.
+    """
+    global _storage_executor, _llm_executor
+    _storage_executor.shutdown(wait=False)
+    _llm_executor.shutdown(wait=False)
+    _storage_executor = ThreadPoolExecutor(
+        max_workers=storage_workers, thread_name_prefix="agentagenda-storage"
+    )
+    _llm_executor = ThreadPoolExecutor(
+        max_workers=llm_workers, thread_name_prefix="agentagenda-llm"
+    )
+
+
+async def _run(executor, function, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        executor, functools.partial(function, *args, **kwargs)
+    )
+
+
+def _on_storage_executor(function):
+    @functools.wraps(function)
+    async def wrapper(*args, **kwargs):
+        return await _run(_storage_executor, function, *args, **kwargs)
+
+    return wrapper
+
+
+def _on_llm_executor(function):
+    @functools.wraps(function)
+    async def wrapper(*args, **kwargs):
+        return await _run(_llm_executor, function, *args, **kwargs)
+
+    return wrapper
+
+
+create_plan = _on_llm_executor(main.create_plan)
+create_steps = _on_llm_executor(main.create_steps)
+create_plan_and_steps = _on_llm_executor(main.create_plan_and_steps)
+
+get_steps = _on_storage_executor(main.get_steps)
+migrate_task_steps = _on_storage_executor(main.migrate_task_steps)
+migrate_to_status_partitions = _on_storage_executor(
+    main.migrate_to_status_partitions
+)
+finish_tasks = _on_storage_executor(main.finish_tasks)
+cancel_tasks = _on_storage_executor(main.cancel_tasks)
+delete_tasks = _on_storage_executor(main.delete_tasks)
+archive_tasks = _on_storage_executor(main.archive_tasks)
+load_archived_task = _on_storage_executor(main.load_archived_task)
+search_archived_tasks = _on_storage_executor(main.search_archived_tasks)
+update_steps = _on_storage_executor(main.update_steps)
+list_tasks = _on_storage_executor(main.list_tasks)
+search_tasks = _on_storage_executor(main.search_tasks)
+find_similar_task = _on_storage_executor(main.find_similar_task)
+delete_task = _on_storage_executor(main.delete_task)
+finish_task = _on_storage_executor(main.finish_task)
+cancel_task = _on_storage_executor(main.cancel_task)
+get_last_created_task = _on_storage_executor(main.get_last_created_task)
+get_last_updated_task = _on_storage_executor(main.get_last_updated_task)
+get_recent_tasks = _on_storage_executor(main.get_recent_tasks)
+tasks_updated_since = _on_storage_executor(main.tasks_updated_since)
+get_task_by_id = _on_storage_executor(main.get_task_by_id)
+get_current_task = _on_storage_executor(main.get_current_task)
+set_current_task = _on_storage_executor(main.set_current_task)
+ready_tasks = _on_storage_executor(main.ready_tasks)
+next_task = _on_storage_executor(main.next_task)
+claim_task = _on_storage_executor(main.claim_task)
+claim_next_task = _on_storage_executor(main.claim_next_task)
+renew_lease = _on_storage_executor(main.renew_lease)
+release_task = _on_storage_executor(main.release_task)
+update_plan = _on_storage_executor(main.update_plan)
+update_step = _on_storage_executor(main.update_step)
+add_step = _on_storage_executor(main.add_step)
+finish_step = _on_storage_executor(main.finish_step)
+cancel_step = _on_storage_executor(main.cancel_step)
+get_next_step = _on_storage_executor(main.get_next_step)
+get_task_progress = _on_storage_executor(main.get_task_progress)
+get_task_as_formatted_string = _on_storage_executor(main.get_task_as_formatted_string)
+list_tasks_as_formatted_string = _on_storage_executor(
+    main.list_tasks_as_formatted_string
+)
+write_tasks_as_formatted_string = _on_storage_executor(
+    main.write_tasks_as_formatted_string
+)
+
+
+async def _generate(goal, plan, steps, model, use_cache):
+    """Generate any missing plan and steps for a goal.
+
+    The plan of a similar completed task is reused first, as create_task
+    does when plan reuse is enabled.
+    """
+    plan, steps, example_plan = await _run(
+        _storage_executor, main._reuse_plan, goal, plan, steps
+    )
+    if plan is None:
+        plan = await create_plan(
+            goal, model=model, use_cache=use_cache, example_plan=example_plan
+        )
+    if steps is None:
+        steps = [
+            {"content": step, "completed": False}
+            for step in await create_steps(goal, plan, model=model, use_cache=use_cache)
+        ]
+    return plan, steps
+
+
+async def create_task(
+    goal,
+    plan=None,
+    steps=None,
+    model="gpt-3.5-turbo-0613",
+    use_cache=True,
+    pipeline=False,
+    priority=0,
+    deadline=None,
+    depends_on=None,
+):
+    """Create a task and store it in memory.
+
+    Args:
+        goal (str): The goal of the task.
+        plan (str, optional): A plan to accomplish the task. Defaults to None.
+        steps (list or dict, optional): Steps needed to complete the task. Defaults to None.
+        model (str, optional): The OpenAI model to use for AI operations. Defaults to 'gpt-3.5-turbo-0613'.
+        use_cache (bool, optional): Whether to use the generation cache, if enabled. Defaults to True.
+        pipeline (bool, optional): Store the task as soon as it is created and generate its plan and steps
+            with a single LLM call. Defaults to False.
+        priority (int, optional): Tasks with higher priorities are scheduled first. Defaults to 0.
+        deadline (float or datetime, optional): Among equal priorities, earlier deadlines are scheduled first.
+            Defaults to None.
+        depends_on (list, optional): Tasks that have to leave in_progress before this one is scheduled.
+            Defaults to None.
+
+    Returns:
+        dict: The created task.
+    """
+    schedule = {"priority": priority, "deadline": deadline, "depends_on": depends_on}
+    if pipeline and plan is None and steps is None:
+        return await _run(
+            _llm_executor,
+            main.create_task,
+            goal,
+            model=model,
+            use_cache=use_cache,
+            pipeline=True,
+            **schedule,
+        )
+    plan, steps = await _generate(goal, plan, steps, model, use_cache)
+    return await _run(
+        _storage_executor, main.create_task, goal, plan, steps, model, **schedule
+    )
+
+
+async def create_tasks(tasks, model="gpt-3.5-turbo-0613", use_cache=True):
+    """Create several tasks, generating their plans and steps concurrently.
+
+    Args:
+        tasks (list): Goals as strings, or dicts with a "goal" and optional "plan", "steps", "priority",
+            "deadline" and "depends_on".
+        model (str, optional): The OpenAI model to use for AI operations. Defaults to 'gpt-3.5-turbo-0613'.
+        use_cache (bool, optional): Whether to use the generation cache, if enabled. Defaults to True.
+
+    Returns:
+        list: A result dict per task, in order, with "id", "success" and "error" keys.
+    """
+    tasks = [{"goal": task} if isinstance(task, str) else task for task in tasks]
+    generated = await asyncio.gather(
+        *[
+            _generate(
+                task["goal"], task.get("plan"), task.get("steps"), model, use_cache
+            )
+            for task in tasks
+        ],
+        return_exceptions=True,
+    )
+
+    # keep every other field, such as priority, deadline and depends_on
+    prepared = [
+        dict(task, plan=result[0], steps=result[1])
+        for task, result in zip(tasks, generated)
+        if not isinstance(result, Exception)
+    ]
+    created = iter(await _run(_storage_executor, main.create_tasks, prepared, model))
+
+    return [
+        {"id": None, "success": False, "error": str(result)}
+        if isinstance(result, Exception)
+        else next(created)
+        for result in generated
+    ]
@@ -0,0 +1,152 @@
+import gzip
+import json
+import os
+import threading
+import zlib
+
+
+class TaskArchive:
+    """An append-only, gzip compressed JSONL archive of tasks.
+
+    Every call to append writes one gzip member to the archive file, so the
+    file stays a valid .jsonl.gz that gzip tools can read as a whole. A
+    plain JSONL index next to it records the offset of the member holding
+    each task, so loading one task only decompresses its own batch.
+
+    Args:
+        path (str): Path of the archive file. The index is kept at path + ".idx".
+    """
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.index_path = path + ".idx"
+        self._entries = {}
+        self._lock = threading.Lock()
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as file:
+                for line in file:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._entries[entry["id"]] = entry
+
+    def append(self, memories):
+        """Archive a batch of tasks.
+
+        Args:
+            memories (list): The tasks to archive, as dicts with "id", "document" and "metadata" keys.
+        """
+        if len(memories) == 0:
+            return
+        lines = "".join(
+            json.dumps(
+                {
+                    "id": memory["id"],
+                    "document": memory["document"],
+                    "metadata": memory["metadata"],
+                }
+            )
+            + "\n"
+            for memory in memories
+        )
+        with self._lock:
+            with open(self.path, "ab") as file:
+                offset = file.seek(0, os.SEEK_END)
+                file.write(gzip.compress(lines.encode()))
+            entries = [
+                {
+                    "id": memory["id"],
+                    "offset": offset,
+                    "status": memory["metadata"].get("status"),
+                    "created_at": memory["metadata"].get("created_at", 0),
+                    "updated_at": memory["metadata"].get("updated_at", 0),
+                }
+                for memory in memories
+            ]
+            # the index is written after the data, so a crash in between only
+            # leaves an unindexed batch, never an entry pointing at nothing
+            with open(self.index_path, "a") as file:
+                for entry in entries:
+                    file.write(json.dumps(entry) + "\n")
+            for entry in entries:
+                self._entries[entry["id"]] = entry
+
+    def _read_member(self, offset):
+        """Decompress the gzip member starting at offset."""
+        decompressor = zlib.decompressobj(wbits=31)
+        chunks = []
+        with open(self.path, "rb") as file:
+            file.seek(offset)
+            while not decompressor.eof:
+                data = file.read(65536)
+                if not data:
+                    break
+                chunks.append(decompressor.decompress(data))
+        return [json.loads(line) for line in b"".join(chunks).splitlines() if line]
+
+    def get(self, task_id):
+        """Load an archived task.
+
+        Args:
+            task_id (str): The id of the task.
+
+        Returns:
+            dict or None: The task, or None if it isn't archived.
+        """
+        entry = self._entries.get(task_id)
+        if entry is None:
+            return None
+        for memory in self._read_member(entry["offset"]):
+            if memory["id"] == task_id:
+                return memory
+        return None
+
+    def search(
+        self, task_ids=None, start=None, end=None, by="updated_at", statuses=None
+    ):
+        """Find archived tasks by id, time range and status.
+
+        Args:
+            task_ids (list, optional): Only return these tasks. Defaults to None (any task).
+            start (float, optional): Only return tasks with a timestamp at or after this one. Defaults to None.
+            end (float, optional): Only return tasks with a timestamp before this one. Defaults to None.
+            by (str, optional): "created_at" or "updated_at". Defaults to "updated_at".
+            statuses (list, optional): Only return tasks with these statuses. Defaults to None (any status).
+
+        Returns:
+            list: The matching tasks, newest first.
+        """
+        with self._lock:
+            if task_ids is not None:
+                entries = [self._entries[i] for i in task_ids if i in self._entries]
+            else:
+                entries = list(self._entries.values())
+        entries = [
+            entry
+            for entry in entries
+            if (start is None or entry[by] >= start)
+            and (end is None or entry[by] < end)
+            and (statuses is None or entry["status"] in statuses)
+        ]
+        entries.sort(key=lambda entry: (entry[by], entry["id"]), reverse=True)
+
+        # decompress each batch once, however many of its tasks match
+        members = {}
+        for entry in entries:
+            if entry["offset"] not in members:
+                members[entry["offset"]] = {
+                    memory["id"]: memory for memory in self._read_member(entry["offset"])
+                }
+        return [
+            members[entry["offset"]][entry["id"]]
+            for entry in entries
+            if entry["id"] in members[entry["offset"]]
+        ]
+
+    def __contains__(self, task_id):
+        return task_id in self._entries
+
+    def __len__(self):
+        return len(self._entries)
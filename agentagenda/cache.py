@@ -0,0 +1,373 @@
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class LRUCache:
+    """A small thread-safe LRU cache with an optional time-to-live.
+
+    Args:
+        max_size (int, optional): Maximum number of entries to keep. Defaults to 1024.
+        ttl (float, optional): Seconds an entry stays valid. Defaults to None (never expires).
+    """
+
+    def __init__(self, max_size=1024, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Get a value from the cache, marking it as recently used.
+
+        Args:
+            key: The key to look up.
+            default (optional): Value returned on a miss. Defaults to None.
+
+        Returns:
+            The cached value, or default if the key is missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, stored_at = entry
+            if self.ttl is not None and time.monotonic() - stored_at >= self.ttl:
+                del self._entries[key]
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """Store a value, evicting the least recently used entry if full.
+
+        Args:
+            key: The key to store.
+            value: The value to store.
+        """
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        """Remove a key from the cache if present.
+
+        Args:
+            key: The key to remove.
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Remove every entry from the cache."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Get hit, miss and size counters for the cache.
+
+        Returns:
+            dict: A dict with "hits", "misses" and "size" keys.
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+            }
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class GenerationCache:
+    """A persistent cache of LLM generations, stored in SQLite.
+
+    Entries are evicted once they are older than max_age, and the least
+    recently used entries are evicted once there are more than max_size.
+
+    Args:
+        path (str, optional): Path of the SQLite database. Defaults to ":memory:" (not persisted).
+        max_size (int, optional): Maximum number of generations to keep. Defaults to 1000.
+        max_age (float, optional): Seconds a generation stays valid. Defaults to None (never expires).
+    """
+
+    def __init__(self, path=":memory:", max_size=1000, max_age=None):
+        if path != ":memory:":
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_size = max_size
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS generations "
+            "(key TEXT PRIMARY KEY, value TEXT, created_at REAL, used_at REAL)"
+        )
+        self._connection.commit()
+
+    @staticmethod
+    def key(prompt, model):
+        """Get the cache key of a prompt and model.
+
+        Args:
+            prompt (str): The composed prompt.
+            model (str): The model the prompt is sent to.
+
+        Returns:
+            str: A hex digest identifying the prompt and model.
+        """
+        return hashlib.sha256("{}\0{}".format(model, prompt).encode()).hexdigest()
+
+    def get(self, key):
+        """Get a generation, marking it as recently used.
+
+        Args:
+            key (str): The key of the generation.
+
+        Returns:
+            The generation, or None if it is missing or expired.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value, created_at FROM generations WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and self.max_age is not None:
+                if now - row[1] >= self.max_age:
+                    self._connection.execute(
+                        "DELETE FROM generations WHERE key = ?", (key,)
+                    )
+                    self._connection.commit()
+                    row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._connection.execute(
+                "UPDATE generations SET used_at = ? WHERE key = ?", (now, key)
+            )
+            self._connection.commit()
+            self.hits += 1
+            return json.loads(row[0])
+
+    def set(self, key, value):
+        """Store a generation and evict old or excess entries.
+
+        Args:
+            key (str): The key of the generation.
+            value: The generation, which must be JSON serializable.
+        """
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO generations VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now, now),
+            )
+            if self.max_age is not None:
+                self._connection.execute(
+                    "DELETE FROM generations WHERE created_at <= ?",
+                    (now - self.max_age,),
+                )
+            self._connection.execute(
+                "DELETE FROM generations WHERE key IN "
+                "(SELECT key FROM generations ORDER BY used_at DESC, rowid DESC LIMIT -1 OFFSET ?)",
+                (self.max_size,),
+            )
+            self._connection.commit()
+
+    def clear(self):
+        """Remove every generation from the cache."""
+        with self._lock:
+            self._connection.execute("DELETE FROM generations")
+            self._connection.commit()
+
+    def stats(self):
+        """Get hit, miss and size counters for the cache.
+
+        Returns:
+            dict: A dict with "hits", "misses" and "size" keys.
+        """
+        with self._lock:
+            size = self._connection.execute(
+                "SELECT COUNT(*) FROM generations"
+            ).fetchone()[0]
+            return {"hits": self.hits, "misses": self.misses, "size": size}
+
+    def close(self):
+        """Close the underlying database."""
+        with self._lock:
+            self._connection.close()
+
+
+class EmbeddingCache:
+    """Embeddings keyed by a hash of their text and the model that made them.
+
+    Recently used embeddings are kept in an LRU. With a path, every
+    embedding is also appended to a float32 file read through a numpy
+    memory map, so embeddings survive restarts and a lookup only reads its
+    own row.
+
+    Args:
+        max_size (int, optional): Maximum number of embeddings to keep in memory. Defaults to 1024.
+        path (str, optional): Path of the embedding file. The keys are kept at path + ".idx".
+            Defaults to None (memory only).
+    """
+
+    def __init__(self, max_size=1024, path=None):
+        self.hits = 0
+        self.misses = 0
+        self._memory = LRUCache(max_size=max_size)
+        self._disk = _EmbeddingFile(path) if path is not None else None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(text, model=""):
+        """Get the cache key of a text and embedding model.
+
+        Args:
+            text (str): The embedded text.
+            model (str, optional): The name of the embedding model. Defaults to "".
+
+        Returns:
+            str: A hex digest identifying the text and model.
+        """
+        return hashlib.sha256("{}\0{}".format(model, text).encode()).hexdigest()
+
+    def get(self, key):
+        """Get an embedding, from memory or from the embedding file.
+
+        Args:
+            key (str): The key of the embedding.
+
+        Returns:
+            list or None: The embedding, or None if it isn't cached.
+        """
+        embedding = self._memory.get(key)
+        if embedding is None and self._disk is not None:
+            embedding = self._disk.get(key)
+            if embedding is not None:
+                self._memory.set(key, embedding)
+        with self._lock:
+            if embedding is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return embedding
+
+    def set(self, key, embedding):
+        """Store an embedding.
+
+        Args:
+            key (str): The key of the embedding.
+            embedding (list): The embedding.
+        """
+        embedding = [float(x) for x in embedding]
+        self._memory.set(key, embedding)
+        if self._disk is not None:
+            self._disk.append(key, embedding)
+
+    def clear(self):
+        """Remove every embedding from memory. The embedding file is kept."""
+        self._memory.clear()
+
+    def stats(self):
+        """Get hit, miss and size counters for the cache.
+
+        Returns:
+            dict: A dict with "hits", "misses", "hit_rate", "size" and "disk_size" keys.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups > 0 else 0.0,
+                "size": len(self._memory),
+                "disk_size": len(self._disk) if self._disk is not None else 0,
+            }
+
+
+class _EmbeddingFile:
+    """An append-only file of float32 embeddings, read through a memory map.
+
+    Rows all have the length of the first embedding stored; embeddings of
+    another length are only kept in memory.
+    """
+
+    def __init__(self, path):
+        # numpy comes with agentmemory's vector store, and is only needed
+        # when embeddings are kept on disk
+        import numpy
+
+        self._numpy = numpy
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.index_path = path + ".idx"
+        self.dimensions = None
+        self._rows = {}
+        self._map = None
+        self._lock = threading.Lock()
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as file:
+                lines = [line.strip() for line in file if line.strip()]
+            if len(lines) > 0:
+                self.dimensions = int(lines[0])
+                for key in lines[1:]:
+                    self._rows[key] = len(self._rows)
+
+    def get(self, key):
+        with self._lock:
+            row = self._rows.get(key)
+            if row is None:
+                return None
+            if self._map is None or row >= self._map.shape[0]:
+                self._map = self._numpy.memmap(
+                    self.path,
+                    dtype=self._numpy.float32,
+                    mode="r",
+                    shape=(len(self._rows), self.dimensions),
+                )
+            return [float(x) for x in self._map[row]]
+
+    def append(self, key, embedding):
+        with self._lock:
+            if key in self._rows:
+                return
+            if self.dimensions is None:
+                self.dimensions = len(embedding)
+                with open(self.index_path, "w") as file:
+                    file.write("{}\n".format(self.dimensions))
+            if len(embedding) != self.dimensions:
+                return
+            row_size = self.dimensions * 4
+            data = self._numpy.asarray(embedding, dtype=self._numpy.float32).tobytes()
+            # rows are written at the offset the index expects, so a row left
+            # over from a crash before its key was written is overwritten
+            mode = "r+b" if os.path.exists(self.path) else "wb"
+            with open(self.path, mode) as file:
+                file.seek(len(self._rows) * row_size)
+                file.write(data)
+                file.truncate()
+            with open(self.index_path, "a") as file:
+                file.write(key + "\n")
+            self._rows[key] = len(self._rows)
+
+    def __len__(self):
+        return len(self._rows)
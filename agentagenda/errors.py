@@ -0,0 +1,14 @@
+class TaskConflictError(Exception):
+    """Raised when a task was changed by someone else since it was read.
+
+    Args:
+        task_ids (list): The ids of the tasks whose stored version didn't match.
+    """
+
+    def __init__(self, task_ids):
+        self.task_ids = list(task_ids)
+        super().__init__(
+            "Tasks were changed since they were read: {}".format(
+                ", ".join(self.task_ids)
+            )
+        )
@@ -0,0 +1,141 @@
+class TaskFilter:
+    """A compound filter over tasks, applied in a single query.
+
+    Every condition that is set has to hold. Statuses, time ranges and
+    has_incomplete_steps are turned into one where filter that the task
+    store evaluates; goal_prefix can't be expressed in the agentmemory
+    (chroma) where syntax, so it is checked on the tasks the store returns.
+
+    Args:
+        status (str or list, optional): Only match tasks with this status, or any of these statuses.
+            Defaults to None (any status).
+        created_since (float, optional): Only match tasks created at or after this timestamp. Defaults to None.
+        created_before (float, optional): Only match tasks created before this timestamp. Defaults to None.
+        updated_since (float, optional): Only match tasks updated at or after this timestamp. Defaults to None.
+        updated_before (float, optional): Only match tasks updated before this timestamp. Defaults to None.
+        has_incomplete_steps (bool, optional): Only match tasks that have (True) or don't have (False) a step left
+            to do, going by their step cursor. Defaults to None (either).
+        goal_prefix (str, optional): Only match tasks whose goal starts with this text. Defaults to None.
+    """
+
+    def __init__(
+        self,
+        status=None,
+        created_since=None,
+        created_before=None,
+        updated_since=None,
+        updated_before=None,
+        has_incomplete_steps=None,
+        goal_prefix=None,
+    ):
+        if isinstance(status, str):
+            status = [status]
+        self.statuses = list(dict.fromkeys(status)) if status is not None else None
+        self.ranges = {
+            "created_at": (created_since, created_before),
+            "updated_at": (updated_since, updated_before),
+        }
+        self.has_incomplete_steps = has_incomplete_steps
+        self.goal_prefix = goal_prefix
+
+    def with_status(self, status):
+        """Get a copy of the filter with the given status, if it doesn't set one itself.
+
+        Args:
+            status (str or list): The status or statuses to fall back to, or None for any status.
+
+        Returns:
+            TaskFilter: The filter, or a copy of it matching status.
+        """
+        if self.statuses is not None or status is None:
+            return self
+        task_filter = TaskFilter(
+            status=status,
+            has_incomplete_steps=self.has_incomplete_steps,
+            goal_prefix=self.goal_prefix,
+        )
+        task_filter.ranges = dict(self.ranges)
+        return task_filter
+
+    def bounds(self, by):
+        """Get the (since, before) range on a timestamp, either end None if open.
+
+        Args:
+            by (str): "created_at" or "updated_at".
+
+        Returns:
+            tuple: The range.
+        """
+        return self.ranges[by]
+
+    @property
+    def has_residual(self):
+        """bool: Whether some condition is checked after the store query."""
+        return self.goal_prefix is not None
+
+    def where(self):
+        """Get the where filter the task store evaluates.
+
+        Returns:
+            dict or None: The filter, or None if no store side condition is set.
+        """
+        clauses = []
+        if self.statuses is not None:
+            if len(self.statuses) == 1:
+                clauses.append({"status": self.statuses[0]})
+            else:
+                clauses.append({"status": {"$in": self.statuses}})
+        for key, (since, before) in self.ranges.items():
+            if since is not None:
+                clauses.append({key: {"$gte": float(since)}})
+            if before is not None:
+                clauses.append({key: {"$lt": float(before)}})
+        if self.has_incomplete_steps is not None:
+            operator = "$gte" if self.has_incomplete_steps else "$lt"
+            clauses.append({"next_step_index": {operator: 0}})
+        if len(clauses) == 0:
+            return None
+        if len(clauses) == 1:
+            return clauses[0]
+        return {"$and": clauses}
+
+    def matches(self, memory):
+        """Check every condition against a task.
+
+        Args:
+            memory (dict or Task): The task.
+
+        Returns:
+            bool: Whether the task matches.
+        """
+        metadata = memory["metadata"]
+        if self.statuses is not None and metadata.get("status") not in self.statuses:
+            return False
+        for key, (since, before) in self.ranges.items():
+            if since is None and before is None:
+                continue
+            if key not in metadata:
+                return False
+            value = float(metadata[key])
+            if since is not None and value < float(since):
+                return False
+            if before is not None and value >= float(before):
+                return False
+        if self.has_incomplete_steps is not None:
+            if "next_step_index" not in metadata:
+                return False
+            if (int(metadata["next_step_index"]) >= 0) != self.has_incomplete_steps:
+                return False
+        if self.goal_prefix is not None:
+            goal = metadata.get("goal", memory.get("document")) or ""
+            if not goal.startswith(self.goal_prefix):
+                return False
+        return True
+
+    def __repr__(self):
+        return (
+            "TaskFilter(statuses={!r}, ranges={!r}, has_incomplete_steps={!r}, "
+            "goal_prefix={!r})".format(
+                self.statuses, self.ranges, self.has_incomplete_steps, self.goal_prefix
+            )
+        )
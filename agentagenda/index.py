@@ -0,0 +1,369 @@
+from bisect import bisect_left, bisect_right, insort
+from collections import Counter
+import heapq
+import math
+import re
+import threading
+
+
+class RecencyIndex:
+    """Task ids kept sorted by their created_at and updated_at timestamps.
+
+    Tasks indexed with a status are also kept sorted per status, so a walk
+    over some statuses doesn't pass the tasks of the others.
+    """
+
+    def __init__(self):
+        self._sorted = {"created_at": [], "updated_at": []}
+        self._by_status = {}
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def update(self, task_id, created_at, updated_at, status=None):
+        """Add a task to the index, or move it if its timestamps or status changed.
+
+        Args:
+            task_id (str): The id of the task.
+            created_at (float): When the task was created.
+            updated_at (float): When the task was last updated.
+            status (str, optional): The status of the task. Defaults to None.
+        """
+        entry = {
+            "created_at": float(created_at),
+            "updated_at": float(updated_at),
+            "status": status,
+        }
+        with self._lock:
+            previous = self._entries.get(task_id)
+            if previous == entry:
+                return
+            if previous is not None:
+                self._remove(task_id, previous)
+            self._entries[task_id] = entry
+            for key, keys in self._lists(status):
+                insort(keys, (entry[key], task_id))
+
+    def _lists(self, status):
+        lists = list(self._sorted.items())
+        if status is not None:
+            if status not in self._by_status:
+                self._by_status[status] = {"created_at": [], "updated_at": []}
+            lists.extend(self._by_status[status].items())
+        return lists
+
+    def remove(self, task_id):
+        """Remove a task from the index.
+
+        Args:
+            task_id (str): The id of the task.
+        """
+        with self._lock:
+            previous = self._entries.pop(task_id, None)
+            if previous is not None:
+                self._remove(task_id, previous)
+
+    def _remove(self, task_id, entry):
+        for key, keys in self._lists(entry["status"]):
+            position = bisect_left(keys, (entry[key], task_id))
+            if position < len(keys) and keys[position] == (entry[key], task_id):
+                del keys[position]
+
+    def latest(self, n=1, by="updated_at"):
+        """Get the ids of the most recent tasks.
+
+        Args:
+            n (int, optional): How many ids to return. Defaults to 1.
+            by (str, optional): "created_at" or "updated_at". Defaults to "updated_at".
+
+        Returns:
+            list: Up to n task ids, newest first.
+        """
+        with self._lock:
+            keys = self._sorted[by]
+            return [task_id for _, task_id in reversed(keys[max(len(keys) - n, 0) :])]
+
+    def since(self, timestamp, by="updated_at"):
+        """Get the ids of tasks with a timestamp after the given one.
+
+        Args:
+            timestamp (float): The timestamp to compare against.
+            by (str, optional): "created_at" or "updated_at". Defaults to "updated_at".
+
+        Returns:
+            list: The task ids, newest first.
+        """
+        with self._lock:
+            keys = self._sorted[by]
+            position = bisect_right(keys, (float(timestamp), "\uffff"))
+            return [task_id for _, task_id in reversed(keys[position:])]
+
+    def position(self, task_id, by="updated_at"):
+        """Get the position of a task in the index.
+
+        Args:
+            task_id (str): The id of the task.
+            by (str, optional): "created_at" or "updated_at". Defaults to "updated_at".
+
+        Returns:
+            tuple or None: The (timestamp, task_id) of the task, or None if it isn't indexed.
+        """
+        entry = self._entries.get(task_id)
+        return (entry[by], task_id) if entry is not None else None
+
+    def pages(
+        self, by="updated_at", after=None, descending=True, page_size=100, statuses=None
+    ):
+        """Walk the task ids in order, a page at a time.
+
+        Each page is taken under the lock, so tasks written between pages
+        are neither skipped nor repeated unless their timestamp moved.
+
+        Args:
+            by (str, optional): "created_at" or "updated_at". Defaults to "updated_at".
+            after (tuple, optional): A (timestamp, task_id) position to start after. Defaults to None (the start).
+            descending (bool, optional): Walk newest first. Defaults to True.
+            page_size (int, optional): How many ids to yield at once. Defaults to 100.
+            statuses (list, optional): Only walk the tasks indexed with these statuses. Defaults to None (every task).
+
+        Yields:
+            list: The next page of task ids.
+        """
+        position = (float(after[0]), after[1]) if after is not None else None
+        while True:
+            with self._lock:
+                if statuses is None:
+                    lists = [self._sorted[by]]
+                else:
+                    lists = [
+                        self._by_status[status][by]
+                        for status in statuses
+                        if status in self._by_status
+                    ]
+                page = []
+                for keys in lists:
+                    if descending:
+                        end = len(keys) if position is None else bisect_left(keys, position)
+                        page.extend(keys[max(end - page_size, 0) : end])
+                    else:
+                        start = 0 if position is None else bisect_right(keys, position)
+                        page.extend(keys[start : start + page_size])
+                page.sort(reverse=descending)
+                page = page[:page_size]
+            if len(page) == 0:
+                return
+            yield [task_id for _, task_id in page]
+            position = page[-1]
+
+    def __contains__(self, task_id):
+        return task_id in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def tokenize(text):
+    """Split text into lowercased words.
+
+    Words joined by dots or dashes, such as "v2.3.1" or "jira-123", are kept
+    whole as well as split, so identifiers match exactly.
+
+    Args:
+        text (str): The text to split.
+
+    Returns:
+        list: The words, in order.
+    """
+    tokens = []
+    for word in re.findall(r"\w+(?:[-.]\w+)*", text.lower()):
+        tokens.append(word)
+        if "-" in word or "." in word:
+            tokens.extend(re.findall(r"\w+", word))
+    return tokens
+
+
+class KeywordIndex:
+    """An inverted index over the goal, plan and step text of tasks.
+
+    Tasks are scored against a query with BM25, counting goal words twice as
+    much as plan and step words. Each field can be replaced as a whole, and
+    the steps field can also be changed one step at a time.
+
+    Args:
+        weights (dict, optional): How much each field counts. Defaults to goal 2, plan 1, steps 1.
+    """
+
+    k1 = 1.2
+    b = 0.75
+
+    def __init__(self, weights=None):
+        self.weights = weights or {"goal": 2.0, "plan": 1.0, "steps": 1.0}
+        self._fields = {}
+        self._lengths = {}
+        self._statuses = {}
+        self._stamps = {}
+        self._postings = {}
+        self._total_length = 0.0
+        self._lock = threading.Lock()
+
+    def _apply(self, task_id, counts, sign):
+        """Add or subtract weighted word counts of a task from the postings."""
+        for term, count in counts.items():
+            postings = self._postings.setdefault(term, {})
+            weight = postings.get(task_id, 0.0) + sign * count
+            if weight > 1e-9:
+                postings[task_id] = weight
+            else:
+                postings.pop(task_id, None)
+                if len(postings) == 0:
+                    del self._postings[term]
+        change = sign * sum(counts.values())
+        self._lengths[task_id] = self._lengths.get(task_id, 0.0) + change
+        self._total_length += change
+
+    def _weighted(self, field, counts):
+        weight = self.weights.get(field, 1.0)
+        return {term: weight * count for term, count in counts.items()}
+
+    def update(self, task_id, status=None, stamp=None, **fields):
+        """Add a task, or replace some of its fields.
+
+        Fields whose text didn't change since the last update are skipped
+        without being tokenized again.
+
+        Args:
+            task_id (str): The id of the task.
+            status (str, optional): The task's status. Defaults to None (unchanged).
+            stamp (tuple, optional): A value that changes whenever the task is written, such as its version and
+                updated_at, checked by is_current. Defaults to None.
+            **fields (str): The new text of fields such as goal, plan and steps.
+        """
+        with self._lock:
+            task_fields = self._fields.setdefault(task_id, {})
+            self._lengths.setdefault(task_id, 0.0)
+            if status is not None:
+                self._statuses[task_id] = status
+            if stamp is not None:
+                self._stamps[task_id] = stamp
+            for field, text in fields.items():
+                if text is None:
+                    continue
+                previous = task_fields.get(field)
+                if previous is not None and previous[0] == text:
+                    continue
+                if previous is not None:
+                    self._apply(task_id, self._weighted(field, previous[1]), -1)
+                counts = Counter(tokenize(text))
+                self._apply(task_id, self._weighted(field, counts), 1)
+                task_fields[field] = (text, counts)
+
+    def is_current(self, task_id, stamp):
+        """Check whether a task was last updated with the given stamp.
+
+        Args:
+            task_id (str): The id of the task.
+            stamp (tuple): The stamp of the task as read.
+
+        Returns:
+            bool: Whether the index already holds this version of the task.
+        """
+        with self._lock:
+            return task_id in self._fields and self._stamps.get(task_id) == stamp
+
+    def add_text(self, task_id, field, text):
+        """Add text, such as a new step, to a field of a task.
+
+        Args:
+            task_id (str): The id of the task.
+            field (str): The field, such as "steps".
+            text (str): The text to add.
+        """
+        self._change_text(task_id, field, text, 1)
+
+    def remove_text(self, task_id, field, text):
+        """Remove text, such as a cancelled step, from a field of a task.
+
+        Args:
+            task_id (str): The id of the task.
+            field (str): The field, such as "steps".
+            text (str): The text to remove.
+        """
+        self._change_text(task_id, field, text, -1)
+
+    def _change_text(self, task_id, field, text, sign):
+        with self._lock:
+            task_fields = self._fields.setdefault(task_id, {})
+            self._lengths.setdefault(task_id, 0.0)
+            _, counts = task_fields.get(field, (None, Counter()))
+            delta = Counter(tokenize(text))
+            if sign < 0:
+                delta = delta & counts
+            self._apply(task_id, self._weighted(field, delta), sign)
+            counts = counts + delta if sign > 0 else counts - delta
+            # the field no longer matches any full text passed to update
+            task_fields[field] = (None, counts)
+
+    def set_status(self, task_id, status):
+        """Record the status of an indexed task.
+
+        Args:
+            task_id (str): The id of the task.
+            status (str): The task's status.
+        """
+        with self._lock:
+            if task_id in self._fields:
+                self._statuses[task_id] = status
+
+    def remove(self, task_id):
+        """Remove a task from the index.
+
+        Args:
+            task_id (str): The id of the task.
+        """
+        with self._lock:
+            task_fields = self._fields.pop(task_id, None)
+            if task_fields is None:
+                return
+            for field, (_, counts) in task_fields.items():
+                self._apply(task_id, self._weighted(field, counts), -1)
+            self._total_length -= self._lengths.pop(task_id, 0.0)
+            self._statuses.pop(task_id, None)
+            self._stamps.pop(task_id, None)
+
+    def search(self, query, n_results=5, statuses=None):
+        """Score tasks against the words of a query.
+
+        Args:
+            query (str): The text to search for.
+            n_results (int, optional): The maximum number of tasks to return. Defaults to 5.
+            statuses (list, optional): Only return tasks with these statuses. Defaults to None (any status).
+
+        Returns:
+            list: (task_id, score) pairs, best first. Tasks sharing no word with the query are left out.
+        """
+        with self._lock:
+            count = len(self._fields)
+            if count == 0:
+                return []
+            average_length = max(self._total_length / count, 1e-9)
+            scores = {}
+            for term in set(tokenize(query)):
+                postings = self._postings.get(term)
+                if postings is None:
+                    continue
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for task_id, weight in postings.items():
+                    if statuses is not None and self._statuses.get(task_id) not in statuses:
+                        continue
+                    norm = 1 - self.b + self.b * self._lengths[task_id] / average_length
+                    scores[task_id] = scores.get(task_id, 0.0) + idf * weight * (
+                        self.k1 + 1
+                    ) / (weight + self.k1 * norm)
+        return heapq.nlargest(
+            n_results, scores.items(), key=lambda item: (item[1], item[0])
+        )
+
+    def __contains__(self, task_id):
+        return task_id in self._fields
+
+    def __len__(self):
+        return len(self._fields)
@@ -1,29 +1,46 @@
+from contextlib import contextmanager
 from datetime import datetime
+import functools
+import itertools
 import json
 import os
+import threading
+import uuid
 from easycompletion import (
     openai_text_call,
     openai_function_call,
     compose_function,
     compose_prompt,
 )
-from agentmemory import (
-    create_memory,
-    get_memory,
-    search_memory,
-    get_memories,
-    delete_memory,
-    update_memory,
-)
 
 from agentlogger import log
 
+from .archive import TaskArchive
+from .cache import LRUCache, GenerationCache, EmbeddingCache
+from .errors import TaskConflictError
+from .filters import TaskFilter
+from .index import RecencyIndex, KeywordIndex
+from .scheduler import TaskScheduler
+from .steps import Step, StepIndex
+from .store import AgentMemoryStore
+from .task import Task
+from .transaction import TaskTransaction
+
 planning_prompt = """\
 {{goal}}
 Based on the goal, generate a step-by-step plan for completing the task. Include all detail, including what resources need to be collected, what outputs need to be generated and what the conditions for knowing the task is complete are.
 Be very thorough in your plan.
 """
 
+planning_example_prompt = """\
+{{goal}}
+Here is the plan that was used for a similar task before:
+{{example_plan}}
+
+Based on the goal and the example plan, generate a step-by-step plan for completing the task. Include all detail, including what resources need to be collected, what outputs need to be generated and what the conditions for knowing the task is complete are.
+Be very thorough in your plan.
+"""
+
 step_creation_prompt = """\
 Client's goal
 {{goal}}
@@ -34,6 +51,23 @@ My plan
 Based on the goal and plan, generate a series of steps.
 """
 
+plan_and_steps_prompt = """\
+{{goal}}
+Based on the goal, generate a step-by-step plan for completing the task. Include all detail, including what resources need to be collected, what outputs need to be generated and what the conditions for knowing the task is complete are.
+Be very thorough in your plan.
+Then, based on the goal and plan, generate a series of steps.
+"""
+
+plan_and_steps_example_prompt = """\
+{{goal}}
+Here is the plan that was used for a similar task before:
+{{example_plan}}
+
+Based on the goal and the example plan, generate a step-by-step plan for completing the task. Include all detail, including what resources need to be collected, what outputs need to be generated and what the conditions for knowing the task is complete are.
+Be very thorough in your plan.
+Then, based on the goal and plan, generate a series of steps.
+"""
+
 step_creation_function = compose_function(
     name="create_steps",
     description="Based on the plan, create a list of steps to complete the task.",
@@ -50,34 +84,1288 @@ step_creation_function = compose_function(
     },
 )
 
+plan_and_steps_function = compose_function(
+    name="create_plan_and_steps",
+    description="Create a plan for the goal and a list of steps to complete it.",
+    required_properties=["plan", "steps"],
+    properties={
+        "plan": {
+            "type": "string",
+            "description": "The step-by-step plan for completing the task.",
+        },
+        "steps": {
+            "type": "array",
+            "description": "Array of steps to complete the task, based on the plan.",
+            "items": {
+                "type": "string",
+                "description": "The text of the single step.",
+            },
+        },
+    },
+)
+
 debug = os.environ.get("DEBUG", False)
 
+# tasks, step records and the current task pointer are kept in a TaskStore,
+# agentmemory's vector store unless set_task_store picks another one
+_task_store = AgentMemoryStore()
 
-def create_task(goal, plan=None, steps=None, model="gpt-3.5-turbo-0613"):
-    """Create a task and store it in memory.
+
+def set_task_store(store):
+    """Keep tasks in a different storage backend.
+
+    InMemoryStore keeps tasks in process memory, and SQLiteStore keeps them
+    in an indexed SQLite database where status, id and time lookups don't go
+    through a vector store; both only embed goals when search_tasks needs
+    them. Tasks are not copied from the previous store, and the caches and
+    indexes built from it are dropped.
 
     Args:
-        goal (str): The goal of the task.
-        plan (str, optional): A plan to accomplish the task. Defaults to None.
-        steps (list or dict, optional): Steps needed to complete the task. Defaults to None.
-        model (str, optional): The OpenAI model to use for AI operations. Defaults to 'gpt-3.5-turbo-0613'.
+        store (TaskStore): The store to use, such as SQLiteStore().
 
     Returns:
-        None
+        TaskStore: The store.
+    """
+    global _task_store, _recency_index, _scheduler, _keyword_index
+    _task_store = store
+    with _recency_index_lock:
+        _recency_index = None
+    with _keyword_index_lock:
+        _keyword_index = None
+    with _scheduler_lock:
+        _scheduler = None
+    invalidate_task_cache()
+    _step_index_cache.clear()
+    if _render_cache is not None:
+        _render_cache.clear()
+        _step_line_cache.clear()
+    return store
+
+
+def get_task_store():
+    """Get the storage backend tasks are kept in.
+
+    Returns:
+        TaskStore: The store.
+    """
+    return _task_store
+
+
+def get_embedding_stats():
+    """Get how many embeddings the task store has computed.
+
+    Writes that only change metadata, such as finishing a task or a step,
+    don't embed anything, so these counters only grow when goals are
+    created or searched.
+
+    Returns:
+        dict: The number of embeddings computed by each store operation, such as "upsert" and "search",
+            and their "total".
+    """
+    return _task_store.get_embedding_stats()
+
+
+def reset_embedding_stats():
+    """Set the task store's embedding counters back to zero."""
+    _task_store.reset_embedding_stats()
+
+
+# tasks live in the "task" category by default; with status partitions
+# enabled, each status has a category of its own, such as "task_complete"
+task_statuses = ("in_progress", "complete", "cancelled")
+_use_status_partitions = False
+
+
+def enable_status_partitions():
+    """Store tasks in a category per status.
+
+    In-progress, complete and cancelled tasks are kept in the
+    "task_in_progress", "task_complete" and "task_cancelled" categories, so
+    queries for active tasks don't scan finished ones. Finishing or
+    cancelling a task moves it to its new category. Run
+    migrate_to_status_partitions once to move existing tasks out of the
+    "task" category.
+    """
+    global _use_status_partitions
+    _use_status_partitions = True
+
+
+def disable_status_partitions():
+    """Store every task in the "task" category."""
+    global _use_status_partitions
+    _use_status_partitions = False
+
+
+def _task_category(status):
+    """Get the category that holds tasks with the given status."""
+    if not _use_status_partitions:
+        return "task"
+    return "task_{}".format(status)
+
+
+def _task_categories(status=None):
+    """Get the categories to read for a status, or for every status."""
+    if not _use_status_partitions:
+        return ["task"]
+    if status is not None:
+        return [_task_category(status)]
+    return [_task_category(status) for status in task_statuses]
+
+
+def _filter_categories(task_filter):
+    """Get the categories to read for the statuses a filter matches."""
+    if task_filter.statuses is None:
+        return _task_categories()
+    return list(dict.fromkeys(_task_category(s) for s in task_filter.statuses))
+
+
+def migrate_to_status_partitions(chunk_size=100):
+    """Move the tasks in the "task" category to their status categories.
+
+    Tasks are moved a chunk at a time along with their embeddings, so no
+    goal is embedded again. Each task is written to its new category before
+    it is deleted from the old one.
+
+    Args:
+        chunk_size (int, optional): How many tasks to move at once. Defaults to 100.
+
+    Returns:
+        int: The number of tasks moved.
+    """
+    moved = 0
+    while True:
+        memories = _task_store.get("task", limit=chunk_size, include_embeddings=True)
+        if len(memories) == 0:
+            break
+        groups = {}
+        for memory in memories:
+            status = memory["metadata"].get("status", "in_progress")
+            groups.setdefault("task_{}".format(status), []).append(memory)
+        for category, group in groups.items():
+            _copy_task_records(group, category)
+        _task_store.delete("task", ids=[memory["id"] for memory in memories])
+        moved += len(memories)
+    log("Moved {} tasks to status categories".format(moved), log=debug)
+    return moved
+
+
+def _copy_task_records(memories, category):
+    """Upsert tasks into a category, reusing their embeddings if present."""
+    _task_store.upsert(
+        category,
+        ids=[memory["id"] for memory in memories],
+        documents=[memory["document"] for memory in memories],
+        metadatas=[memory["metadata"] for memory in memories],
+        embeddings=[memory.get("embedding") for memory in memories],
+    )
+
+
+def _move_tasks(moves):
+    """Write tasks whose status changed, moving them to their new category.
+
+    Args:
+        moves (list): (task, previous status) pairs, with the task's metadata already updated.
+    """
+    groups = {}
+    unmoved = []
+    for memory, previous_status in moves:
+        source = _task_category(previous_status)
+        target = _task_category(memory["metadata"]["status"])
+        if source == target:
+            unmoved.append(memory)
+        else:
+            groups.setdefault((source, target), []).append((memory, previous_status))
+    # the tasks are claimed in their old category with their old status, so
+    # a move interrupted after the claim is still moved when repeated
+    for (source, target), pairs in list(groups.items()):
+        _claim_versions(
+            [memory for memory, _ in pairs],
+            category=source,
+            metadatas=[
+                dict(memory["metadata"], status=previous_status)
+                for memory, previous_status in pairs
+            ],
+        )
+        groups[(source, target)] = [memory for memory, _ in pairs]
+    _write_tasks(unmoved)
+
+    for (source, target), memories in groups.items():
+        ids = [memory["id"] for memory in memories]
+        embeddings = {
+            stored["id"]: stored["embedding"]
+            for stored in _task_store.get(source, ids=ids, include_embeddings=True)
+        }
+        for memory in memories:
+            memory["embedding"] = embeddings.get(memory["id"])
+        # write before deleting, so an interrupted move leaves a copy in the
+        # old category rather than losing the task; moving it again repairs it
+        _copy_task_records(memories, target)
+        _task_store.delete(source, ids=ids)
+        for memory in memories:
+            memory.pop("embedding", None)
+            if _task_cache is not None:
+                _task_cache.set(memory["id"], _copy_task(memory))
+            _index_task(memory)
+
+
+# in-process task cache, disabled until enable_task_cache is called
+_task_cache = None
+
+
+def enable_task_cache(max_size=1024, ttl=None):
+    """Enable the in-process task cache.
+
+    Tasks are kept in a bounded LRU keyed by task id. Every function in this
+    module that writes a task updates the cache as well, so reads of a task
+    this process wrote don't go back to the task store. When several processes
+    share the same store, set a ttl so stale entries expire.
+
+    Args:
+        max_size (int, optional): Maximum number of tasks to cache. Defaults to 1024.
+        ttl (float, optional): Seconds before a cached task is re-read. Defaults to None (never).
+
+    Returns:
+        LRUCache: The task cache.
+    """
+    global _task_cache
+    _task_cache = LRUCache(max_size=max_size, ttl=ttl)
+    return _task_cache
+
+
+def disable_task_cache():
+    """Disable the in-process task cache and drop its contents."""
+    global _task_cache
+    _task_cache = None
+
+
+def invalidate_task_cache(task=None):
+    """Drop a task, or every task, from the in-process task cache.
+
+    Args:
+        task (dict or int or str, optional): The task to invalidate. Defaults to None (all tasks).
+    """
+    if _task_cache is None:
+        return
+    if task is None:
+        _task_cache.clear()
+    else:
+        _task_cache.delete(get_task_id(task))
+
+
+def _copy_task(memory):
+    # copy the metadata so callers mutating a task don't mutate the cache
+    return dict(memory, metadata=dict(memory["metadata"]))
+
+
+def _read_task(task_id):
+    """Read a task from the cache, falling back to the task store."""
+    if _task_cache is not None:
+        memory = _task_cache.get(task_id)
+        if memory is not None:
+            return _copy_task(memory)
+    memory = None
+    for category in _task_categories():
+        memories = _task_store.get(category, ids=[task_id])
+        if len(memories) > 0:
+            memory = memories[0]
+            break
+    if memory is not None and _task_cache is not None:
+        _task_cache.set(task_id, _copy_task(memory))
+    if memory is not None:
+        _index_task(memory)
+    return memory
+
+
+def _whole_task(task):
+    """Get the whole task behind a Task view that keeps only some fields.
+
+    Raises ValueError if the task no longer exists.
+    """
+    if not isinstance(task, Task) or task.fields is None:
+        return task
+    memory = _read_task(task.id)
+    if memory is None:
+        raise ValueError("Task not found: {}".format(task.id))
+    return memory
+
+
+def _write_task(memory):
+    """Write a task's metadata to the task store and through to the cache.
+
+    Returns the task as written, with its new version. Raises
+    TaskConflictError if the task was written since it was read.
+    """
+    memory["metadata"]["updated_at"] = datetime.timestamp(datetime.now())
+    _claim_versions([memory])
+    if _task_cache is not None:
+        _task_cache.set(memory["id"], _copy_task(memory))
+    _index_task(memory)
+    return memory
+
+
+# every task carries a "version" that each write checks and bumps in one
+# conditional update, so a write based on a stale read fails instead of
+# undoing another write.
+# Writers in this process are serialized per task, so conflicts only come
+# from other processes or from a stale task cache
+_task_locks = [threading.RLock() for _ in range(64)]
+_conflict_retries = 3
+
+
+def _task_lock(task_id):
+    """Get the lock serializing writes to a task in this process."""
+    return _task_locks[hash(str(task_id)) % len(_task_locks)]
+
+
+def _claim_versions(memories, category=None, metadatas=None):
+    """Write tasks' metadata with bumped versions if the stored versions still match.
+
+    The check and the write are a single conditional update in the task
+    store, all or nothing for the tasks of each category. metadatas, if
+    given, is written in place of the tasks' own metadata.
+
+    Raises TaskConflictError if any stored version differs from the version
+    the task was read with; the tasks of that category are left unchanged.
+    """
+    if metadatas is None:
+        metadatas = [memory["metadata"] for memory in memories]
+    groups = {}
+    for memory, metadata in zip(memories, metadatas):
+        key = category or _task_category(memory["metadata"]["status"])
+        groups.setdefault(key, []).append((memory, metadata))
+    conflicts = []
+    for key, group in groups.items():
+        versions = [int(memory["metadata"].get("version", 0)) for memory, _ in group]
+        failed = _task_store.update_if_version(
+            key,
+            [memory["id"] for memory, _ in group],
+            [
+                dict(metadata, version=version + 1)
+                for (_, metadata), version in zip(group, versions)
+            ],
+            versions,
+        )
+        if len(failed) > 0:
+            conflicts.extend(failed)
+            continue
+        for (memory, _), version in zip(group, versions):
+            memory["metadata"]["version"] = version + 1
+    if len(conflicts) > 0:
+        raise TaskConflictError(conflicts)
+
+
+def _retry_on_conflict(function):
+    """Re-run a task mutator from a fresh read when its write conflicts.
+
+    Mutators of a single task also hold that task's lock while they run.
+    The first argument of the mutator is the task, or a list of tasks.
+    """
+
+    @functools.wraps(function)
+    def wrapper(task, *args, **kwargs):
+        for attempt in range(_conflict_retries + 1):
+            try:
+                if isinstance(task, list):
+                    return function(task, *args, **kwargs)
+                with _task_lock(get_task_id(task)):
+                    return function(task, *args, **kwargs)
+            except TaskConflictError as error:
+                if attempt == _conflict_retries:
+                    raise
+                log(
+                    "Retrying {} after a conflict: {}".format(function.__name__, error),
+                    log=debug,
+                )
+                for task_id in error.task_ids:
+                    invalidate_task_cache(task_id)
+
+    return wrapper
+
+
+@contextmanager
+def transaction(task):
+    """Make several plan and step changes to a task with a single write.
+
+    The task is read once, changed in memory through the TaskTransaction
+    and written when the with block ends. Nothing is written if the block
+    raises. Other writers in this process wait for the transaction to end;
+    if another process wrote the task meanwhile, TaskConflictError is raised
+    and nothing is written.
+
+        with transaction(task) as t:
+            t.finish_step("Prepare Bread")
+            t.add_step("Wash the dishes")
+
+    Args:
+        task (dict or int or str): The task to change.
+
+    Yields:
+        TaskTransaction: The transaction to make changes through.
+    """
+    task_id = get_task_id(task)
+    with _task_lock(task_id):
+        memory = _read_task(task_id)
+        if memory is None:
+            raise ValueError("Task not found: {}".format(task_id))
+        steps = _get_step_index(memory).copy_steps()
+        pending = TaskTransaction(memory, steps, records=_uses_step_records(memory))
+        yield pending
+        if pending.steps_changed:
+            _save_steps(
+                memory,
+                pending.steps,
+                changed=list(pending.changed.values()),
+                added=pending.added,
+                removed=pending.removed,
+            )
+        elif pending.dirty:
+            memory["metadata"]["updated_at"] = datetime.timestamp(datetime.now())
+            _write_task(memory)
+
+
+# task ids sorted by created_at and updated_at, built from one scan of the
+# task category the first time a recency lookup needs it
+_recency_index = None
+_recency_index_lock = threading.Lock()
+
+
+def _get_recency_index():
+    """Get the recency index, building it from the task category if needed."""
+    global _recency_index
+    with _recency_index_lock:
+        if _recency_index is None:
+            index = RecencyIndex()
+            memories = [
+                memory
+                for category in _task_categories()
+                for memory in _task_store.get(category)
+            ]
+            for memory in memories:
+                metadata = memory["metadata"]
+                index.update(
+                    memory["id"],
+                    metadata.get("created_at", 0),
+                    metadata.get("updated_at", 0),
+                    status=metadata.get("status"),
+                )
+            log("Built recency index of {} tasks".format(len(index)), log=debug)
+            _recency_index = index
+        return _recency_index
+
+
+def rebuild_recency_index():
+    """Rebuild the recency index from the task category.
+
+    The index is kept up to date by every function in this module that
+    writes a task. Call this after other processes have written to the
+    same store.
+
+    Returns:
+        RecencyIndex: The rebuilt index.
+    """
+    global _recency_index
+    with _recency_index_lock:
+        _recency_index = None
+    return _get_recency_index()
+
+
+def _index_task(memory):
+    """Update a task in the recency, keyword and scheduler indexes that have been built."""
+    if _scheduler is not None:
+        _schedule_task(_scheduler, memory)
+    if _keyword_index is not None:
+        # reads index tasks too, so tasks written by other processes are
+        # picked up; unchanged tasks are skipped without parsing their text
+        stamp = _keyword_stamp(memory)
+        if not _keyword_index.is_current(memory["id"], stamp):
+            _keyword_index.update(
+                memory["id"],
+                status=memory["metadata"].get("status"),
+                stamp=stamp,
+                **_keyword_fields(memory),
+            )
+    if _recency_index is None:
+        return
+    metadata = memory["metadata"]
+    _recency_index.update(
+        memory["id"],
+        metadata.get("created_at", 0),
+        metadata.get("updated_at", 0),
+        status=metadata.get("status"),
+    )
+
+
+def _unindex_task(task_id):
+    """Remove a task from the recency, keyword and scheduler indexes that have been built."""
+    if _scheduler is not None:
+        _scheduler.remove(task_id)
+    if _keyword_index is not None:
+        _keyword_index.remove(task_id)
+    if _recency_index is not None:
+        _recency_index.remove(task_id)
+
+
+# the words of every task's goal, plan and steps, built from one scan of the
+# task categories the first time a keyword search needs it
+_keyword_index = None
+_keyword_index_lock = threading.Lock()
+
+
+def _keyword_fields(memory):
+    """Get the text a task is keyword indexed by.
+
+    The steps of tasks with step records are left out, as their "steps" JSON
+    may be stale; their step records keep the index up to date instead.
     """
+    metadata = memory["metadata"]
+    fields = {
+        "goal": metadata.get("goal", memory.get("document")),
+        "plan": metadata.get("plan"),
+    }
+    if not _uses_step_records(memory) and "steps" in metadata:
+        fields["steps"] = "\n".join(
+            step.content for step in _parse_steps(metadata["steps"])
+        )
+    return fields
+
+
+def _keyword_stamp(memory):
+    """Get the (version, updated_at) pair that changes on every write of a task."""
+    metadata = memory["metadata"]
+    return (int(metadata.get("version", 0)), metadata.get("updated_at", 0))
+
+
+def _get_keyword_index():
+    """Get the keyword index, building it from the task categories if needed."""
+    global _keyword_index
+    with _keyword_index_lock:
+        if _keyword_index is None:
+            index = KeywordIndex()
+            for category in _task_categories():
+                for memory in _task_store.get(category):
+                    fields = _keyword_fields(memory)
+                    if _uses_step_records(memory):
+                        fields["steps"] = "\n".join(
+                            step.content for step in _load_steps(memory)
+                        )
+                    index.update(
+                        memory["id"],
+                        status=memory["metadata"].get("status"),
+                        stamp=_keyword_stamp(memory),
+                        **fields,
+                    )
+            log("Built keyword index of {} tasks".format(len(index)), log=debug)
+            _keyword_index = index
+        return _keyword_index
+
+
+def rebuild_keyword_index():
+    """Rebuild the keyword index from the task categories.
+
+    The index is kept up to date by every function in this module that
+    writes a task or its steps. Call this after other processes have written
+    to the same store.
+
+    Returns:
+        KeywordIndex: The rebuilt index.
+    """
+    global _keyword_index
+    with _keyword_index_lock:
+        _keyword_index = None
+    return _get_keyword_index()
+
+
+# in-progress tasks by priority, deadline and age, built from one scan of
+# the in-progress tasks the first time the scheduler is used
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def _schedule_fields(priority=0, deadline=None, depends_on=None):
+    """Build the scheduling metadata of a new task."""
+    fields = {"priority": priority}
+    if deadline is not None:
+        if isinstance(deadline, datetime):
+            deadline = datetime.timestamp(deadline)
+        fields["deadline"] = deadline
+    if depends_on:
+        fields["depends_on"] = json.dumps([get_task_id(task) for task in depends_on])
+    return fields
+
+
+def _schedule_task(scheduler, memory, with_dependencies=True, scanned=False):
+    """Add, update or remove a task in the scheduler from its metadata.
+
+    scanned means every in-progress task is already in the scheduler, so
+    dependencies outside it are finished and needn't be looked up.
+    """
+    metadata = memory["metadata"]
+    if metadata.get("status") != "in_progress":
+        scheduler.remove(memory["id"])
+        return
+    key = TaskScheduler.key(
+        metadata.get("priority", 0),
+        metadata.get("deadline"),
+        metadata.get("created_at", 0),
+    )
+    depends_on = []
+    if with_dependencies:
+        depends_on = json.loads(metadata.get("depends_on") or "[]")
+        if scanned:
+            depends_on = [task_id for task_id in depends_on if task_id in scheduler]
+        else:
+            depends_on = _unfinished_dependencies(scheduler, depends_on)
+    scheduler.update(memory["id"], key, depends_on)
+
+
+def _unfinished_dependencies(scheduler, depends_on):
+    """Get the dependencies a task still waits for.
+
+    Dependencies in the scheduler are in progress. The status of the others
+    is read from the task cache or the task store, without indexing them,
+    and only the ones that are finished, cancelled or deleted are dropped.
+    """
+    unknown = [task_id for task_id in depends_on if task_id not in scheduler]
+    if len(unknown) == 0:
+        return depends_on
+    statuses = {}
+    missing = []
+    for task_id in unknown:
+        memory = _task_cache.get(task_id) if _task_cache is not None else None
+        if memory is not None:
+            statuses[task_id] = memory["metadata"].get("status")
+        else:
+            missing.append(task_id)
+    for category in _task_categories():
+        if len(missing) == 0:
+            break
+        for memory in _task_store.get(category, ids=missing):
+            statuses[memory["id"]] = memory["metadata"].get("status")
+        missing = [task_id for task_id in missing if task_id not in statuses]
+    return [
+        task_id
+        for task_id in depends_on
+        if task_id in scheduler
+        or statuses.get(task_id, "complete") not in ("complete", "cancelled")
+    ]
+
+
+def _get_scheduler():
+    """Get the scheduler, building it from the in-progress tasks if needed."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            scheduler = TaskScheduler()
+            memories = list(iter_tasks("in_progress", chunk_size=500))
+            # add every task before any dependency, so dependencies on
+            # tasks later in the scan are seen
+            for memory in memories:
+                _schedule_task(scheduler, memory, with_dependencies=False)
+            for memory in memories:
+                _schedule_task(scheduler, memory, scanned=True)
+            log("Built scheduler of {} tasks".format(len(scheduler)), log=debug)
+            _scheduler = scheduler
+        return _scheduler
+
+
+def rebuild_scheduler():
+    """Rebuild the scheduler from the in-progress tasks.
+
+    The scheduler is kept up to date by every function in this module that
+    writes a task. Call this after other processes have written to the
+    same store.
+
+    Returns:
+        TaskScheduler: The rebuilt scheduler.
+    """
+    global _scheduler
+    with _scheduler_lock:
+        _scheduler = None
+    return _get_scheduler()
+
+
+def ready_tasks(n=10, fields=None):
+    """Get the in-progress tasks that are ready to run, in the order to run them.
+
+    Tasks with a higher priority come first, then tasks with an earlier
+    deadline, then older tasks. Tasks that depend on a task that is still
+    in progress are left out.
+
+    Args:
+        n (int, optional): How many tasks to return. Defaults to 10.
+        fields (list, optional): Return Task views keeping only these metadata fields. Defaults to None (full task dicts).
+
+    Returns:
+        list: Up to n tasks.
+    """
+    scheduler = _get_scheduler()
+    while True:
+        task_ids = scheduler.ready(n)
+        memories = _read_tasks(task_ids)
+        missing = [task_id for task_id in task_ids if task_id not in memories]
+        if len(missing) == 0:
+            return _project([memories[task_id] for task_id in task_ids], fields)
+        # tasks deleted by another process
+        for task_id in missing:
+            scheduler.remove(task_id)
+
+
+def _iter_ready_tasks(page_size=16):
+    """Yield the ready tasks in scheduler order, reading more as needed."""
+    seen = set()
+    n = page_size
+    while True:
+        tasks = ready_tasks(n)
+        for task in tasks:
+            if task["id"] not in seen:
+                seen.add(task["id"])
+                yield task
+        if len(tasks) < n:
+            return
+        n *= 2
+
+
+def next_task(fields=None):
+    """Get the in-progress task to run next.
+
+    Args:
+        fields (list, optional): Return a Task view keeping only these metadata fields. Defaults to None (the full task dict).
+
+    Returns:
+        dict or Task or None: The task, or None if no task is ready.
+    """
+    tasks = ready_tasks(1, fields=fields)
+    return tasks[0] if len(tasks) > 0 else None
+
+
+# persistent cache of generated plans and steps, disabled until
+# enable_generation_cache is called
+_generation_cache = None
+
+
+def enable_generation_cache(path=None, max_size=1000, max_age=None):
+    """Cache generated plans and steps so identical prompts skip the LLM.
+
+    Generations are keyed by a hash of the composed prompt and the model, so
+    a recurring goal gets the same plan and steps back without a completion.
+
+    Args:
+        path (str, optional): Path of the SQLite cache file. Defaults to "agentagenda_generations.db" in STORAGE_PATH.
+        max_size (int, optional): Maximum number of generations to keep. Defaults to 1000.
+        max_age (float, optional): Seconds a generation stays valid. Defaults to None (never expires).
+
+    Returns:
+        GenerationCache: The generation cache.
+    """
+    global _generation_cache
+    if path is None:
+        path = os.path.join(
+            os.environ.get("STORAGE_PATH", "./memory"), "agentagenda_generations.db"
+        )
+    if _generation_cache is not None:
+        _generation_cache.close()
+    _generation_cache = GenerationCache(path, max_size=max_size, max_age=max_age)
+    return _generation_cache
+
+
+def disable_generation_cache():
+    """Stop caching generated plans and steps."""
+    global _generation_cache
+    if _generation_cache is not None:
+        _generation_cache.close()
+    _generation_cache = None
+
+
+def get_generation_cache_stats():
+    """Get hit, miss and size counters for the generation cache.
+
+    Returns:
+        dict or None: A dict with "hits", "misses" and "size" keys, or None if the cache is disabled.
+    """
+    if _generation_cache is None:
+        return None
+    return _generation_cache.stats()
+
+
+# embeddings of goals and search terms, disabled until enable_embedding_cache
+# is called
+_embedding_cache = None
+
+
+def enable_embedding_cache(max_size=1024, path=None):
+    """Cache the embeddings of task goals and search terms.
+
+    Embeddings are keyed by a hash of the text and the embedding model, so
+    create_task and search_tasks only run the model for texts they haven't
+    seen. With a path, embeddings are also kept in a memory-mapped file that
+    survives restarts.
+
+    Args:
+        max_size (int, optional): Maximum number of embeddings to keep in memory. Defaults to 1024.
+        path (str, optional): Path of the embedding file, such as "./memory/agentagenda_embeddings.f32".
+            Defaults to None (memory only).
+
+    Returns:
+        EmbeddingCache: The embedding cache.
+    """
+    global _embedding_cache
+    _embedding_cache = EmbeddingCache(max_size=max_size, path=path)
+    return _embedding_cache
+
+
+def disable_embedding_cache():
+    """Let the task store embed goals and search terms itself."""
+    global _embedding_cache
+    _embedding_cache = None
+
+
+def get_embedding_cache_stats():
+    """Get hit, miss and size counters for the embedding cache.
+
+    Returns:
+        dict or None: A dict with "hits", "misses", "hit_rate", "size" and "disk_size" keys, or None if the
+            cache is disabled.
+    """
+    if _embedding_cache is None:
+        return None
+    return _embedding_cache.stats()
+
+
+def _cached_embeddings(category, texts):
+    """Embed texts for a category through the embedding cache.
+
+    Returns None when the cache is disabled, leaving embedding to the store.
+    """
+    if _embedding_cache is None:
+        return None
+    model = _task_store.embedding_model(category)
+    keys = [EmbeddingCache.key(text, model) for text in texts]
+    embeddings = [_embedding_cache.get(key) for key in keys]
+    missing = {}
+    for text, key, embedding in zip(texts, keys, embeddings):
+        if embedding is None:
+            missing[key] = text
+    if len(missing) > 0:
+        computed = _task_store.embed(category, list(missing.values()))
+        for key, embedding in zip(missing, computed):
+            _embedding_cache.set(key, embedding)
+            missing[key] = embedding
+        embeddings = [
+            embedding if embedding is not None else missing[key]
+            for key, embedding in zip(keys, embeddings)
+        ]
+    return embeddings
+
+
+def _generate(prompt, model, use_cache, generate):
+    """Call generate(), or return its cached result for the prompt and model."""
+    if _generation_cache is None or not use_cache:
+        return generate()
+    key = GenerationCache.key(prompt, model)
+    value = _generation_cache.get(key)
+    if value is None:
+        value = generate()
+        _generation_cache.set(key, value)
+    else:
+        log("Using cached generation for prompt: {}".format(prompt), log=debug)
+    return value
+
+
+# reuse of plans from similar completed tasks, disabled until
+# enable_plan_reuse is called
+_plan_reuse = None
+
+
+def enable_plan_reuse(max_distance=0.1, mode="copy"):
+    """Reuse the plans of similar completed tasks in create_task.
+
+    Before generating a plan, create_task searches completed tasks for the
+    closest goal. If it is within max_distance, its plan and steps are copied
+    to the new task ("copy"), or its plan is given to the LLM as an example
+    to plan from ("seed").
+
+    Args:
+        max_distance (float, optional): Maximum embedding distance of a similar goal. Defaults to 0.1.
+        mode (str, optional): "copy" or "seed". Defaults to "copy".
+    """
+    global _plan_reuse
+    if mode not in ("copy", "seed"):
+        raise ValueError("Unknown plan reuse mode: {}".format(mode))
+    _plan_reuse = {"max_distance": max_distance, "mode": mode}
+
+
+def disable_plan_reuse():
+    """Always generate new plans in create_task."""
+    global _plan_reuse
+    _plan_reuse = None
+
+
+# the id of the current task is kept in a single record of its own category,
+# so looking it up or switching it never scans the task category
+current_task_category = "task_current"
+_current_task_lock = threading.Lock()
+
+
+def _get_current_task_id():
+    """Read the current task pointer, building it from metadata if missing."""
+    pointers = _task_store.get(current_task_category, ids=["current"])
+    if len(pointers) > 0:
+        return pointers[0]["metadata"]["task_id"] or None
+
+    # stores written before the pointer existed only have the "current" flag
+    memories = _task_store.get(
+        _task_category("in_progress"), where={"current": "True"}, limit=1
+    )
+    task_id = memories[0]["id"] if len(memories) > 0 else None
+    _set_current_task_id(task_id)
+    return task_id
+
+
+def _set_current_task_id(task_id):
+    """Point the current task pointer at a task id, or at nothing."""
+    _task_store.upsert(
+        current_task_category, ["current"], ["current"], [{"task_id": task_id or ""}]
+    )
+
+
+def _switch_current_task(task_id):
+    """Unflag the previous current task and point at a new one.
+
+    The caller is responsible for setting "current" on the new task itself.
+    """
+    with _current_task_lock:
+        previous_id = _get_current_task_id()
+        if previous_id is not None and previous_id != task_id:
+            for attempt in range(_conflict_retries + 1):
+                previous = _read_task(previous_id)
+                if previous is None:
+                    break
+                previous["metadata"]["current"] = "False"
+                try:
+                    _write_task(previous)
+                    break
+                except TaskConflictError:
+                    if attempt == _conflict_retries:
+                        raise
+                    invalidate_task_cache(previous_id)
+        if previous_id != task_id:
+            _set_current_task_id(task_id)
+
+
+def _release_current_task(memory):
+    """Clear the pointer if it points at a task that is no longer current."""
+    if memory["metadata"].get("current") != "True":
+        return
+    _clear_current_task([memory["id"]])
+
+
+def _clear_current_task(task_ids):
+    """Clear the pointer if it points at one of the given tasks."""
+    with _current_task_lock:
+        if _get_current_task_id() in task_ids:
+            _set_current_task_id(None)
+
+
+# steps are kept in the task's "steps" JSON by default; with step records
+# enabled, new tasks store each step as its own memory in this category
+step_category = "task_step"
+_use_step_records = False
+
+
+def enable_step_records():
+    """Store the steps of newly created tasks as individual step records.
+
+    Each step becomes a memory in the "task_step" category, so changing one
+    step rewrites that record only. The task's "steps" JSON is kept as a view
+    that is rebuilt the next time the task is read with get_task_by_id or
+    get_current_task.
+    """
+    global _use_step_records
+    _use_step_records = True
+
+
+def disable_step_records():
+    """Store the steps of newly created tasks in the task's "steps" JSON."""
+    global _use_step_records
+    _use_step_records = False
+
+
+def _uses_step_records(memory):
+    return memory["metadata"].get("step_storage") == "records"
+
+
+def _parse_steps(steps, task_id=None):
+    """Turn a steps JSON string, or a list of dicts or strings, into Steps."""
+    if isinstance(steps, str):
+        steps = json.loads(steps)
+    parsed = []
+    for ordinal, step in enumerate(steps):
+        if isinstance(step, str):
+            step = {"content": step, "completed": False}
+        parsed.append(
+            Step(step["content"], step["completed"], task_id=task_id, ordinal=ordinal)
+        )
+    return parsed
+
+
+def _load_steps(memory):
+    """Load the steps of a task, in order."""
+    if not _uses_step_records(memory):
+        return _parse_steps(memory["metadata"]["steps"], memory.get("id"))
+    records = _task_store.get(step_category, where={"task_id": memory["id"]})
+    return sorted(
+        [Step.from_memory(record) for record in records], key=lambda s: s.ordinal
+    )
+
+
+def _write_step_records(changed=(), added=(), removed=()):
+    """Write, create and delete step records with one call each."""
+    if len(changed) > 0:
+        _task_store.update(
+            step_category,
+            ids=[step.id for step in changed],
+            metadatas=[step.to_metadata() for step in changed],
+        )
+    if len(added) > 0:
+        _task_store.upsert(
+            step_category,
+            ids=[step.id for step in added],
+            documents=[step.content for step in added],
+            metadatas=[step.to_metadata() for step in added],
+        )
+    if len(removed) > 0:
+        _task_store.delete(step_category, ids=[step.id for step in removed])
+    if _keyword_index is not None:
+        for step in added:
+            _keyword_index.add_text(step.task_id, "steps", step.content)
+        for step in removed:
+            _keyword_index.remove_text(step.task_id, "steps", step.content)
+
+
+def _update_step_cursor(memory, steps):
+    """Recompute a task's next step and completion counters from its steps.
+
+    next_step_index is the position of the next step in the "steps" JSON, or
+    its ordinal for tasks with step records, and -1 once every step is done.
+    """
+    metadata = memory["metadata"]
+    next_index = -1
+    next_content = ""
+    completed_count = 0
+    for index, step in enumerate(steps):
+        if step.completed:
+            completed_count += 1
+        elif next_index < 0:
+            next_index = step.ordinal if _uses_step_records(memory) else index
+            next_content = step.content
+    metadata["next_step_index"] = next_index
+    metadata["next_step"] = next_content
+    metadata["completed_count"] = completed_count
+    metadata["step_count"] = len(steps)
+
+
+def _advance_step_cursor(memory, step, was_completed):
+    """Update the cursor for a single changed step without loading the rest.
+
+    Returns False when the remaining steps have to be scanned, which only
+    happens when the next step itself was just completed.
+    """
+    metadata = memory["metadata"]
+    if "next_step_index" not in metadata:
+        return False
+    if step.completed == was_completed:
+        return True
+    next_index = int(metadata["next_step_index"])
+    if step.completed:
+        if step.ordinal == next_index:
+            return False
+        metadata["completed_count"] = int(metadata["completed_count"]) + 1
+    else:
+        metadata["completed_count"] = int(metadata["completed_count"]) - 1
+        if next_index < 0 or step.ordinal < next_index:
+            metadata["next_step_index"] = step.ordinal
+            metadata["next_step"] = step.content
+    return True
+
+
+def _save_steps(memory, steps, changed=(), added=(), removed=()):
+    """Persist step changes and the task itself.
+
+    Tasks with step records only write the records that changed; other tasks
+    get their whole "steps" JSON rewritten from steps. When steps is given
+    the task's next step cursor is recomputed from it, otherwise the caller
+    has already kept the cursor up to date. Returns the task as written.
+    """
+    metadata = memory["metadata"]
+    if steps is not None:
+        _update_step_cursor(memory, steps)
+    if _uses_step_records(memory):
+        metadata["steps_stale"] = "True"
+    else:
+        metadata["steps"] = json.dumps([step.to_dict() for step in steps])
+    metadata["updated_at"] = datetime.timestamp(datetime.now())
+    # write the task first, so a conflicting write leaves the step records alone
+    response = _write_task(memory)
+    if _uses_step_records(memory):
+        _write_step_records(changed, added, removed)
+    return response
+
+
+# step indexes of recently used tasks, by task id; an index is only used
+# while its version matches the task's updated_at
+_step_index_cache = LRUCache(max_size=256)
+
+
+def _get_step_index(memory):
+    """Get the step index of a task, building it if the task has changed."""
+    version = memory["metadata"].get("updated_at")
+    index = _step_index_cache.get(memory["id"])
+    if index is None or index.version != version:
+        index = StepIndex(_load_steps(memory), version=version)
+        _step_index_cache.set(memory["id"], index)
+    return index
+
+
+def _set_step_completed(memory, index, position, completed):
+    """Mark one indexed step as completed or not and save the task."""
+    previous = index.steps[position]
+    # unversioned until the write succeeds, so a failed write can't leave
+    # an index that claims to match the stored task
+    index.version = None
+    index.set_completed(position, completed)
+    step = index.steps[position]
+    if _uses_step_records(memory) and _advance_step_cursor(
+        memory, step, previous.completed
+    ):
+        response = _save_steps(memory, None, changed=[step])
+    else:
+        response = _save_steps(memory, index.copy_steps(), changed=[step])
+    # the index now matches what was written, so keep it for the next call
+    index.version = memory["metadata"]["updated_at"]
+    _step_index_cache.set(memory["id"], index)
+    return response
+
+
+def _materialize_steps(memory):
+    """Rebuild a step-record task's "steps" JSON view if it is out of date."""
+    if memory is None or not _uses_step_records(memory):
+        return memory
+    if memory["metadata"].get("steps_stale") != "True":
+        return memory
+    steps = _load_steps(memory)
+    memory["metadata"]["steps"] = json.dumps([step.to_dict() for step in steps])
+    memory["metadata"]["steps_stale"] = "False"
+    try:
+        _write_task(memory)
+    except TaskConflictError:
+        # someone else wrote the task meanwhile; the view is still correct
+        invalidate_task_cache(memory["id"])
+    return memory
+
+
+def _fold_steps(memories):
+    """Rebuild the stale "steps" JSON of tasks from their step records.
+
+    The step records of every stale task are read with a single task store
+    call, and the tasks are changed in place without being written back.
+    """
+    stale = [
+        memory
+        for memory in memories
+        if _uses_step_records(memory)
+        and memory["metadata"].get("steps_stale") == "True"
+    ]
+    if len(stale) == 0:
+        return memories
+    records = _task_store.get(
+        step_category, where={"task_id": {"$in": [memory["id"] for memory in stale]}}
+    )
+    steps = {}
+    for record in records:
+        step = Step.from_memory(record)
+        steps.setdefault(step.task_id, []).append(step)
+    for memory in stale:
+        task_steps = sorted(steps.get(memory["id"], []), key=lambda s: s.ordinal)
+        memory["metadata"]["steps"] = json.dumps(
+            [step.to_dict() for step in task_steps]
+        )
+        memory["metadata"]["steps_stale"] = "False"
+    return memories
+
+
+def get_steps(task):
+    """Get the steps of a task as Step objects.
+
+    Args:
+        task (dict or int or str): The task to get the steps of.
+
+    Returns:
+        list: The steps of the task, in order.
+    """
+    if not isinstance(task, (dict, Task)) or "id" not in task:
+        task = _read_task(get_task_id(task))
+    return _load_steps(_whole_task(task))
+
+
+@_retry_on_conflict
+def migrate_task_steps(task):
+    """Move a task's steps from its "steps" JSON into step records.
+
+    Args:
+        task (dict or int or str): The task to migrate.
+
+    Returns:
+        dict: The migrated task.
+    """
+    memory = _read_task(get_task_id(task))
+    if _uses_step_records(memory):
+        return memory
+    steps = _load_steps(memory)
+    _write_step_records(added=steps)
+    memory["metadata"]["step_storage"] = "records"
+    memory["metadata"]["next_ordinal"] = len(steps)
+    memory["metadata"]["steps_stale"] = "False"
+    _update_step_cursor(memory, steps)
+    _write_task(memory)
+    return memory
+
+
+def _reuse_plan(goal, plan, steps):
+    """Look up a similar completed task's plan if plan reuse is enabled.
+
+    Returns the plan and steps to use, which are still None if nothing was
+    copied, and an example plan to seed plan generation with.
+    """
+    if plan is not None or _plan_reuse is None:
+        return plan, steps, None
+    similar = find_similar_task(goal, max_distance=_plan_reuse["max_distance"])
+    if similar is None:
+        return plan, steps, None
+    if _plan_reuse["mode"] == "seed":
+        return plan, steps, similar["metadata"]["plan"]
+    log("Reusing plan of similar task: {}".format(similar["id"]), log=debug)
+    if steps is None:
+        steps = [
+            {"content": step.content, "completed": False}
+            for step in _load_steps(similar)
+        ]
+    return similar["metadata"]["plan"], steps, None
+
+
+def _build_task(goal, plan, steps, model, current=True, use_cache=True):
+    """Generate any missing plan and steps and build a task's metadata.
+
+    Returns the metadata and the task's steps as a list of Steps.
+    """
+    plan, steps, example_plan = _reuse_plan(goal, plan, steps)
+
     if plan is None:
         log("Creating plan for goal: {}".format(goal), log=debug)
-        plan = create_plan(goal)
-    if steps is None:
-        response = openai_function_call(
-            text=compose_prompt(step_creation_prompt, {"goal": goal, "plan": plan}),
-            functions=[step_creation_function],
-            function_call="create_steps",
-            debug=debug,
-            model=model,
+        plan = create_plan(
+            goal, model=model, use_cache=use_cache, example_plan=example_plan
         )
-
-        steps = response["arguments"]["steps"]
+    if steps is None:
+        steps = create_steps(goal, plan, model=model, use_cache=use_cache)
 
         step_items = []
 
@@ -94,12 +1382,6 @@ def create_task(goal, plan=None, steps=None, model="gpt-3.5-turbo-0613"):
     created_at = datetime.timestamp(datetime.now())
     updated_at = datetime.timestamp(datetime.now())
 
-    memories = get_memories("task", filter_metadata={"current": "True"})
-    for memory in memories:
-        metadata = memory["metadata"]
-        metadata["current"] = "False"
-        update_memory("task", memory["id"], metadata=metadata)
-
     task = {
         "created_at": created_at,
         "updated_at": updated_at,
@@ -107,60 +1389,848 @@ def create_task(goal, plan=None, steps=None, model="gpt-3.5-turbo-0613"):
         "plan": plan,
         "steps": steps,
         "status": "in_progress",
-        "current": "True",
+        "current": "True" if current else "False",
+        "version": 0,
     }
 
-    return get_task_by_id(create_memory("task", goal, metadata=task))
+    step_list = _parse_steps(steps)
+    if _use_step_records:
+        task["step_storage"] = "records"
+        task["next_ordinal"] = len(step_list)
+        task["steps_stale"] = "False"
+    _update_step_cursor({"metadata": task}, step_list)
+    return task, step_list
+
+
+def create_task(
+    goal,
+    plan=None,
+    steps=None,
+    model="gpt-3.5-turbo-0613",
+    use_cache=True,
+    pipeline=False,
+    priority=0,
+    deadline=None,
+    depends_on=None,
+):
+    """Create a task and store it in memory.
+
+    Args:
+        goal (str): The goal of the task.
+        plan (str, optional): A plan to accomplish the task. Defaults to None.
+        steps (list or dict, optional): Steps needed to complete the task. Defaults to None.
+        model (str, optional): The OpenAI model to use for AI operations. Defaults to 'gpt-3.5-turbo-0613'.
+        use_cache (bool, optional): Whether to use the generation cache, if enabled. Defaults to True.
+        pipeline (bool, optional): Store the task as soon as it is created and generate its plan and steps
+            with a single LLM call, instead of one call for the plan and one for the steps. Defaults to False.
+        priority (int, optional): Tasks with higher priorities are scheduled first. Defaults to 0.
+        deadline (float or datetime, optional): Among equal priorities, earlier deadlines are scheduled first.
+            Defaults to None.
+        depends_on (list, optional): Tasks that have to leave in_progress before this one is scheduled.
+            Defaults to None.
+
+    Returns:
+        dict: The created task.
+    """
+    schedule = _schedule_fields(priority, deadline, depends_on)
+    if pipeline and plan is None and steps is None:
+        plan, steps, example_plan = _reuse_plan(goal, plan, steps)
+        if plan is None:
+            return _create_task_pipelined(
+                goal, model, use_cache, schedule, example_plan
+            )
+
+    task, step_list = _build_task(goal, plan, steps, model, use_cache=use_cache)
+    task.update(schedule)
+
+    task_id = str(uuid.uuid4())
+    category = _task_category("in_progress")
+    _task_store.upsert(
+        category, [task_id], [goal], [task], _cached_embeddings(category, [goal])
+    )
+    _index_task({"id": task_id, "metadata": task})
+    if _use_step_records:
+        for step in step_list:
+            step.task_id = task_id
+        _write_step_records(added=step_list)
+    _switch_current_task(task_id)
+    return get_task_by_id(task_id)
+
+
+def _create_task_pipelined(goal, model, use_cache, schedule, example_plan=None):
+    """Store a task for the goal right away, then fill in its plan and steps.
+
+    The task is marked with "plan_pending" until its plan and steps, which
+    come from a single create_plan_and_steps call, have been written. If the
+    call fails, plan_pending is cleared, the error is kept in "plan_error"
+    and re-raised.
+    """
+    task, _ = _build_task(goal, "", [], model)
+    task.update(schedule)
+    task["plan_pending"] = "True"
+    task_id = str(uuid.uuid4())
+    category = _task_category("in_progress")
+    _task_store.upsert(
+        category, [task_id], [goal], [task], _cached_embeddings(category, [goal])
+    )
+    _index_task({"id": task_id, "metadata": task})
+    _switch_current_task(task_id)
+
+    try:
+        generation = create_plan_and_steps(
+            goal, model=model, use_cache=use_cache, example_plan=example_plan
+        )
+    except Exception as error:
+        log("Plan generation failed for {}: {}".format(task_id, error), log=debug)
+        _fail_pending_plan(task_id, error)
+        raise
+
+    memory = _read_task(task_id)
+    memory["metadata"]["plan"] = generation["plan"]
+    memory["metadata"]["plan_pending"] = "False"
+    step_list = _parse_steps(generation["steps"], task_id)
+    if _uses_step_records(memory):
+        memory["metadata"]["next_ordinal"] = len(step_list)
+    _save_steps(memory, step_list, added=step_list)
+    return get_task_by_id(task_id)
+
+
+@_retry_on_conflict
+def _fail_pending_plan(task_id, error):
+    """Record why a pipelined task's plan couldn't be generated."""
+    memory = _read_task(task_id)
+    if memory is None:
+        return
+    memory["metadata"]["plan_pending"] = "False"
+    memory["metadata"]["plan_error"] = str(error)
+    _write_task(memory)
+
+
+def _read_tasks(task_ids):
+    """Read several tasks with a single task store call.
+
+    Returns a dict of task id to task; missing tasks are left out.
+    """
+    found = {}
+    missing = []
+    for task_id in task_ids:
+        memory = _task_cache.get(task_id) if _task_cache is not None else None
+        if memory is not None:
+            found[task_id] = _copy_task(memory)
+        else:
+            missing.append(task_id)
+    for category in _task_categories():
+        if len(missing) == 0:
+            break
+        for memory in _task_store.get(category, ids=missing):
+            found[memory["id"]] = memory
+            if _task_cache is not None:
+                _task_cache.set(memory["id"], _copy_task(memory))
+            _index_task(memory)
+        missing = [task_id for task_id in missing if task_id not in found]
+    return found
+
+
+def _write_tasks(memories):
+    """Write the metadata of several tasks with a single task store call.
+
+    Raises TaskConflictError if any of the tasks was written since it was read.
+    """
+    _claim_versions(memories)
+    for memory in memories:
+        if _task_cache is not None:
+            _task_cache.set(memory["id"], _copy_task(memory))
+        _index_task(memory)
+
+
+def _result(task_id, error=None):
+    return {"id": task_id, "success": error is None, "error": error}
+
+
+def create_tasks(tasks, model="gpt-3.5-turbo-0613", use_cache=True):
+    """Create several tasks, storing them with a single task store call.
+
+    Plans and steps that aren't given are generated for each task as in
+    create_task. Unlike create_task, the new tasks don't replace the
+    current task.
+
+    Args:
+        tasks (list): Goals as strings, or dicts with a "goal" and optional "plan", "steps", "priority",
+            "deadline" and "depends_on".
+        model (str, optional): The OpenAI model to use for AI operations. Defaults to 'gpt-3.5-turbo-0613'.
+        use_cache (bool, optional): Whether to use the generation cache, if enabled. Defaults to True.
+
+    Returns:
+        list: A result dict per task, in order, with "id", "success" and "error" keys.
+    """
+    results = []
+    ids = []
+    documents = []
+    metadatas = []
+    step_lists = []
+    for task in tasks:
+        if isinstance(task, str):
+            task = {"goal": task}
+        try:
+            metadata, step_list = _build_task(
+                task["goal"],
+                task.get("plan"),
+                task.get("steps"),
+                model,
+                current=False,
+                use_cache=use_cache,
+            )
+            metadata.update(
+                _schedule_fields(
+                    task.get("priority", 0),
+                    task.get("deadline"),
+                    task.get("depends_on"),
+                )
+            )
+        except Exception as error:
+            log("Failed to create task {}: {}".format(task, error), log=debug)
+            results.append(_result(None, str(error)))
+            continue
+        task_id = str(uuid.uuid4())
+        for step in step_list:
+            step.task_id = task_id
+        ids.append(task_id)
+        documents.append(task["goal"])
+        metadatas.append(metadata)
+        step_lists.append(step_list)
+        results.append(_result(task_id))
+
+    if len(ids) > 0:
+        log("Creating {} tasks".format(len(ids)), log=debug)
+        category = _task_category("in_progress")
+        _task_store.upsert(
+            category,
+            ids=ids,
+            documents=documents,
+            metadatas=metadatas,
+            embeddings=_cached_embeddings(category, documents),
+        )
+        for task_id, metadata in zip(ids, metadatas):
+            _index_task({"id": task_id, "metadata": metadata})
+        if _use_step_records:
+            _write_step_records(
+                added=[step for step_list in step_lists for step in step_list]
+            )
+    return results
+
+
+def _set_tasks_status(tasks, status):
+    """Set the status of several tasks with one read and one write."""
+    task_ids = [get_task_id(task) for task in tasks]
+    memories = _read_tasks(task_ids)
+    updated_at = datetime.timestamp(datetime.now())
+    results = []
+    moves = []
+    for task_id in task_ids:
+        memory = memories.get(task_id)
+        if memory is None:
+            results.append(_result(task_id, "Task not found"))
+            continue
+        _release_current_task(memory)
+        moves.append((memory, memory["metadata"]["status"]))
+        memory["metadata"]["status"] = status
+        memory["metadata"]["updated_at"] = updated_at
+        memory["metadata"]["current"] = "False"
+        results.append(_result(task_id))
+    _move_tasks(moves)
+    return results
+
+
+@_retry_on_conflict
+def finish_tasks(tasks):
+    """Mark several tasks as complete.
+
+    Args:
+        tasks (list): The tasks to finish, as dicts, ints or strs.
+
+    Returns:
+        list: A result dict per task, in order, with "id", "success" and "error" keys.
+    """
+    log("Finishing {} tasks".format(len(tasks)), log=debug)
+    return _set_tasks_status(tasks, "complete")
+
+
+@_retry_on_conflict
+def cancel_tasks(tasks):
+    """Cancel several tasks.
+
+    Args:
+        tasks (list): The tasks to cancel, as dicts, ints or strs.
+
+    Returns:
+        list: A result dict per task, in order, with "id", "success" and "error" keys.
+    """
+    log("Cancelling {} tasks".format(len(tasks)), log=debug)
+    return _set_tasks_status(tasks, "cancelled")
+
+
+def delete_tasks(tasks):
+    """Delete several tasks and their step records.
+
+    Args:
+        tasks (list): The tasks to delete, as dicts, ints or strs.
+
+    Returns:
+        list: A result dict per task, in order, with "id", "success" and "error" keys.
+    """
+    log("Deleting {} tasks".format(len(tasks)), log=debug)
+    task_ids = [get_task_id(task) for task in tasks]
+    existing = set()
+    for category in _task_categories():
+        found = [memory["id"] for memory in _task_store.get(category, ids=task_ids)]
+        if len(found) > 0:
+            _task_store.delete(category, ids=found)
+            existing.update(found)
+    if len(existing) > 0:
+        _task_store.delete(step_category, where={"task_id": {"$in": list(existing)}})
+    for task_id in existing:
+        invalidate_task_cache(task_id)
+        _unindex_task(task_id)
+    if len(existing) > 0:
+        _clear_current_task(existing)
+    return [
+        _result(task_id) if task_id in existing else _result(task_id, "Task not found")
+        for task_id in task_ids
+    ]
+
+
+# archives of finished tasks, by path
+_task_archives = {}
+_task_archives_lock = threading.Lock()
+
+
+def _get_task_archive(path=None):
+    """Get the archive at path, defaulting to one in STORAGE_PATH."""
+    if path is None:
+        path = os.path.join(
+            os.environ.get("STORAGE_PATH", "./memory"), "agentagenda_archive.jsonl.gz"
+        )
+    with _task_archives_lock:
+        if path not in _task_archives:
+            _task_archives[path] = TaskArchive(path)
+        return _task_archives[path]
+
+
+def archive_tasks(
+    older_than=None, statuses=("complete", "cancelled"), path=None, chunk_size=100
+):
+    """Move finished tasks out of the task store into a compressed archive.
+
+    Archived tasks keep their goal, plan, steps and metadata but not their
+    embeddings, and no longer show up in list_tasks or search_tasks. Use
+    load_archived_task and search_archived_tasks to read them back.
+
+    Args:
+        older_than (float, optional): Only archive tasks last updated more than this many seconds ago. Defaults to None (any age).
+        statuses (list, optional): The statuses of the tasks to archive. Defaults to ("complete", "cancelled").
+        path (str, optional): Path of the archive file. Defaults to "agentagenda_archive.jsonl.gz" in STORAGE_PATH.
+        chunk_size (int, optional): How many tasks to move at once. Defaults to 100.
+
+    Returns:
+        int: The number of tasks archived.
+    """
+    archive = _get_task_archive(path)
+    archived = []
+    for status in statuses:
+        where = {"status": status}
+        if older_than is not None:
+            cutoff = datetime.timestamp(datetime.now()) - older_than
+            where = {"$and": [where, {"updated_at": {"$lt": cutoff}}]}
+        for category in _task_categories(status):
+            while True:
+                memories = _task_store.get(category, where=where, limit=chunk_size)
+                if len(memories) == 0:
+                    break
+                # fold step records back into the steps JSON, so archived
+                # tasks don't depend on anything left in the task store
+                archive.append(_fold_steps(memories))
+
+                ids = [memory["id"] for memory in memories]
+                _task_store.delete(category, ids=ids)
+                _task_store.delete(step_category, where={"task_id": {"$in": ids}})
+                for task_id in ids:
+                    invalidate_task_cache(task_id)
+                    _unindex_task(task_id)
+                archived.extend(ids)
+    if len(archived) > 0:
+        _clear_current_task(archived)
+    log("Archived {} tasks".format(len(archived)), log=debug)
+    return len(archived)
+
+
+def load_archived_task(task_id, path=None):
+    """Load a task from the archive.
+
+    Args:
+        task_id (str): The id of the task.
+        path (str, optional): Path of the archive file. Defaults to "agentagenda_archive.jsonl.gz" in STORAGE_PATH.
+
+    Returns:
+        dict or None: The task, or None if it isn't archived.
+    """
+    return _get_task_archive(path).get(get_task_id(task_id))
+
+
+def search_archived_tasks(
+    task_ids=None, start=None, end=None, by="updated_at", statuses=None, path=None
+):
+    """Find archived tasks by id, time range and status.
+
+    Args:
+        task_ids (list, optional): Only return these tasks. Defaults to None (any task).
+        start (float, optional): Only return tasks with a timestamp at or after this one. Defaults to None.
+        end (float, optional): Only return tasks with a timestamp before this one. Defaults to None.
+        by (str, optional): "created_at" or "updated_at". Defaults to "updated_at".
+        statuses (list, optional): Only return tasks with these statuses. Defaults to None (any status).
+        path (str, optional): Path of the archive file. Defaults to "agentagenda_archive.jsonl.gz" in STORAGE_PATH.
+
+    Returns:
+        list: The matching tasks, newest first.
+    """
+    return _get_task_archive(path).search(
+        task_ids=task_ids, start=start, end=end, by=by, statuses=statuses
+    )
+
+
+@_retry_on_conflict
+def update_steps(task, steps):
+    """Update several steps of a task with one read and one write.
 
+    Args:
+        task (dict or int or str): The task in which the steps are to be updated.
+        steps (list): The steps to update, as dicts with "content" and "completed" keys or Steps.
 
-def list_tasks(status="in_progress"):
+    Returns:
+        list: A result dict per step, in order, with "content", "success" and "error" keys.
+    """
+    task_id = get_task_id(task)
+    task = _read_task(task_id)
+    current_steps = _load_steps(task)
+    results = []
+    changed = {}
+    for step in steps:
+        if isinstance(step, Step):
+            step = step.to_dict()
+        matches = [s for s in current_steps if s.content == step["content"]]
+        for s in matches:
+            s.completed = step["completed"]
+            changed[s.ordinal] = s
+        results.append(
+            {
+                "content": step["content"],
+                "success": len(matches) > 0,
+                "error": None if len(matches) > 0 else "Step not found",
+            }
+        )
+    log("Updating {} steps for task: {}".format(len(steps), task), log=debug)
+    _save_steps(task, current_steps, changed=list(changed.values()))
+    return results
+
+
+def _project(memories, fields):
+    """Wrap memories in Task views keeping only the given fields."""
+    if fields is None or "steps" in fields:
+        _fold_steps(memories)
+    if fields is None:
+        return memories
+    return [Task(memory, fields=fields) for memory in memories]
+
+
+def list_tasks(
+    status="in_progress",
+    fields=None,
+    limit=None,
+    offset=0,
+    after=None,
+    sort_by=None,
+    descending=True,
+    task_filter=None,
+):
     """List all tasks with the given status.
 
+    Without limit, offset, after or sort_by this returns the 20 most
+    recently created tasks, newest first. Any of them
+    switches to paging: pass the last task of a page as after to get the
+    next one.
+
     Args:
-        status (str, optional): The status of the tasks to retrieve. Defaults to 'in_progress'.
+        status (str or list, optional): The status of the tasks to retrieve, a list of statuses, or None for every
+            status. Defaults to 'in_progress'.
+        fields (list, optional): Return Task views keeping only these metadata fields. Defaults to None (full task dicts).
+        limit (int, optional): The maximum number of tasks to return. Defaults to None (no limit).
+        offset (int, optional): How many tasks to skip. Defaults to 0.
+        after (dict or Task or int or str, optional): Start after this task. Requires a sort order, so sort_by
+            defaults to "created_at" when it is given. Defaults to None.
+        sort_by (str, optional): "created_at" or "updated_at". Defaults to None (store order).
+        descending (bool, optional): List the newest tasks first when sorting. Defaults to True.
+        task_filter (TaskFilter, optional): Only list tasks matching this filter. Its statuses, if set, take the
+            place of status. Defaults to None.
 
     Returns:
         list: A list of tasks with the given status.
     """
-    debug = os.environ.get("DEBUG", False)
-    memories = get_memories(
-        "task", filter_metadata={"status": status}, include_embeddings=False
-    )
+    task_filter = _task_filter(status, task_filter)
+    categories = _filter_categories(task_filter)
+    if limit is None and offset == 0 and after is None and sort_by is None:
+        memories = [
+            memory
+            for category in categories
+            for memory in _task_store.get(category, where=task_filter.where())
+        ]
+        memories = _residual(memories, task_filter)
+        # task ids are random, so the newest tasks are found by created_at
+        memories = sorted(
+            memories,
+            key=lambda memory: (memory["metadata"].get("created_at", 0), memory["id"]),
+            reverse=True,
+        )[:20]
+        log("Found {} tasks".format(len(memories)), log=debug)
+        return _project(memories, fields)
+
+    if (
+        sort_by is None
+        and after is None
+        and len(categories) == 1
+        and not task_filter.has_residual
+    ):
+        # store order pages are pushed down to the task store
+        memories = _task_store.get(
+            categories[0],
+            where=task_filter.where(),
+            limit=limit,
+            offset=offset,
+        )
+    else:
+        if sort_by is None and after is not None:
+            sort_by = "created_at"
+        # status is already part of task_filter
+        tasks = iter_tasks(
+            status=None,
+            sort_by=sort_by,
+            after=after,
+            descending=descending,
+            task_filter=task_filter,
+        )
+        stop = offset + limit if limit is not None else None
+        memories = list(itertools.islice(tasks, offset, stop))
     log("Found {} tasks".format(len(memories)), log=debug)
-    return memories
+    return _project(memories, fields)
+
+
+def _task_filter(status, task_filter):
+    """Combine a status argument and an optional TaskFilter into one TaskFilter."""
+    if task_filter is None:
+        return TaskFilter(status=status)
+    return task_filter.with_status(status)
+
+
+def _residual(memories, task_filter):
+    """Drop the tasks failing the conditions the task store couldn't check."""
+    if not task_filter.has_residual:
+        return memories
+    return [memory for memory in memories if task_filter.matches(memory)]
+
+
+def _sort_position(after, sort_by):
+    """Get the (timestamp, task_id) position of the task to start after."""
+    if isinstance(after, (dict, Task)) and sort_by in after["metadata"]:
+        return (after["metadata"][sort_by], get_task_id(after))
+    task_id = get_task_id(after)
+    position = _get_recency_index().position(task_id, by=sort_by)
+    if position is None:
+        memory = _read_task(task_id)
+        if memory is None:
+            raise ValueError("Task not found: {}".format(task_id))
+        position = (memory["metadata"][sort_by], task_id)
+    return position
+
+
+def iter_tasks(
+    status="in_progress",
+    sort_by=None,
+    after=None,
+    descending=True,
+    chunk_size=100,
+    fields=None,
+    task_filter=None,
+):
+    """Iterate over the tasks with the given status, reading them in chunks.
 
+    Only one chunk of tasks is held at a time, so walking a large backlog
+    doesn't load every task at once.
 
-def search_tasks(search_term, status="in_progress"):
+    Args:
+        status (str or list, optional): The status of the tasks to retrieve, a list of statuses, or None for every
+            status. Defaults to 'in_progress'.
+        sort_by (str, optional): "created_at" or "updated_at". Defaults to None (store order).
+        after (dict or Task or int or str, optional): Start after this task. Requires sort_by. Defaults to None.
+        descending (bool, optional): Yield the newest tasks first when sorting. Defaults to True.
+        chunk_size (int, optional): How many tasks to read at once. Defaults to 100.
+        fields (list, optional): Yield Task views keeping only these metadata fields. Defaults to None (full task dicts).
+        task_filter (TaskFilter, optional): Only yield tasks matching this filter. Its statuses, if set, take the
+            place of status. Defaults to None.
+
+    Yields:
+        dict or Task: The next task.
+    """
+    task_filter = _task_filter(status, task_filter)
+    if sort_by is None:
+        if after is not None:
+            raise ValueError("after requires sort_by")
+        for category in _filter_categories(task_filter):
+            offset = 0
+            while True:
+                memories = _task_store.get(
+                    category,
+                    where=task_filter.where(),
+                    limit=chunk_size,
+                    offset=offset,
+                )
+                yield from _project(_residual(memories, task_filter), fields)
+                if len(memories) < chunk_size:
+                    break
+                offset += chunk_size
+        return
+
+    if sort_by not in ("created_at", "updated_at"):
+        raise ValueError("Unknown sort key: {}".format(sort_by))
+    index = _get_recency_index()
+    position = _sort_position(after, sort_by) if after is not None else None
+    # the walk only passes the tasks of the requested statuses, and a range
+    # on the sort key starts it at one end of the range and ends it at the
+    # other, instead of filtering every task in the index
+    since, before = task_filter.bounds(sort_by)
+    start = before if descending else since
+    if start is not None:
+        start = (float(start), "")
+        if position is None or (start < position) == descending:
+            position = start
+    for task_ids in index.pages(
+        by=sort_by,
+        after=position,
+        descending=descending,
+        page_size=chunk_size,
+        statuses=task_filter.statuses,
+    ):
+        memories = _read_tasks(task_ids)
+        page = []
+        for task_id in task_ids:
+            memory = memories.get(task_id)
+            if memory is None:
+                index.remove(task_id)
+                continue
+            timestamp = float(memory["metadata"].get(sort_by, 0))
+            if (descending and since is not None and timestamp < float(since)) or (
+                not descending and before is not None and timestamp >= float(before)
+            ):
+                yield from _project(page, fields)
+                return
+            if task_filter.matches(memory):
+                page.append(memory)
+        yield from _project(page, fields)
+
+
+def search_tasks(
+    search_term,
+    status="in_progress",
+    n_results=5,
+    include_distances=False,
+    max_distance=None,
+    fields=None,
+    mode="vector",
+    task_filter=None,
+):
     """Search for tasks related to a given search term.
 
     Args:
         search_term (str): The search term to use.
-        status (str, optional): The status of the tasks to retrieve. Defaults to 'in_progress'.
+        status (str or list, optional): The status of the tasks to retrieve, a list of statuses, or None for every
+            status. Defaults to 'in_progress'.
+        n_results (int, optional): The maximum number of tasks to return. Defaults to 5.
+        include_distances (bool, optional): Whether to include each task's "distance" from the search term. Defaults to False.
+        max_distance (float, optional): Only return tasks within this distance of the search term. Defaults to None.
+        fields (list, optional): Return Task views keeping only these metadata fields. Defaults to None (full task dicts).
+        mode (str, optional): "vector" ranks goals by embedding distance, "keyword" ranks the words of goals, plans
+            and steps with a local index without querying the vector store, and "hybrid" fuses both rankings.
+            Keyword and hybrid results carry a "score". In hybrid mode max_distance only limits the vector ranking,
+            so tasks found by keyword alone are kept, without a "distance". Defaults to "vector".
+        task_filter (TaskFilter, optional): Only return tasks matching this filter. Its statuses, if set, take the
+            place of status. Defaults to None.
 
     Returns:
         list: A list of tasks related to the search term.
     """
-    memories = search_memory(
-        "task",
-        search_term,
-        filter_metadata={"status": status},
-        include_embeddings=False,
-        include_distances=False,
-    )
+    task_filter = _task_filter(status, task_filter)
+    if mode == "keyword":
+        memories = _keyword_search(search_term, task_filter, n_results)
+    elif mode == "hybrid":
+        memories = _hybrid_search(
+            search_term, task_filter, n_results, include_distances, max_distance
+        )
+    elif mode == "vector":
+        memories = _vector_search(
+            search_term, task_filter, n_results, include_distances, max_distance
+        )
+    else:
+        raise ValueError("Unknown search mode: {}".format(mode))
     log("Found {} tasks".format(len(memories)), log=debug)
+    return _project(memories, fields)
+
+
+# how much deeper each retry of a search goes when conditions checked after
+# the query leave too few results
+_search_depth_factor = 4
+
+
+def _vector_search(
+    search_term, task_filter, n_results, include_distances, max_distance
+):
+    """Find tasks by embedding distance, querying each category the filter covers."""
+    categories = _filter_categories(task_filter)
+    query_embeddings = {}
+    for category in categories:
+        embeddings = _cached_embeddings(category, [search_term])
+        query_embeddings[category] = embeddings[0] if embeddings else None
+    # results from several categories are merged by distance
+    with_distances = (
+        include_distances or max_distance is not None or len(categories) > 1
+    )
+    depth = n_results
+    while True:
+        memories = []
+        exhausted = True
+        for category in categories:
+            found = _task_store.search(
+                category,
+                search_term,
+                n_results=depth,
+                where=task_filter.where(),
+                include_distances=with_distances,
+                max_distance=max_distance,
+                query_embedding=query_embeddings[category],
+            )
+            if len(found) >= depth:
+                exhausted = False
+            memories.extend(found)
+        if len(categories) > 1:
+            memories.sort(key=lambda memory: memory["distance"])
+        memories = _residual(memories, task_filter)
+        if len(memories) >= n_results or exhausted:
+            break
+        depth *= _search_depth_factor
+    memories = memories[:n_results]
+    if not include_distances:
+        for memory in memories:
+            memory.pop("distance", None)
     return memories
 
 
+def _keyword_search(search_term, task_filter, n_results):
+    """Find tasks by the words of their goal, plan and steps, with their "score"."""
+    index = _get_keyword_index()
+    depth = n_results
+    while True:
+        hits = index.search(
+            search_term, n_results=depth, statuses=task_filter.statuses
+        )
+        memories = _read_tasks([task_id for task_id, _ in hits])
+        missing = [task_id for task_id, _ in hits if task_id not in memories]
+        if len(missing) > 0:
+            # tasks deleted by another process
+            for task_id in missing:
+                index.remove(task_id)
+            continue
+        results = []
+        for task_id, score in hits:
+            memory = memories[task_id]
+            if task_filter.matches(memory):
+                memory["score"] = score
+                results.append(memory)
+        if len(results) >= n_results or len(hits) < depth:
+            return results[:n_results]
+        depth *= _search_depth_factor
+
+
+# reciprocal rank fusion constant: how much the top ranks outweigh the rest
+_rank_fusion_k = 60
+
+
+def _hybrid_search(
+    search_term, task_filter, n_results, include_distances, max_distance
+):
+    """Fuse keyword and vector rankings with reciprocal rank fusion.
+
+    Each task scores 1 / (k + rank) in each ranking it appears in, so the
+    scores of both rankings add up without having to be on the same scale.
+    max_distance only limits the vector ranking; keyword matches have no
+    distance to compare, so they are kept whatever their distance.
+    """
+    depth = n_results * 2
+    keyword = _keyword_search(search_term, task_filter, depth)
+    vector = _vector_search(
+        search_term,
+        task_filter,
+        depth,
+        include_distances or max_distance is not None,
+        max_distance,
+    )
+    found = {}
+    scores = {}
+    for ranking in (keyword, vector):
+        for rank, memory in enumerate(ranking):
+            found.setdefault(memory["id"], memory)
+            if "distance" in memory:
+                found[memory["id"]]["distance"] = memory["distance"]
+            scores[memory["id"]] = scores.get(memory["id"], 0.0) + 1.0 / (
+                _rank_fusion_k + rank + 1
+            )
+    ranked = sorted(scores, key=lambda task_id: (-scores[task_id], task_id))
+    results = []
+    for task_id in ranked[:n_results]:
+        memory = found[task_id]
+        memory["score"] = scores[task_id]
+        if not include_distances:
+            memory.pop("distance", None)
+        results.append(memory)
+    return results
+
+
+def find_similar_task(goal, max_distance=0.1, status="complete"):
+    """Find the task with the goal closest to the given goal.
+
+    Args:
+        goal (str): The goal to compare against.
+        max_distance (float, optional): Maximum embedding distance of a similar goal. Defaults to 0.1.
+        status (str, optional): The status of the tasks to search. Defaults to 'complete'.
+
+    Returns:
+        dict or None: The closest task, with its "distance", or None if no task is close enough.
+    """
+    memories = search_tasks(
+        goal,
+        status=status,
+        n_results=1,
+        include_distances=True,
+        max_distance=max_distance,
+    )
+    return memories[0] if len(memories) > 0 else None
+
+
 def get_task_id(task):
     """Get the ID of a task.
 
     Args:
-        task (dict or int or str): The task to get the ID of.
+        task (dict or Task or int or str): The task to get the ID of.
 
     Returns:
         str: The ID of the task.
     """
-    if isinstance(task, dict):
+    if isinstance(task, (dict, Task)):
         return task["id"]
     elif isinstance(task, int):
         return str(task)
@@ -175,12 +2245,18 @@ def delete_task(task):
         task (dict or int or str): The task to delete.
 
     Returns:
-        dict: The response from the memory deletion operation.
+        None
     """
     log("Deleting task: {}".format(task), log=debug)
-    return delete_memory("task", get_task_id(task))
+    invalidate_task_cache(task)
+    _unindex_task(get_task_id(task))
+    _task_store.delete(step_category, where={"task_id": get_task_id(task)})
+    for category in _task_categories():
+        _task_store.delete(category, ids=[get_task_id(task)])
+    _clear_current_task([get_task_id(task)])
 
 
+@_retry_on_conflict
 def finish_task(task):
     """Mark a task as complete.
 
@@ -188,25 +2264,27 @@ def finish_task(task):
         task (dict or int or str): The task to finish.
 
     Returns:
-        dict: The response from the memory update operation.
+        dict: The updated task.
     """
     log("Finishing task: {}".format(task), log=debug)
     updated_at = datetime.timestamp(datetime.now())
 
-    memory = get_memory("task", get_task_id(task))
+    memory = _read_task(get_task_id(task))
+    _release_current_task(memory)
 
     metadata = memory["metadata"]
+    previous_status = metadata["status"]
     metadata["status"] = "complete"
     metadata["updated_at"] = updated_at
     metadata["current"] = "False"
 
-    return update_memory(
-        "task",
-        get_task_id(task),
-        metadata=metadata,
-    )
+    if _task_category(previous_status) != _task_category("complete"):
+        _move_tasks([(memory, previous_status)])
+        return memory
+    return _write_task(memory)
 
 
+@_retry_on_conflict
 def cancel_task(task):
     """Cancel a task.
 
@@ -214,57 +2292,110 @@ def cancel_task(task):
         task (dict or int or str): The task to cancel.
 
     Returns:
-        dict: The response from the memory update operation.
+        dict: The updated task.
     """
     log("Cancelling task: {}".format(task), log=debug)
     updated_at = datetime.timestamp(datetime.now())
 
-    memory = get_memory("task", get_task_id(task))
+    memory = _read_task(get_task_id(task))
+    _release_current_task(memory)
 
     metadata = memory["metadata"]
+    previous_status = metadata["status"]
     metadata["status"] = "cancelled"
     metadata["updated_at"] = updated_at
     metadata["current"] = "False"
 
-    return update_memory(
-        "task",
-        get_task_id(task),
-        metadata=metadata,
-    )
+    if _task_category(previous_status) != _task_category("cancelled"):
+        _move_tasks([(memory, previous_status)])
+        return memory
+    return _write_task(memory)
 
 
-def get_last_created_task():
+def _recent_tasks(get_ids, fields):
+    """Read the tasks get_ids() returns, keeping their order.
+
+    Ids of tasks deleted by another process are dropped from the recency
+    index and the lookup is repeated.
+    """
+    index = _get_recency_index()
+    while True:
+        task_ids = get_ids(index)
+        memories = _read_tasks(task_ids)
+        missing = [task_id for task_id in task_ids if task_id not in memories]
+        if len(missing) == 0:
+            return _project([memories[task_id] for task_id in task_ids], fields)
+        for task_id in missing:
+            index.remove(task_id)
+
+
+def get_last_created_task(fields=None):
     """
     Get the most recently created task.
 
+    Parameters
+    ----------
+    fields : list, optional
+        Return a Task view keeping only these metadata fields. Defaults to
+        None (the full task dict).
+
     Returns
     -------
-    dict or None
+    dict or Task or None
         The task with the most recent created_at date. If no tasks are found, None is returned.
     """
-    tasks = get_memories("task", include_embeddings=False)
-    sorted_tasks = sorted(
-        tasks, key=lambda x: x["metadata"]["created_at"], reverse=True
-    )
-    log("Last created task: {}".format(len(sorted_tasks)), log=debug)
-    return sorted_tasks[0] if sorted_tasks else None
+    tasks = get_recent_tasks(1, by="created_at", fields=fields)
+    log("Last created task: {}".format(len(tasks)), log=debug)
+    return tasks[0] if tasks else None
 
 
-def get_last_updated_task():
+def get_last_updated_task(fields=None):
     """
     Get the most recently updated task.
 
+    Parameters
+    ----------
+    fields : list, optional
+        Return a Task view keeping only these metadata fields. Defaults to
+        None (the full task dict).
+
     Returns
     -------
-    dict or None
+    dict or Task or None
         The task with the most recent updated_at date. If no tasks are found, None is returned.
     """
-    tasks = get_memories("task", include_embeddings=False)
-    sorted_tasks = sorted(
-        tasks, key=lambda x: x["metadata"]["updated_at"], reverse=True
-    )
-    log("Last updated task: {}".format(len(sorted_tasks)), log=debug)
-    return sorted_tasks[0] if sorted_tasks else None
+    tasks = get_recent_tasks(1, by="updated_at", fields=fields)
+    log("Last updated task: {}".format(len(tasks)), log=debug)
+    return tasks[0] if tasks else None
+
+
+def get_recent_tasks(n=10, by="updated_at", fields=None):
+    """Get the most recently created or updated tasks.
+
+    Args:
+        n (int, optional): How many tasks to return. Defaults to 10.
+        by (str, optional): "created_at" or "updated_at". Defaults to "updated_at".
+        fields (list, optional): Return Task views keeping only these metadata fields. Defaults to None (full task dicts).
+
+    Returns:
+        list: Up to n tasks, newest first.
+    """
+    if by not in ("created_at", "updated_at"):
+        raise ValueError("Unknown recency key: {}".format(by))
+    return _recent_tasks(lambda index: index.latest(n, by=by), fields)
+
+
+def tasks_updated_since(timestamp, fields=None):
+    """Get the tasks updated after a timestamp.
+
+    Args:
+        timestamp (float): The timestamp to compare against.
+        fields (list, optional): Return Task views keeping only these metadata fields. Defaults to None (full task dicts).
+
+    Returns:
+        list: The tasks updated after the timestamp, newest first.
+    """
+    return _recent_tasks(lambda index: index.since(timestamp), fields)
 
 
 def get_task_by_id(task_id):
@@ -281,11 +2412,123 @@ def get_task_by_id(task_id):
     dict or None
         The task with the given ID. If no task is found, None is returned.
     """
-    memory = get_memory("task", task_id)
+    memory = _materialize_steps(_read_task(task_id))
     log("Task with ID {}: {}".format(task_id, memory), log=debug)
     return memory
 
 
+def _lease_holder(memory, now):
+    """Get the owner of a task's unexpired lease, or None."""
+    metadata = memory["metadata"]
+    owner = metadata.get("lease_owner") or None
+    if owner is not None and float(metadata.get("lease_expires_at", 0)) > now:
+        return owner
+    return None
+
+
+def claim_task(task, owner, lease_seconds=60):
+    """Lease a task to an owner, if no one else holds an unexpired lease.
+
+    The lease is kept in the task's "lease_owner" and "lease_expires_at"
+    metadata. Owners renew it with renew_lease while they work on the task;
+    if they stop, the lease expires and the task can be claimed again.
+
+    Args:
+        task (dict or int or str): The task to claim.
+        owner (str): A name identifying the claimant.
+        lease_seconds (float, optional): How long the lease lasts without renewal. Defaults to 60.
+
+    Returns:
+        dict or None: The claimed task, or None if someone else holds it.
+    """
+    task_id = get_task_id(task)
+    with _task_lock(task_id):
+        memory = _read_task(task_id)
+        now = datetime.timestamp(datetime.now())
+        if memory is None or _lease_holder(memory, now) not in (None, owner):
+            return None
+        memory["metadata"]["lease_owner"] = owner
+        memory["metadata"]["lease_expires_at"] = now + lease_seconds
+        try:
+            _write_task(memory)
+        except TaskConflictError:
+            # someone else wrote the task first, possibly claiming it
+            invalidate_task_cache(task_id)
+            return None
+    log("Claimed task {} for {}".format(task_id, owner), log=debug)
+    return memory
+
+
+def claim_next_task(owner, lease_seconds=60, status="in_progress"):
+    """Lease the first task with the given status that isn't leased.
+
+    In-progress tasks are tried in the order next_task would return them.
+
+    Args:
+        owner (str): A name identifying the claimant.
+        lease_seconds (float, optional): How long the lease lasts without renewal. Defaults to 60.
+        status (str, optional): The status of the tasks to claim from. Defaults to 'in_progress'.
+
+    Returns:
+        dict or None: The claimed task, or None if every task is leased.
+    """
+    now = datetime.timestamp(datetime.now())
+    if status == "in_progress":
+        # try the tasks in the order the scheduler would run them
+        candidates = _iter_ready_tasks()
+    else:
+        candidates = iter_tasks(status, chunk_size=50)
+    for memory in candidates:
+        if _lease_holder(memory, now) is None:
+            claimed = claim_task(memory, owner, lease_seconds=lease_seconds)
+            if claimed is not None:
+                return claimed
+    return None
+
+
+@_retry_on_conflict
+def renew_lease(task, owner, lease_seconds=60):
+    """Extend an owner's lease on a task.
+
+    Args:
+        task (dict or int or str): The leased task.
+        owner (str): The owner of the lease.
+        lease_seconds (float, optional): How long the lease lasts from now. Defaults to 60.
+
+    Returns:
+        bool: False if the lease was lost to another owner or the task is gone.
+    """
+    memory = _read_task(get_task_id(task))
+    now = datetime.timestamp(datetime.now())
+    if memory is None or memory["metadata"].get("lease_owner") != owner:
+        return False
+    if _lease_holder(memory, now) not in (None, owner):
+        return False
+    memory["metadata"]["lease_expires_at"] = now + lease_seconds
+    _write_task(memory)
+    return True
+
+
+@_retry_on_conflict
+def release_task(task, owner):
+    """Give up an owner's lease on a task.
+
+    Args:
+        task (dict or int or str): The leased task.
+        owner (str): The owner of the lease.
+
+    Returns:
+        bool: False if the task wasn't leased to the owner.
+    """
+    memory = _read_task(get_task_id(task))
+    if memory is None or memory["metadata"].get("lease_owner") != owner:
+        return False
+    memory["metadata"]["lease_owner"] = ""
+    memory["metadata"]["lease_expires_at"] = 0
+    _write_task(memory)
+    return True
+
+
 def get_current_task():
     """
     Get the current active task.
@@ -295,58 +2538,113 @@ def get_current_task():
     dict or None
         The task marked as the current active task. If no current task is found, None is returned.
     """
-    memory = get_memories(
-        "task", filter_metadata={"current": "True"}, include_embeddings=False
-    )
-    if len(memory) > 0:
-        log("Current task: {}".format(memory[0]), log=debug)
-        return memory[0]
+    task_id = _get_current_task_id()
+    memory = _read_task(task_id) if task_id is not None else None
+    if task_id is not None and memory is None:
+        # the task was deleted without clearing the pointer, by another
+        # process or an older version
+        _clear_current_task([task_id])
+    if memory is not None and memory["metadata"].get("current") == "True":
+        log("Current task: {}".format(memory), log=debug)
+        return _materialize_steps(memory)
     else:
         log("No current task found", log=debug)
         return None
 
 
-def set_current_task(task):
+def set_current_task(task=None):
     """Set a task as the current task.
 
     Args:
-        task (dict or int or str): The task to be set as current.
+        task (dict or int or str, optional): The task to be set as current. Defaults to None (the task
+            next_task returns).
 
     Returns:
         dict: The response from the memory update operation.
     """
-    task_id = get_task_id
+    if task is None:
+        task = next_task()
+        if task is None:
+            log("No task is ready to be set as current", log=debug)
+            return None
+    return _set_current_task(task)
 
-    memories = get_memories(
-        "task", filter_metadata={"current": "True"}, include_embeddings=False
-    )
 
-    for memory in memories:
-        metadata = memory["metadata"]
-        metadata["current"] = "False"
-        update_memory("task", memory["id"], metadata=metadata)
+@_retry_on_conflict
+def _set_current_task(task):
+    task_id = get_task_id(task)
     log("Setting current task: {}".format(task), log=debug)
-    metadata = memory["metadata"]
-    metadata["current"] = "True"
-    return update_memory("task", task_id, metadata=metadata)
+    _switch_current_task(task_id)
+    memory = _read_task(task_id)
+    memory["metadata"]["current"] = "True"
+    return _write_task(memory)
 
 
-def create_plan(goal, model="gpt-3.5-turbo-0613"):
+def create_plan(goal, model="gpt-3.5-turbo-0613", use_cache=True, example_plan=None):
     """Create a plan for the goal using OpenAI API.
 
     Args:
         goal (str): The goal for which to create the plan.
         model (str, optional): The OpenAI model to use for AI operations. Defaults to 'gpt-3.5-turbo-0613'.
+        use_cache (bool, optional): Whether to use the generation cache, if enabled. Defaults to True.
+        example_plan (str, optional): A plan for a similar goal to base the new plan on. Defaults to None.
 
     Returns:
         str: The generated plan.
     """
-    response = openai_text_call(
-        compose_prompt(planning_prompt, {"goal": goal}), debug=debug, model=model
-    )
-    return response["text"]
+    if example_plan is None:
+        prompt = compose_prompt(planning_prompt, {"goal": goal})
+    else:
+        prompt = compose_prompt(
+            planning_example_prompt, {"goal": goal, "example_plan": example_plan}
+        )
+
+    def generate():
+        response = openai_text_call(prompt, debug=debug, model=model)
+        return response["text"]
+
+    return _generate(prompt, model, use_cache, generate)
+
+
+def create_plan_and_steps(
+    goal, model="gpt-3.5-turbo-0613", use_cache=True, example_plan=None
+):
+    """Create a plan and the steps to carry it out with a single OpenAI API call.
+
+    Args:
+        goal (str): The goal for which to create the plan and steps.
+        model (str, optional): The OpenAI model to use for AI operations. Defaults to 'gpt-3.5-turbo-0613'.
+        use_cache (bool, optional): Whether to use the generation cache, if enabled. Defaults to True.
+        example_plan (str, optional): A plan for a similar goal to base the new plan on. Defaults to None.
+
+    Returns:
+        dict: A dict with the generated "plan" string and "steps" list.
+    """
+    log("Creating plan and steps for goal: {}".format(goal), log=debug)
+    if example_plan is None:
+        prompt = compose_prompt(plan_and_steps_prompt, {"goal": goal})
+    else:
+        prompt = compose_prompt(
+            plan_and_steps_example_prompt, {"goal": goal, "example_plan": example_plan}
+        )
+
+    def generate():
+        response = openai_function_call(
+            text=prompt,
+            functions=[plan_and_steps_function],
+            function_call="create_plan_and_steps",
+            debug=debug,
+            model=model,
+        )
+        return {
+            "plan": response["arguments"]["plan"],
+            "steps": response["arguments"]["steps"],
+        }
+
+    return _generate(prompt, model, use_cache, generate)
 
 
+@_retry_on_conflict
 def update_plan(task, plan):
     """Update the plan for a task.
 
@@ -355,42 +2653,46 @@ def update_plan(task, plan):
         plan (str): The new plan.
 
     Returns:
-        None
+        dict: The updated task.
     """
     task_id = get_task_id(task)
     log("Updating plan for task: {}".format(task), log=debug)
-    memory = get_memory("task", task_id)
+    memory = _read_task(task_id)
     metadata = memory["metadata"]
     metadata["plan"] = plan
     metadata["updated_at"] = datetime.timestamp(datetime.now())
-    update_memory("task", task_id, metadata=metadata)
+    return _write_task(memory)
 
 
-def create_steps(goal, plan, model="gpt-3.5-turbo-0613"):
+def create_steps(goal, plan, model="gpt-3.5-turbo-0613", use_cache=True):
     """Create a series of steps based on the plan and the goal using OpenAI API.
 
     Args:
         goal (str): The goal for which to create the steps.
         plan (str): The plan based on which to create the steps.
         model (str, optional): The OpenAI model to use for AI operations. Defaults to 'gpt-3.5-turbo-0613'.
+        use_cache (bool, optional): Whether to use the generation cache, if enabled. Defaults to True.
 
     Returns:
         list: The generated steps.
     """
     log("Creating steps for goal: {}".format(goal), log=debug)
-    updated_at = datetime.timestamp(datetime.now())
-    response = openai_function_call(
-        text=compose_prompt(
-            step_creation_prompt, {"goal": goal, "plan": plan, "updated_at": updated_at}
-        ),
-        functions=[step_creation_function],
-        function_call="create_steps",
-        debug=debug,
-        model=model,
-    )
-    return response["arguments"]["steps"]
+    prompt = compose_prompt(step_creation_prompt, {"goal": goal, "plan": plan})
+
+    def generate():
+        response = openai_function_call(
+            text=prompt,
+            functions=[step_creation_function],
+            function_call="create_steps",
+            debug=debug,
+            model=model,
+        )
+        return response["arguments"]["steps"]
+
+    return _generate(prompt, model, use_cache, generate)
 
 
+@_retry_on_conflict
 def update_step(task, step):
     """
     Update a step in a task.
@@ -399,8 +2701,10 @@ def update_step(task, step):
     ----------
     task : dict
         The task in which the step is to be updated.
-    step : dict
-        The step which is to be updated.
+    step : dict or Step
+        The step which is to be updated. A Step read with get_steps is
+        written directly; a dict, or a Step whose record no longer exists
+        or belongs to another task, updates every step with the same content.
 
     Returns
     -------
@@ -408,23 +2712,52 @@ def update_step(task, step):
         The updated task after updating the step.
     """
     task_id = get_task_id(task)
-    task = get_memory("task", task_id)
-    metadata = task["metadata"]
-    metadata["steps"] = json.loads(metadata["steps"])
-
-    for s in metadata["steps"]:
-        if s["content"] == step["content"]:
-            s["completed"] = step["completed"]
+    task = _read_task(task_id)
+
+    previous = None
+    if (
+        isinstance(step, Step)
+        and step.id is not None
+        and str(step.task_id) == str(task_id)
+        and _uses_step_records(task)
+    ):
+        records = _task_store.get(step_category, ids=[step.id])
+        if len(records) > 0 and str(records[0]["metadata"]["task_id"]) == str(task_id):
+            previous = records[0]
+
+    if previous is not None:
+        log("Updating step for task: {}\nStep is: {}".format(task, step), log=debug)
+        was_completed = previous["metadata"]["completed"] == "True"
+        if _advance_step_cursor(task, step, was_completed):
+            return _save_steps(task, None, changed=[step])
+        steps = [s if s.ordinal != step.ordinal else step for s in _load_steps(task)]
+        return _save_steps(task, steps, changed=[step])
+
+    if isinstance(step, Step):
+        step = step.to_dict()
+
+    index = _get_step_index(task)
+    positions = [
+        p for p in index.find(step["content"]) if index.steps[p].content == step["content"]
+    ]
+    if len(positions) == 1:
+        log("Updating step for task: {}\nStep is: {}".format(task, step), log=debug)
+        return _set_step_completed(task, index, positions[0], step["completed"])
+
+    steps = index.copy_steps()
+    changed = []
+    for p in positions:
+        steps[p].completed = step["completed"]
+        changed.append(steps[p])
 
-    metadata["steps"] = json.dumps(metadata["steps"])
-    metadata["updated_at"] = datetime.timestamp(datetime.now())
     log(
-        "Updating step for task: {}\nSteps are: {}".format(task, metadata["steps"]),
+        "Updating step for task: {}\nSteps are: {}".format(task, steps),
         log=debug,
     )
-    return update_memory("task", task_id, metadata=metadata)
+    return _save_steps(task, steps, changed=changed)
 
 
+@_retry_on_conflict
 def add_step(task, step):
     """
     Add a step to a task.
@@ -442,51 +2775,75 @@ def add_step(task, step):
         The updated task after adding the step.
     """
     task_id = get_task_id(task)
-    task = get_memory("task", task_id)
+    task = _read_task(task_id)
     metadata = task["metadata"]
-    steps = json.loads(metadata["steps"])
-    steps.append({"content": step, "completed": False})
-    metadata["steps"] = json.dumps(steps)
+
+    if _uses_step_records(task):
+        steps = None
+        ordinal = int(metadata["next_ordinal"])
+        metadata["next_ordinal"] = ordinal + 1
+        metadata["step_count"] = int(metadata["step_count"]) + 1
+        if int(metadata["next_step_index"]) < 0:
+            metadata["next_step_index"] = ordinal
+            metadata["next_step"] = step
+    else:
+        steps = _load_steps(task)
+        ordinal = len(steps)
+
+    new_step = Step(step, False, task_id=task_id, ordinal=ordinal)
+    if steps is not None:
+        steps.append(new_step)
     log(
-        "Adding step for task: {}\nSteps are: {}".format(task, metadata["steps"]),
+        "Adding step for task: {}\nStep is: {}".format(task, new_step),
         log=debug,
     )
-    metadata["updated_at"] = datetime.timestamp(datetime.now())
-    return update_memory("task", task_id, metadata=metadata)
+    return _save_steps(task, steps, added=[new_step])
 
 
-def finish_step(task, step):
+@_retry_on_conflict
+def finish_step(task, step, min_score=0.5):
     """
     Mark a step in a task as completed.
 
+    Only the single best matching step is completed: a step with the same
+    words as the given text if there is one, otherwise the step sharing
+    the most words with it. Incomplete steps win ties.
+
     Parameters
     ----------
     task : dict
         The task containing the step to be marked as completed.
     step : str
         The step which is to be marked as completed.
+    min_score : float, optional
+        The lowest word overlap score accepted as a match, from 0 to 1.
+        Defaults to 0.5.
 
     Returns
     -------
-    dict
-        The updated task after marking the step as completed.
+    dict or None
+        The updated task after marking the step as completed, or None if
+        no step matches or the matching step is already completed.
     """
     task_id = get_task_id(task)
-    task = get_memory("task", task_id)
-    metadata = task["metadata"]
-    steps = json.loads(metadata["steps"])
-    for s in steps:
-        if step.lower() in s["content"].lower() or s["content"].lower() in step.lower():
-            s["completed"] = True
-    metadata["steps"] = json.dumps(steps)
+    task = _read_task(task_id)
+    index = _get_step_index(task)
+    position, score = index.match(step, min_score=min_score)
+    if position is None:
+        log("No step matches: {} (best score {})".format(step, score), log=debug)
+        return None
     log(
-        "Finishing step for task: {}\nSteps are: {}".format(task, metadata["steps"]),
+        "Finishing step for task: {}\nStep is: {} (score {})".format(
+            task, index.steps[position], score
+        ),
         log=debug,
     )
-    metadata["updated_at"] = datetime.timestamp(datetime.now())
-    return update_memory("task", task_id, metadata=metadata)
+    if index.steps[position].completed:
+        return None
+    return _set_step_completed(task, index, position, True)
 
 
+@_retry_on_conflict
 def cancel_step(task, step):
     """
     Remove a step from a task.
@@ -504,93 +2861,322 @@ def cancel_step(task, step):
         The updated task after removing the step.
     """
     task_id = get_task_id(task)
-    task = get_memory("task", task_id)
-    metadata = task["metadata"]
-    steps = metadata["steps"]
-    steps = json.loads(steps)
-    steps = [s for s in steps if s["content"] != step]
-    metadata["steps"] = json.dumps(steps)
-    metadata["updated_at"] = datetime.timestamp(datetime.now())
+    task = _read_task(task_id)
+    index = _get_step_index(task)
+    steps = index.copy_steps()
+    positions = set(p for p in index.find(step) if steps[p].content == step)
+    removed = [steps[p] for p in sorted(positions)]
+    steps = [s for p, s in enumerate(steps) if p not in positions]
     log(
-        "Cancelling step for task: {}\nSteps are: {}".format(task, metadata["steps"]),
+        "Cancelling step for task: {}\nSteps are: {}".format(task, steps),
         log=debug,
     )
-    return update_memory("task", task_id, metadata=metadata)
+    return _save_steps(task, steps, removed=removed)
 
 
 def get_next_step(task):
     """
-    This function will get the task, unpack the string to a dict from the
-    "steps" object in task["metadata"], find the first step in the list
-    that hasn't been completed and return it
+    This function will get the first step of the task that hasn't been
+    completed and return it. Tasks written by this version keep the next
+    step in task["metadata"], so no steps need to be loaded; older tasks
+    fall back to loading their steps and scanning them
     """
 
-    # First, get the steps from the task metadata
-    steps = json.loads(task["metadata"]["steps"])
+    task = _whole_task(task)
+    metadata = task["metadata"]
+
+    # Use the maintained cursor if the task has one
+    if "next_step_index" in metadata:
+        if int(metadata["next_step_index"]) < 0:
+            return None
+        return {"content": metadata["next_step"], "completed": False}
+
+    # Otherwise, get the steps of the task
+    steps = _load_steps(task)
 
     # Loop through each step to find the first one that isn't completed
     for step in steps:
-        if not step["completed"]:
+        if not step.completed:
             # If a step is not completed, return it
-            return step
+            return step.to_dict()
 
     # If all steps are completed, return None
     return None
 
 
+def get_task_progress(task):
+    """Get the percentage of a task's steps that are completed.
+
+    Args:
+        task (dict or int or str): The task to get the progress of.
+
+    Returns:
+        float: The percentage of completed steps, from 0 to 100. A task with no steps is 100.
+    """
+    if not isinstance(task, (dict, Task)) or "metadata" not in task:
+        task = _read_task(get_task_id(task))
+    task = _whole_task(task)
+    metadata = task["metadata"]
+    if "completed_count" in metadata:
+        completed_count = int(metadata["completed_count"])
+        step_count = int(metadata["step_count"])
+    else:
+        steps = _load_steps(task)
+        completed_count = len([step for step in steps if step.completed])
+        step_count = len(steps)
+    if step_count == 0:
+        return 100.0
+    return 100.0 * completed_count / step_count
+
+
+# rendered tasks, keyed by task id, updated_at and the include_* flags
+_render_cache = LRUCache(max_size=256)
+# the rendered step lines of each task, so re-rendering a task after one of
+# its steps changed only formats that step
+_step_line_cache = LRUCache(max_size=256)
+
+
+def enable_render_cache(max_size=256):
+    """Memoize get_task_as_formatted_string.
+
+    Renders are keyed by the task's id and updated_at, so a task renders
+    again as soon as it is written. The render cache is enabled by default.
+
+    Args:
+        max_size (int, optional): Maximum number of renders to keep. Defaults to 256.
+    """
+    global _render_cache, _step_line_cache
+    _render_cache = LRUCache(max_size=max_size)
+    _step_line_cache = LRUCache(max_size=max_size)
+
+
+def disable_render_cache():
+    """Render tasks from scratch on every get_task_as_formatted_string call."""
+    global _render_cache, _step_line_cache
+    _render_cache = None
+    _step_line_cache = None
+
+
+def get_render_cache_stats():
+    """Get hit, miss and size counters for the render cache.
+
+    Returns:
+        dict or None: A dict with "hits", "misses" and "size" keys, or None if the cache is disabled.
+    """
+    if _render_cache is None:
+        return None
+    return _render_cache.stats()
+
+
+def _render_step_lines(task_id, steps):
+    """Format a line per step, reusing the lines of steps that didn't change."""
+    previous = ()
+    if _step_line_cache is not None and task_id is not None:
+        previous = _step_line_cache.get(task_id, ())
+    lines = []
+    for i, step in enumerate(steps):
+        state = (step.content, step.completed)
+        if i < len(previous) and previous[i][0] == state:
+            lines.append(previous[i])
+        else:
+            line = "{}: {}".format(
+                step.content, "Completed" if step.completed else "Not completed"
+            )
+            lines.append((state, line))
+    if _step_line_cache is not None and task_id is not None:
+        _step_line_cache.set(task_id, lines)
+    return [line for _, line in lines]
+
+
+def estimate_tokens(text):
+    """Estimate how many tokens a text is, without a tokenizer.
+
+    Uses the common rule of thumb of four characters per token, which is
+    close for English text and costs nothing to compute.
+
+    Args:
+        text (str): The text to measure.
+
+    Returns:
+        int: The estimated number of tokens.
+    """
+    return (len(text) + 3) // 4
+
+
+def _char_budget(max_tokens, max_chars):
+    """Get the number of characters allowed by a token and character budget."""
+    budgets = []
+    if max_tokens is not None:
+        budgets.append(max_tokens * 4)
+    if max_chars is not None:
+        budgets.append(max_chars)
+    return min(budgets) if budgets else None
+
+
+def _truncate(text, limit):
+    """Cut text down to limit characters, marking the cut with "..."."""
+    if len(text) <= limit:
+        return text
+    if limit < 3:
+        return text[:limit]
+    return text[: limit - 3].rstrip() + "..."
+
+
+def _render_within_budget(metadata, current_step, steps, flags, budget):
+    """Render a task in at most budget characters.
+
+    The goal comes first, then the current step, the status and the
+    incomplete steps in order. Completed steps are counted rather than
+    listed, and the plan gets whatever room is left.
+    """
+    include_plan, include_status, include_steps = flags
+    lines = {"goal": _truncate("Current Task: {}".format(metadata["goal"]), budget)}
+    used = len(lines["goal"])
+
+    def fits(line):
+        return used + 1 + len(line) <= budget
+
+    candidates = []
+    if current_step is not None:
+        candidates.append(
+            ("current_step", "Current Step: {}".format(current_step["content"]))
+        )
+    if include_status:
+        candidates.append(("status", "Status: {}".format(metadata["status"])))
+    for name, line in candidates:
+        if fits(line):
+            lines[name] = line
+            used += 1 + len(line)
+
+    if include_steps:
+        completed = len([step for step in steps if step.completed])
+        remaining = [step for step in steps if not step.completed]
+        items = ["{} completed".format(completed)] if completed > 0 else []
+        shown = 0
+        for step in remaining:
+            item = "{}: Not completed".format(step.content)
+            # leave room to say how many steps were left out
+            left_out = len(remaining) - shown - 1
+            more = ["... {} more".format(left_out)] if left_out > 0 else []
+            if not fits("Steps: " + ", ".join(items + [item] + more)):
+                break
+            items.append(item)
+            shown += 1
+        if shown < len(remaining):
+            more = items + ["... {} more".format(len(remaining) - shown)]
+            if fits("Steps: " + ", ".join(more)):
+                items = more
+        line = "Steps: " + ", ".join(items)
+        if len(items) > 0 and fits(line):
+            lines["steps"] = line
+            used += 1 + len(line)
+
+    if include_plan:
+        room = budget - used - 1 - len("Plan: ")
+        if room >= 20:
+            lines["plan"] = "Plan: {}".format(_truncate(metadata["plan"], room))
+
+    order = ["goal", "plan", "status", "current_step", "steps"]
+    return "\n".join(lines[name] for name in order if name in lines)
+
+
 def get_task_as_formatted_string(
     task,
     include_current_step=True,
     include_plan=True,
     include_status=True,
     include_steps=True,
+    max_tokens=None,
+    max_chars=None,
 ):
     """
     This function will return a string representation of the task,
-    including the plan, status and steps based on the arguments provided
+    including the plan, status and steps based on the arguments provided.
+    Renders of stored tasks are cached until the task is next updated.
+    With max_tokens or max_chars, the goal, current step and next
+    incomplete steps are kept first, completed steps are counted instead
+    of listed, and the plan is truncated to fit
     """
 
+    task = _whole_task(task)
+    metadata = task["metadata"]
+    task_id = task["id"] if "id" in task else None
+
+    # Tasks that were never stored have no id or updated_at to key them by
+    key = None
+    if _render_cache is not None and task_id is not None and "updated_at" in metadata:
+        key = (
+            task_id,
+            metadata["updated_at"],
+            include_current_step,
+            include_plan,
+            include_status,
+            include_steps,
+            max_tokens,
+            max_chars,
+        )
+        rendered = _render_cache.get(key)
+        if rendered is not None:
+            return rendered
+
+    # Load the steps at most once, for both the current step and the list
+    steps = None
+    if include_steps or (include_current_step and "next_step_index" not in metadata):
+        steps = _load_steps(task)
+
+    current_step = None
+    if include_current_step:
+        # find the first step that isn't completed
+        if "next_step_index" in metadata:
+            current_step = get_next_step(task)
+        else:
+            current_step = next(
+                (step.to_dict() for step in steps if not step.completed), None
+            )
+
+    budget = _char_budget(max_tokens, max_chars)
+    if budget is not None:
+        flags = (include_plan, include_status, include_steps)
+        rendered = _render_within_budget(metadata, current_step, steps, flags, budget)
+        if key is not None:
+            _render_cache.set(key, rendered)
+        return rendered
+
     # Define an empty list to store the task details
     task_details = []
 
-    task_details.append("Current Task: {}".format(task["metadata"]["goal"]))
+    task_details.append("Current Task: {}".format(metadata["goal"]))
 
     # Append each detail to the list based on the arguments
     if include_plan:
-        task_details.append("Plan: {}".format(task["metadata"]["plan"]))
+        task_details.append("Plan: {}".format(metadata["plan"]))
 
     if include_status:
-        task_details.append("Status: {}".format(task["metadata"]["status"]))
+        task_details.append("Status: {}".format(metadata["status"]))
 
-    # For the steps, since it's a list, we need to format each step separately
-    steps = json.loads(task["metadata"]["steps"])
-
-    if include_current_step:
-        # find the first step that isn't completed
-        current_step = get_next_step(task)
-        if current_step is not None:
-            task_details.append("Current Step: {}".format(current_step["content"]))
+    if current_step is not None:
+        task_details.append("Current Step: {}".format(current_step["content"]))
 
     if include_steps:
-        formatted_steps = ", ".join(
-            [
-                "{}: {}".format(
-                    step["content"],
-                    "Completed" if step["completed"] else "Not completed",
-                )
-                for step in steps
-            ]
-        )
+        # For the steps, since it's a list, we need to format each step separately
+        formatted_steps = ", ".join(_render_step_lines(task_id, steps))
         task_details.append("Steps: {}".format(formatted_steps))
 
     # Finally, join all the task details into a single string and return it
-    return "\n".join(task_details)
+    rendered = "\n".join(task_details)
+    if key is not None:
+        _render_cache.set(key, rendered)
+    return rendered
 
 
-def list_tasks_as_formatted_string():
+def list_tasks_as_formatted_string(max_tokens=None, max_chars=None):
     """
     Retrieve and format a list of all current tasks.
 
+    Args:
+        max_tokens (int, optional): Estimated token budget for the whole list. Defaults to None (no limit).
+        max_chars (int, optional): Character budget for the whole list. Defaults to None (no limit).
+
     Returns:
         str: Formatted string containing details of all current tasks.
     """
@@ -598,12 +3184,67 @@ def list_tasks_as_formatted_string():
     # Get all tasks
     tasks = list_tasks()
 
+    # Split the budget evenly between the tasks
+    budget = _char_budget(max_tokens, max_chars)
+    share = None
+    if budget is not None and len(tasks) > 0:
+        share = max((budget - len(tasks) + 1) // len(tasks), 0)
+
     # Define an empty list to store the task details
     task_details = []
 
-    # Loop through each task and append the formatted string to the list
+    # Loop through each task and append the formatted string to the list,
+    # reusing the cached render of tasks that haven't changed
     for task in tasks:
-        task_details.append(get_task_as_formatted_string(task))
+        task_details.append(get_task_as_formatted_string(task, max_chars=share))
 
     # Finally, join all the task details into a single string and return it
     return "\n".join(task_details)
+
+
+def write_tasks_as_formatted_string(
+    file,
+    status="in_progress",
+    sort_by=None,
+    chunk_size=100,
+    include_current_step=True,
+    include_plan=True,
+    include_status=True,
+    include_steps=True,
+    max_tokens=None,
+    max_chars=None,
+):
+    """
+    Write the formatted details of every task with the given status to a file.
+
+    Tasks are read chunk_size at a time and written one by one, so the
+    whole listing is never held in memory.
+
+    Args:
+        file: A file-like object with a write method.
+        status (str, optional): The status of the tasks to write, or None for every status. Defaults to 'in_progress'.
+        sort_by (str, optional): "created_at" or "updated_at". Defaults to None (store order).
+        chunk_size (int, optional): How many tasks to read at once. Defaults to 100.
+        max_tokens (int, optional): Estimated token budget for each task. Defaults to None (no limit).
+        max_chars (int, optional): Character budget for each task. Defaults to None (no limit).
+
+    Returns:
+        int: The number of tasks written.
+    """
+    count = 0
+    for task in iter_tasks(status, sort_by=sort_by, chunk_size=chunk_size):
+        if count > 0:
+            file.write("\n")
+        file.write(
+            get_task_as_formatted_string(
+                task,
+                include_current_step=include_current_step,
+                include_plan=include_plan,
+                include_status=include_status,
+                include_steps=include_steps,
+                max_tokens=max_tokens,
+                max_chars=max_chars,
+            )
+        )
+        count += 1
+    return count
@@ -0,0 +1,122 @@
+import heapq
+import threading
+
+
+class TaskScheduler:
+    """A priority heap of the in-progress tasks that are ready to run.
+
+    Tasks are ordered by highest priority, then earliest deadline, then
+    oldest. A task is ready once none of the tasks it depends on is in
+    progress; tasks waiting on a dependency are kept aside and pushed onto
+    the heap when their last dependency finishes. A dependency doesn't have
+    to be in the scheduler itself, and is waited on until it is removed.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._keys = {}
+        self._waiting_on = {}
+        self._dependents = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(priority=0, deadline=None, created_at=0):
+        """Get the sort key of a task.
+
+        Args:
+            priority (int, optional): Higher priorities run first. Defaults to 0.
+            deadline (float, optional): Earlier deadlines run first. Defaults to None (no deadline).
+            created_at (float, optional): Older tasks run first. Defaults to 0.
+
+        Returns:
+            tuple: The key, smallest first.
+        """
+        return (
+            -float(priority),
+            float(deadline) if deadline is not None else float("inf"),
+            float(created_at),
+        )
+
+    def update(self, task_id, key=None, depends_on=()):
+        """Add or update an in-progress task, or remove a task that isn't.
+
+        Args:
+            task_id (str): The id of the task.
+            key (tuple, optional): The task's sort key, or None if it isn't in progress. Defaults to None.
+            depends_on (list, optional): The ids of the unfinished tasks it waits for. Defaults to ().
+        """
+        with self._lock:
+            if key is None:
+                self._remove(task_id)
+                return
+            previous = self._keys.get(task_id)
+            waiting_on = set(depends_on)
+            waiting_on.discard(task_id)
+            if previous == key and waiting_on == self._waiting_on.get(task_id, set()):
+                return
+            self._keys[task_id] = key
+            self._set_waiting_on(task_id, waiting_on)
+            if len(waiting_on) == 0:
+                heapq.heappush(self._heap, (key, task_id))
+
+    def remove(self, task_id):
+        """Remove a task, unblocking the tasks that wait for it.
+
+        Args:
+            task_id (str): The id of the task.
+        """
+        with self._lock:
+            self._remove(task_id)
+
+    def _set_waiting_on(self, task_id, waiting_on):
+        for dependency in self._waiting_on.pop(task_id, ()):
+            self._dependents.get(dependency, set()).discard(task_id)
+        if len(waiting_on) > 0:
+            self._waiting_on[task_id] = waiting_on
+            for dependency in waiting_on:
+                self._dependents.setdefault(dependency, set()).add(task_id)
+
+    def _remove(self, task_id):
+        # a task that was never added may still be waited on
+        if self._keys.pop(task_id, None) is not None:
+            self._set_waiting_on(task_id, set())
+        for dependent in self._dependents.pop(task_id, ()):
+            waiting_on = self._waiting_on.get(dependent)
+            if waiting_on is None:
+                continue
+            waiting_on.discard(task_id)
+            if len(waiting_on) == 0:
+                del self._waiting_on[dependent]
+                heapq.heappush(self._heap, (self._keys[dependent], dependent))
+
+    def _is_ready(self, key, task_id):
+        return self._keys.get(task_id) == key and task_id not in self._waiting_on
+
+    def ready(self, n=1):
+        """Get the ids of the next ready tasks without removing them.
+
+        Args:
+            n (int, optional): How many ids to return. Defaults to 1.
+
+        Returns:
+            list: Up to n task ids, the one to run first first.
+        """
+        with self._lock:
+            popped = []
+            seen = set()
+            while len(popped) < n and len(self._heap) > 0:
+                key, task_id = heapq.heappop(self._heap)
+                # entries of updated, removed or blocked tasks are dropped
+                # lazily, as are duplicates of the same entry
+                if self._is_ready(key, task_id) and task_id not in seen:
+                    seen.add(task_id)
+                    popped.append((key, task_id))
+            for entry in popped:
+                heapq.heappush(self._heap, entry)
+            return [task_id for _, task_id in popped]
+
+    def __contains__(self, task_id):
+        return task_id in self._keys
+
+    def __len__(self):
+        return len(self._keys)
@@ -0,0 +1,209 @@
+import re
+
+
+def step_id(task_id, ordinal):
+    """Get the id of a step record.
+
+    Args:
+        task_id (str): The id of the task the step belongs to.
+        ordinal (int): The position of the step within its task.
+
+    Returns:
+        str: The id of the step record.
+    """
+    return "{}:{}".format(task_id, ordinal)
+
+
+class Step:
+    """A single step of a task.
+
+    Args:
+        content (str): The text of the step.
+        completed (bool, optional): Whether the step is done. Defaults to False.
+        task_id (str, optional): The id of the task the step belongs to. Defaults to None.
+        ordinal (int, optional): The position of the step within its task. Defaults to None.
+    """
+
+    __slots__ = ("content", "completed", "task_id", "ordinal")
+
+    def __init__(self, content, completed=False, task_id=None, ordinal=None):
+        self.content = content
+        self.completed = completed
+        self.task_id = task_id
+        self.ordinal = ordinal
+
+    @property
+    def id(self):
+        """str: The id of the step record, or None for unsaved steps."""
+        if self.task_id is None or self.ordinal is None:
+            return None
+        return step_id(self.task_id, self.ordinal)
+
+    @classmethod
+    def from_memory(cls, memory):
+        """Build a step from a "task_step" memory.
+
+        Args:
+            memory (dict): The memory as returned by agentmemory.
+
+        Returns:
+            Step: The step.
+        """
+        metadata = memory["metadata"]
+        return cls(
+            memory["document"],
+            completed=metadata["completed"] == "True",
+            task_id=metadata["task_id"],
+            ordinal=int(metadata["ordinal"]),
+        )
+
+    def to_dict(self):
+        """Get the step in the format stored in a task's "steps" JSON.
+
+        Returns:
+            dict: A dict with "content" and "completed" keys.
+        """
+        return {"content": self.content, "completed": self.completed}
+
+    def to_metadata(self):
+        """Get the metadata stored on the step's memory.
+
+        Returns:
+            dict: The step metadata.
+        """
+        return {
+            "task_id": self.task_id,
+            "ordinal": self.ordinal,
+            "completed": "True" if self.completed else "False",
+        }
+
+    def __repr__(self):
+        return "Step({!r}, completed={!r}, task_id={!r}, ordinal={!r})".format(
+            self.content, self.completed, self.task_id, self.ordinal
+        )
+
+
+def normalize_step(content):
+    """Normalize step content for matching.
+
+    Args:
+        content (str): The text of a step.
+
+    Returns:
+        str: The lowercased words of the step, separated by single spaces.
+    """
+    return " ".join(re.findall(r"\w+", content.lower()))
+
+
+class StepIndex:
+    """Lookup tables over the steps of one task.
+
+    Steps can be found by ordinal, by normalized content through a hash
+    lookup, or fuzzily through an inverted index of their words, so a
+    match only looks at steps that share a word with the query.
+
+    Args:
+        steps (list): The task's steps as Steps, in order.
+        version (optional): The task's updated_at when the steps were read. Defaults to None.
+    """
+
+    def __init__(self, steps, version=None):
+        self.steps = list(steps)
+        self.version = version
+        self._by_ordinal = {}
+        self._by_content = {}
+        self._by_token = {}
+        self._tokens = []
+        for position, step in enumerate(self.steps):
+            normalized = normalize_step(step.content)
+            tokens = frozenset(normalized.split())
+            self._tokens.append(tokens)
+            self._by_ordinal[step.ordinal] = position
+            self._by_content.setdefault(normalized, []).append(position)
+            for token in tokens:
+                self._by_token.setdefault(token, []).append(position)
+
+    def get(self, ordinal):
+        """Get a step by its ordinal.
+
+        Args:
+            ordinal (int): The position of the step within its task.
+
+        Returns:
+            Step or None: The step, or None if there is none with that ordinal.
+        """
+        position = self._by_ordinal.get(ordinal)
+        return self.steps[position] if position is not None else None
+
+    def find(self, content):
+        """Get the positions of the steps with the same normalized content.
+
+        Args:
+            content (str): The step text to look up.
+
+        Returns:
+            list: The positions of the matching steps, in order.
+        """
+        return list(self._by_content.get(normalize_step(content), ()))
+
+    def match(self, content, min_score=0.5):
+        """Find the single step that best matches a text.
+
+        An exact match of the normalized content scores 1. Otherwise steps
+        are scored by the overlap of their words with the text's words
+        (2 * shared / (words in text + words in step)). Ties go to
+        incomplete steps, then to the earliest step.
+
+        Args:
+            content (str): The text to match.
+            min_score (float, optional): The lowest score accepted as a match. Defaults to 0.5.
+
+        Returns:
+            tuple: The position of the best step and its score, or (None, best score) if no step scores min_score.
+        """
+        exact = self.find(content)
+        if len(exact) > 0:
+            incomplete = [p for p in exact if not self.steps[p].completed]
+            return (incomplete or exact)[0], 1.0
+
+        query = frozenset(normalize_step(content).split())
+        overlaps = {}
+        for token in query:
+            for position in self._by_token.get(token, ()):
+                overlaps[position] = overlaps.get(position, 0) + 1
+
+        best, best_key = None, (0.0,)
+        for position, overlap in overlaps.items():
+            score = 2.0 * overlap / (len(query) + len(self._tokens[position]))
+            key = (score, not self.steps[position].completed, -position)
+            if key > best_key:
+                best, best_key = position, key
+        if best is None or best_key[0] < min_score:
+            return None, best_key[0]
+        return best, best_key[0]
+
+    def set_completed(self, position, completed):
+        """Mark the step at a position as completed or not.
+
+        Args:
+            position (int): The position of the step.
+            completed (bool): Whether the step is done.
+        """
+        step = self.steps[position]
+        self.steps[position] = Step(
+            step.content, completed, task_id=step.task_id, ordinal=step.ordinal
+        )
+
+    def copy_steps(self):
+        """Get copies of the steps that can be changed without changing the index.
+
+        Returns:
+            list: The steps, in order.
+        """
+        return [
+            Step(step.content, step.completed, task_id=step.task_id, ordinal=step.ordinal)
+            for step in self.steps
+        ]
+
+    def __len__(self):
+        return len(self.steps)
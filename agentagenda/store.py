@@ -0,0 +1,882 @@
+"""Storage backends for tasks, step records and the current task pointer.
+
+Records are grouped in categories, such as "task" or "task_step", and are
+dicts with "id", "document" and "metadata" keys, as agentmemory returns
+them. Filters use the agentmemory (chroma) where syntax: {"field": value},
+{"field": {"$lt": value}} with $eq, $ne, $lt, $lte, $gt, $gte, $in and
+$nin, combined with {"$and": [...]} and {"$or": [...]}.
+"""
+
+from abc import ABC, abstractmethod
+from array import array
+import json
+import os
+import sqlite3
+import threading
+
+from agentmemory import get_client, search_memory, chroma_collection_to_list
+
+
+class TaskStore(ABC):
+    """The interface every storage backend implements.
+
+    Backends that leave any abstract method out fail when instantiated.
+    Stores count the embeddings they compute, by the operation that
+    computed them, in embedding_counts.
+    """
+
+    def __init__(self):
+        self.embedding_counts = {}
+        self._counts_lock = threading.Lock()
+
+    def _count_embeddings(self, operation, n):
+        with self._counts_lock:
+            self.embedding_counts[operation] = (
+                self.embedding_counts.get(operation, 0) + n
+            )
+
+    def get_embedding_stats(self):
+        """Get how many embeddings the store has computed.
+
+        Returns:
+            dict: The number of embeddings computed by each operation, such as "upsert" and "search",
+                and their "total".
+        """
+        with self._counts_lock:
+            stats = dict(self.embedding_counts)
+        stats["total"] = sum(stats.values())
+        return stats
+
+    def reset_embedding_stats(self):
+        """Set the embedding counters back to zero."""
+        with self._counts_lock:
+            self.embedding_counts = {}
+
+    @abstractmethod
+    def get(
+        self,
+        category,
+        ids=None,
+        where=None,
+        limit=None,
+        offset=0,
+        include_embeddings=False,
+    ):
+        """Get records in store order.
+
+        Args:
+            category (str): The category to read.
+            ids (list, optional): Only return these records. Defaults to None (any record).
+            where (dict, optional): Only return records with matching metadata. Defaults to None.
+            limit (int, optional): The maximum number of records to return. Defaults to None (no limit).
+            offset (int, optional): How many matching records to skip. Defaults to 0.
+            include_embeddings (bool, optional): Include each record's "embedding", or None if it has none.
+                Defaults to False.
+
+        Returns:
+            list: The matching records.
+        """
+
+    @abstractmethod
+    def upsert(self, category, ids, documents, metadatas, embeddings=None):
+        """Create or replace records.
+
+        Records whose document is unchanged keep their embedding, so
+        rewriting a record's metadata through upsert never embeds it again.
+
+        Args:
+            category (str): The category to write.
+            ids (list): The ids of the records.
+            documents (list): The text of each record, which search embeds.
+            metadatas (list): The metadata of each record.
+            embeddings (list, optional): The embedding of each record, or None where it should be computed.
+                Defaults to None (embed new and changed documents).
+        """
+
+    @abstractmethod
+    def update(self, category, ids, metadatas):
+        """Replace the metadata of existing records, keeping their documents and embeddings.
+
+        Args:
+            category (str): The category to write.
+            ids (list): The ids of the records.
+            metadatas (list): The new metadata of each record.
+        """
+
+    @abstractmethod
+    def update_if_version(self, category, ids, metadatas, versions):
+        """Replace the metadata of records only if their "version" is still the expected one.
+
+        Either every record is written or none is. Records without a
+        version count as version 0.
+
+        Args:
+            category (str): The category to write.
+            ids (list): The ids of the records.
+            metadatas (list): The new metadata of each record.
+            versions (list): The version each stored record must have.
+
+        Returns:
+            list: The ids of the records whose version didn't match, or are missing. Nothing was written
+                unless it is empty.
+        """
+
+    @abstractmethod
+    def delete(self, category, ids=None, where=None):
+        """Delete records by id, by metadata, or both.
+
+        Args:
+            category (str): The category to delete from.
+            ids (list, optional): The ids of the records to delete. Defaults to None.
+            where (dict, optional): Delete records with matching metadata. Defaults to None.
+        """
+
+    @abstractmethod
+    def search(
+        self,
+        category,
+        query,
+        n_results=5,
+        where=None,
+        include_distances=False,
+        max_distance=None,
+        query_embedding=None,
+    ):
+        """Find the records whose documents are closest to a query.
+
+        Args:
+            category (str): The category to search.
+            query (str): The text to search for.
+            n_results (int, optional): The maximum number of records to return. Defaults to 5.
+            where (dict, optional): Only return records with matching metadata. Defaults to None.
+            include_distances (bool, optional): Include each record's "distance" from the query. Defaults to False.
+            max_distance (float, optional): Only return records within this distance of the query. Defaults to None.
+            query_embedding (list, optional): The embedding of the query. Defaults to None (embed the query).
+
+        Returns:
+            list: The matching records, closest first.
+        """
+
+    @abstractmethod
+    def embed(self, category, texts):
+        """Embed texts the way the store embeds the documents of a category.
+
+        Args:
+            category (str): The category the embeddings are for.
+            texts (list): The texts to embed.
+
+        Returns:
+            list: An embedding per text, as lists of floats.
+        """
+
+    @abstractmethod
+    def embedding_model(self, category):
+        """Get the name of the model that embeds the documents of a category.
+
+        Args:
+            category (str): The category.
+
+        Returns:
+            str: The name of the model, which keys cached embeddings.
+        """
+
+
+class AgentMemoryStore(TaskStore):
+    """The default store, keeping each category in an agentmemory collection.
+
+    Chroma has no conditional writes, so update_if_version compares and
+    writes under a lock. That holds within one process only; processes
+    sharing a store should use SQLiteStore.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._write_lock = threading.Lock()
+
+    def _collection(self, category):
+        return get_client().get_or_create_collection(category)
+
+    def get(
+        self,
+        category,
+        ids=None,
+        where=None,
+        limit=None,
+        offset=0,
+        include_embeddings=False,
+    ):
+        if ids is not None and len(ids) == 0:
+            return []
+        include = ["metadatas", "documents"]
+        if include_embeddings:
+            include.append("embeddings")
+        response = self._collection(category).get(
+            ids=ids,
+            where=where,
+            limit=limit,
+            offset=offset or None,
+            include=include,
+        )
+        memories = chroma_collection_to_list(response)
+        if include_embeddings:
+            for memory in memories:
+                memory.setdefault("embedding", None)
+        return memories
+
+    def upsert(self, category, ids, documents, metadatas, embeddings=None):
+        if len(ids) == 0:
+            return
+        if embeddings is None:
+            embeddings = [None] * len(ids)
+        rows = list(zip(ids, documents, metadatas, embeddings))
+        unembedded = [row[0] for row in rows if row[3] is None]
+        stored = {}
+        if len(unembedded) > 0:
+            stored = {
+                memory["id"]: memory["document"]
+                for memory in self.get(category, ids=unembedded)
+            }
+        # agentmemory embeds every document upserted without an embedding,
+        # so records whose document didn't change only get their metadata
+        # written
+        unchanged = []
+        embedded = []
+        new = []
+        for row in rows:
+            if row[3] is not None:
+                embedded.append(row)
+            elif row[0] in stored and stored[row[0]] == row[1]:
+                unchanged.append(row)
+            else:
+                new.append(row)
+        collection = self._collection(category)
+        if len(unchanged) > 0:
+            collection.update(
+                ids=[row[0] for row in unchanged],
+                metadatas=[row[2] for row in unchanged],
+            )
+        if len(embedded) > 0:
+            collection.upsert(
+                ids=[row[0] for row in embedded],
+                documents=[row[1] for row in embedded],
+                metadatas=[row[2] for row in embedded],
+                embeddings=[row[3] for row in embedded],
+            )
+        if len(new) > 0:
+            collection.upsert(
+                ids=[row[0] for row in new],
+                documents=[row[1] for row in new],
+                metadatas=[row[2] for row in new],
+            )
+            self._count_embeddings("upsert", len(new))
+
+    def update(self, category, ids, metadatas):
+        if len(ids) == 0:
+            return
+        self._collection(category).update(ids=ids, metadatas=metadatas)
+
+    def update_if_version(self, category, ids, metadatas, versions):
+        if len(ids) == 0:
+            return []
+        with self._write_lock:
+            stored = {
+                memory["id"]: memory["metadata"]
+                for memory in self.get(category, ids=ids)
+            }
+            conflicts = _version_conflicts(stored, ids, versions)
+            if len(conflicts) == 0:
+                self._collection(category).update(ids=ids, metadatas=metadatas)
+        return conflicts
+
+    def delete(self, category, ids=None, where=None):
+        if ids is not None and len(ids) == 0:
+            return
+        self._collection(category).delete(ids=ids, where=where)
+
+    def search(
+        self,
+        category,
+        query,
+        n_results=5,
+        where=None,
+        include_distances=False,
+        max_distance=None,
+        query_embedding=None,
+    ):
+        if query_embedding is not None:
+            return self._search_by_embedding(
+                category,
+                query_embedding,
+                n_results,
+                where,
+                include_distances,
+                max_distance,
+            )
+        # agentmemory only returns distances alongside embeddings
+        with_distances = include_distances or max_distance is not None
+        memories = search_memory(
+            category,
+            query,
+            n_results=n_results,
+            filter_metadata=where,
+            include_embeddings=with_distances,
+            include_distances=with_distances,
+            max_distance=max_distance,
+        )
+        # the query is embedded whether or not anything matches
+        self._count_embeddings("search", 1)
+        for memory in memories:
+            memory.pop("embedding", None)
+            if not include_distances:
+                memory.pop("distance", None)
+        return memories
+
+    def _search_by_embedding(
+        self, category, query_embedding, n_results, where, include_distances, max_distance
+    ):
+        """Query a collection with an embedding, as search_memory queries with a text."""
+        collection = self._collection(category)
+        n_results = min(n_results, collection.count())
+        if n_results == 0:
+            return []
+        response = collection.query(
+            query_embeddings=[list(query_embedding)],
+            n_results=n_results,
+            where=where,
+            include=["metadatas", "documents", "distances"],
+        )
+        # one query was made, so each field holds a single list of results
+        memories = [
+            {"id": i, "document": document, "metadata": metadata, "distance": distance}
+            for i, document, metadata, distance in zip(
+                response["ids"][0],
+                response["documents"][0],
+                response["metadatas"][0],
+                response["distances"][0],
+            )
+        ]
+        if max_distance is not None and max_distance < 1.0:
+            memories = [m for m in memories if m["distance"] <= max_distance]
+        if not include_distances:
+            for memory in memories:
+                memory.pop("distance", None)
+        return memories
+
+    def _embedding_function(self, category):
+        # chroma collections embed with the function they were created with
+        collection = getattr(self._collection(category), "collection", None)
+        function = getattr(collection, "_embedding_function", None)
+        return function if function is not None else _default_embedding_function()
+
+    def embed(self, category, texts):
+        self._count_embeddings("embed", len(texts))
+        embeddings = self._embedding_function(category)(list(texts))
+        return [[float(x) for x in e] for e in embeddings]
+
+    def embedding_model(self, category):
+        return _function_name(self._embedding_function(category))
+
+
+def _version_conflicts(stored, ids, versions):
+    """Get the ids whose stored metadata is missing or has another version."""
+    return [
+        task_id
+        for task_id, version in zip(ids, versions)
+        if task_id not in stored
+        or int(stored[task_id].get("version", 0)) != int(version)
+    ]
+
+
+def _matches(metadata, where):
+    """Check metadata against a where filter."""
+    if where is None:
+        return True
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(_matches(metadata, c) for c in condition):
+                return False
+            continue
+        if key == "$or":
+            if not any(_matches(metadata, c) for c in condition):
+                return False
+            continue
+        if key not in metadata:
+            return False
+        value = metadata[key]
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for operator, operand in condition.items():
+            if operator == "$eq":
+                matched = value == operand
+            elif operator == "$ne":
+                matched = value != operand
+            elif operator == "$lt":
+                matched = value < operand
+            elif operator == "$lte":
+                matched = value <= operand
+            elif operator == "$gt":
+                matched = value > operand
+            elif operator == "$gte":
+                matched = value >= operand
+            elif operator == "$in":
+                matched = value in operand
+            elif operator == "$nin":
+                matched = value not in operand
+            else:
+                raise ValueError("Unknown operator: {}".format(operator))
+            if not matched:
+                return False
+    return True
+
+
+def _default_embedding_function():
+    # the same model agentmemory's chroma collections embed with
+    from chromadb.utils.embedding_functions import DefaultEmbeddingFunction
+
+    return DefaultEmbeddingFunction()
+
+
+def _function_name(function):
+    name = getattr(function, "name", None)
+    if callable(name):
+        try:
+            return name()
+        except Exception:
+            pass
+    return getattr(function, "__qualname__", type(function).__name__)
+
+
+def _distance(a, b):
+    """Squared euclidean distance, the distance chroma collections use."""
+    return sum((x - y) * (x - y) for x, y in zip(a, b))
+
+
+class _LocalStore(TaskStore):
+    """Search for stores that keep records locally.
+
+    Documents are only embedded when a search first needs them, so records
+    that are never searched, such as step records, are never embedded.
+
+    Args:
+        embedding_function (callable, optional): Turns a list of texts into a list of embeddings.
+            Defaults to None (chroma's default embedding model, loaded on first search).
+    """
+
+    def __init__(self, embedding_function=None):
+        super().__init__()
+        self._embedding_function = embedding_function
+
+    def _embed(self, texts, operation="search"):
+        if self._embedding_function is None:
+            self._embedding_function = _default_embedding_function()
+        self._count_embeddings(operation, len(texts))
+        return [[float(x) for x in e] for e in self._embedding_function(texts)]
+
+    def embed(self, category, texts):
+        return self._embed(list(texts), operation="embed")
+
+    def embedding_model(self, category):
+        if self._embedding_function is None:
+            self._embedding_function = _default_embedding_function()
+        return _function_name(self._embedding_function)
+
+    @abstractmethod
+    def _set_embeddings(self, category, ids, embeddings):
+        """Store the embeddings computed for records on their first search."""
+
+    def search(
+        self,
+        category,
+        query,
+        n_results=5,
+        where=None,
+        include_distances=False,
+        max_distance=None,
+        query_embedding=None,
+    ):
+        memories = self.get(category, where=where, include_embeddings=True)
+        if len(memories) == 0:
+            return []
+        unembedded = [memory for memory in memories if memory["embedding"] is None]
+        if len(unembedded) > 0:
+            embeddings = self._embed([memory["document"] for memory in unembedded])
+            for memory, embedding in zip(unembedded, embeddings):
+                memory["embedding"] = embedding
+            self._set_embeddings(
+                category, [memory["id"] for memory in unembedded], embeddings
+            )
+        if query_embedding is None:
+            query_embedding = self._embed([query])[0]
+        for memory in memories:
+            memory["distance"] = _distance(query_embedding, memory.pop("embedding"))
+        memories.sort(key=lambda memory: memory["distance"])
+        memories = memories[:n_results]
+        # agentmemory treats distances of 1 and above as no limit
+        if max_distance is not None and max_distance < 1.0:
+            memories = [m for m in memories if m["distance"] <= max_distance]
+        if not include_distances:
+            for memory in memories:
+                memory.pop("distance")
+        return memories
+
+
+class InMemoryStore(_LocalStore):
+    """A store that keeps every record in process memory.
+
+    Nothing is persisted, so this suits tests and short-lived agents.
+
+    Args:
+        embedding_function (callable, optional): Turns a list of texts into a list of embeddings.
+            Defaults to None (chroma's default embedding model, loaded on first search).
+    """
+
+    def __init__(self, embedding_function=None):
+        super().__init__(embedding_function)
+        self._categories = {}
+        self._lock = threading.Lock()
+
+    def get(
+        self,
+        category,
+        ids=None,
+        where=None,
+        limit=None,
+        offset=0,
+        include_embeddings=False,
+    ):
+        with self._lock:
+            records = self._categories.get(category, {})
+            if ids is not None:
+                candidates = [records[i] for i in ids if i in records]
+            else:
+                candidates = list(records.values())
+            matches = [r for r in candidates if _matches(r["metadata"], where)]
+            stop = offset + limit if limit is not None else None
+            memories = []
+            for record in matches[offset:stop]:
+                memory = {
+                    "id": record["id"],
+                    "document": record["document"],
+                    "metadata": dict(record["metadata"]),
+                }
+                if include_embeddings:
+                    memory["embedding"] = record["embedding"]
+                memories.append(memory)
+            return memories
+
+    def upsert(self, category, ids, documents, metadatas, embeddings=None):
+        if embeddings is None:
+            embeddings = [None] * len(ids)
+        with self._lock:
+            records = self._categories.setdefault(category, {})
+            for task_id, document, metadata, embedding in zip(
+                ids, documents, metadatas, embeddings
+            ):
+                previous = records.get(task_id)
+                if embedding is None and previous is not None:
+                    if previous["document"] == document:
+                        embedding = previous["embedding"]
+                records[task_id] = {
+                    "id": task_id,
+                    "document": document,
+                    "metadata": dict(metadata),
+                    "embedding": list(embedding) if embedding is not None else None,
+                }
+
+    def update(self, category, ids, metadatas):
+        with self._lock:
+            records = self._categories.get(category, {})
+            for task_id, metadata in zip(ids, metadatas):
+                if task_id in records:
+                    records[task_id]["metadata"] = dict(metadata)
+
+    def update_if_version(self, category, ids, metadatas, versions):
+        with self._lock:
+            records = self._categories.get(category, {})
+            stored = {
+                task_id: records[task_id]["metadata"]
+                for task_id in ids
+                if task_id in records
+            }
+            conflicts = _version_conflicts(stored, ids, versions)
+            if len(conflicts) == 0:
+                for task_id, metadata in zip(ids, metadatas):
+                    records[task_id]["metadata"] = dict(metadata)
+        return conflicts
+
+    def delete(self, category, ids=None, where=None):
+        with self._lock:
+            records = self._categories.get(category, {})
+            candidates = list(records) if ids is None else ids
+            for task_id in candidates:
+                record = records.get(task_id)
+                if record is not None and _matches(record["metadata"], where):
+                    del records[task_id]
+
+    def _set_embeddings(self, category, ids, embeddings):
+        with self._lock:
+            records = self._categories.get(category, {})
+            for task_id, embedding in zip(ids, embeddings):
+                if task_id in records:
+                    records[task_id]["embedding"] = embedding
+
+
+class SQLiteStore(_LocalStore):
+    """A store that keeps every record in one indexed SQLite table.
+
+    The status, current, task_id, created_at and updated_at metadata fields
+    are copied into indexed columns, so the lookups agentagenda makes by
+    status, by current task, by task and by time use an index instead of a
+    scan. Other fields are filtered with json_extract. The database runs in
+    WAL mode, so readers in other processes don't block writers.
+
+    Args:
+        path (str, optional): Path of the SQLite database. Defaults to "agentagenda.db" in STORAGE_PATH.
+        embedding_function (callable, optional): Turns a list of texts into a list of embeddings.
+            Defaults to None (chroma's default embedding model, loaded on first search).
+    """
+
+    indexed_fields = ("status", "current", "task_id", "created_at", "updated_at")
+
+    def __init__(self, path=None, embedding_function=None):
+        super().__init__(embedding_function)
+        if path is None:
+            path = os.path.join(
+                os.environ.get("STORAGE_PATH", "./memory"), "agentagenda.db"
+            )
+        if path != ":memory:":
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._pid = None
+        self._connection = None
+        self._connect()
+
+    def _connect(self):
+        """Get the connection, opening a new one in a forked process."""
+        if self._pid == os.getpid():
+            return self._connection
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS records ("
+            "category TEXT NOT NULL, id TEXT NOT NULL, document TEXT, "
+            "metadata TEXT NOT NULL, embedding BLOB, "
+            "status TEXT, current TEXT, task_id TEXT, "
+            "created_at REAL, updated_at REAL, "
+            "PRIMARY KEY (category, id))"
+        )
+        for field in self.indexed_fields:
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS records_{0} "
+                "ON records (category, {0})".format(field)
+            )
+        connection.commit()
+        self._connection = connection
+        self._pid = os.getpid()
+        return connection
+
+    def _column(self, field):
+        if field in self.indexed_fields:
+            return field
+        return "json_extract(metadata, {})".format(
+            _quote("$.{}".format(json.dumps(field)))
+        )
+
+    def _where(self, where, params):
+        """Compile a where filter to SQL, appending its parameters to params."""
+        clauses = []
+        for key, condition in where.items():
+            if key in ("$and", "$or"):
+                parts = ["({})".format(self._where(c, params)) for c in condition]
+                joiner = " AND " if key == "$and" else " OR "
+                clauses.append("({})".format(joiner.join(parts) or "1"))
+                continue
+            column = self._column(key)
+            if not isinstance(condition, dict):
+                condition = {"$eq": condition}
+            for operator, operand in condition.items():
+                if operator in ("$in", "$nin"):
+                    operand = list(operand)
+                    if len(operand) == 0:
+                        clauses.append("0" if operator == "$in" else "1")
+                        continue
+                    clauses.append(
+                        "{} {} ({})".format(
+                            column,
+                            "IN" if operator == "$in" else "NOT IN",
+                            ", ".join("?" * len(operand)),
+                        )
+                    )
+                    params.extend(operand)
+                elif operator in _sql_operators:
+                    clauses.append("{} {} ?".format(column, _sql_operators[operator]))
+                    params.append(operand)
+                else:
+                    raise ValueError("Unknown operator: {}".format(operator))
+        return " AND ".join(clauses) or "1"
+
+    def _select(self, columns, category, ids, where):
+        params = [category]
+        sql = "SELECT {} FROM records WHERE category = ?".format(columns)
+        if ids is not None:
+            sql += " AND id IN ({})".format(", ".join("?" * len(ids)))
+            params.extend(ids)
+        if where is not None:
+            sql += " AND ({})".format(self._where(where, params))
+        return sql, params
+
+    def get(
+        self,
+        category,
+        ids=None,
+        where=None,
+        limit=None,
+        offset=0,
+        include_embeddings=False,
+    ):
+        if ids is not None and len(ids) == 0:
+            return []
+        sql, params = self._select(
+            "id, document, metadata, embedding", category, ids, where
+        )
+        sql += " ORDER BY rowid"
+        if limit is not None or offset:
+            sql += " LIMIT ? OFFSET ?"
+            params.extend([limit if limit is not None else -1, offset or 0])
+        with self._lock:
+            rows = self._connect().execute(sql, params).fetchall()
+        memories = []
+        for task_id, document, metadata, embedding in rows:
+            memory = {"id": task_id, "document": document, "metadata": json.loads(metadata)}
+            if include_embeddings:
+                memory["embedding"] = (
+                    list(array("d", embedding)) if embedding is not None else None
+                )
+            memories.append(memory)
+        return memories
+
+    def _indexed_values(self, metadata):
+        return [metadata.get(field) for field in self.indexed_fields]
+
+    def upsert(self, category, ids, documents, metadatas, embeddings=None):
+        if embeddings is None:
+            embeddings = [None] * len(ids)
+        rows = [
+            [
+                category,
+                task_id,
+                document,
+                json.dumps(metadata),
+                array("d", embedding).tobytes() if embedding is not None else None,
+            ]
+            + self._indexed_values(metadata)
+            for task_id, document, metadata, embedding in zip(
+                ids, documents, metadatas, embeddings
+            )
+        ]
+        # updating in place keeps the rowid, and so the store order, and an
+        # unchanged document keeps its embedding
+        sql = (
+            "INSERT INTO records (category, id, document, metadata, embedding, "
+            "status, current, task_id, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (category, id) DO UPDATE SET "
+            "document = excluded.document, metadata = excluded.metadata, "
+            "embedding = COALESCE(excluded.embedding, "
+            "CASE WHEN document = excluded.document THEN embedding END), "
+            "status = excluded.status, "
+            "current = excluded.current, task_id = excluded.task_id, "
+            "created_at = excluded.created_at, updated_at = excluded.updated_at"
+        )
+        with self._lock:
+            connection = self._connect()
+            connection.executemany(sql, rows)
+            connection.commit()
+
+    def update(self, category, ids, metadatas):
+        rows = [
+            [json.dumps(metadata)] + self._indexed_values(metadata) + [category, task_id]
+            for task_id, metadata in zip(ids, metadatas)
+        ]
+        sql = (
+            "UPDATE records SET metadata = ?, status = ?, current = ?, task_id = ?, "
+            "created_at = ?, updated_at = ? WHERE category = ? AND id = ?"
+        )
+        with self._lock:
+            connection = self._connect()
+            connection.executemany(sql, rows)
+            connection.commit()
+
+    def update_if_version(self, category, ids, metadatas, versions):
+        if len(ids) == 0:
+            return []
+        sql = (
+            "UPDATE records SET metadata = ?, status = ?, current = ?, task_id = ?, "
+            "created_at = ?, updated_at = ? WHERE category = ? AND id = ? "
+            "AND COALESCE(json_extract(metadata, '$.version'), 0) = ?"
+        )
+        conflicts = []
+        with self._lock:
+            connection = self._connect()
+            # the immediate transaction takes the write lock up front, so
+            # other processes can't write between the checks and the commit
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                for task_id, metadata, version in zip(ids, metadatas, versions):
+                    cursor = connection.execute(
+                        sql,
+                        [json.dumps(metadata)]
+                        + self._indexed_values(metadata)
+                        + [category, task_id, int(version)],
+                    )
+                    if cursor.rowcount == 0:
+                        conflicts.append(task_id)
+            except Exception:
+                connection.rollback()
+                raise
+            if len(conflicts) > 0:
+                connection.rollback()
+            else:
+                connection.commit()
+        return conflicts
+
+    def delete(self, category, ids=None, where=None):
+        if ids is not None and len(ids) == 0:
+            return
+        sql, params = self._select("rowid", category, ids, where)
+        with self._lock:
+            connection = self._connect()
+            connection.execute(
+                "DELETE FROM records WHERE rowid IN ({})".format(sql), params
+            )
+            connection.commit()
+
+    def _set_embeddings(self, category, ids, embeddings):
+        rows = [
+            (array("d", embedding).tobytes(), category, task_id)
+            for task_id, embedding in zip(ids, embeddings)
+        ]
+        with self._lock:
+            connection = self._connect()
+            connection.executemany(
+                "UPDATE records SET embedding = ? WHERE category = ? AND id = ?", rows
+            )
+            connection.commit()
+
+
+_sql_operators = {
+    "$eq": "=",
+    "$ne": "!=",
+    "$lt": "<",
+    "$lte": "<=",
+    "$gt": ">",
+    "$gte": ">=",
+}
+
+
+def _quote(text):
+    return "'{}'".format(text.replace("'", "''"))
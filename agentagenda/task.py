@@ -0,0 +1,86 @@
+import json
+
+
+class Task:
+    """A lightweight view of a task memory.
+
+    The "steps" JSON is only decoded the first time steps is read. When
+    fields is given, only those metadata fields are kept, so listing many
+    tasks doesn't hold on to every plan and step list.
+
+    A Task can be passed anywhere a task dict is accepted; task["metadata"],
+    task["id"] and task.get(...) work as they do on the dict. Functions that
+    need fields a view left out read the whole task first.
+
+    Args:
+        memory (dict): The task memory as returned by agentmemory.
+        fields (list, optional): The metadata fields to keep. Defaults to None (all fields).
+    """
+
+    __slots__ = ("id", "document", "metadata", "distance", "fields", "_steps")
+
+    def __init__(self, memory, fields=None):
+        metadata = memory["metadata"]
+        if fields is not None:
+            fields = list(fields)
+            metadata = {key: metadata[key] for key in fields if key in metadata}
+        self.id = memory["id"]
+        self.fields = fields
+        self.document = memory.get("document")
+        self.metadata = metadata
+        self.distance = memory.get("distance")
+        self._steps = None
+
+    @property
+    def goal(self):
+        """str: The goal of the task."""
+        return self.metadata.get("goal", self.document)
+
+    @property
+    def status(self):
+        """str: The status of the task."""
+        return self.metadata.get("status")
+
+    @property
+    def plan(self):
+        """str: The plan of the task."""
+        return self.metadata.get("plan")
+
+    @property
+    def steps(self):
+        """list: The steps of the task as dicts, decoded on first access."""
+        if self._steps is None:
+            steps = self.metadata.get("steps")
+            self._steps = json.loads(steps) if steps is not None else []
+        return self._steps
+
+    def to_dict(self):
+        """Get the task as a memory dict.
+
+        Returns:
+            dict: A dict with "id", "document" and "metadata" keys, and "distance" for search results.
+        """
+        memory = {"id": self.id, "document": self.document, "metadata": self.metadata}
+        if self.distance is not None:
+            memory["distance"] = self.distance
+        return memory
+
+    def get(self, key, default=None):
+        if key in self:
+            return getattr(self, key)
+        return default
+
+    def __getitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __contains__(self, key):
+        if key == "distance":
+            return self.distance is not None
+        return key in ("id", "document", "metadata")
+
+    def __repr__(self):
+        return "Task(id={!r}, goal={!r}, status={!r})".format(
+            self.id, self.goal, self.status
+        )
@@ -1,7 +1,14 @@
+import asyncio
 from datetime import datetime
+import io
 import json
-from agentmemory import create_memory, get_memories, get_memory, wipe_category
+import os
+import tempfile
+import threading
+import time
+from agentmemory import create_memory, get_memories, get_memory, update_memory, wipe_category
 from agentagenda import (
+    TaskFilter,
     create_task,
     delete_task,
     list_tasks,
@@ -14,8 +21,74 @@ from agentagenda import (
     add_step,
     finish_step,
     cancel_step,
+    enable_task_cache,
+    disable_task_cache,
+    invalidate_task_cache,
+    get_task_by_id,
+    get_current_task,
+    set_current_task,
+    enable_step_records,
+    disable_step_records,
+    get_steps,
+    migrate_task_steps,
+    get_task_progress,
+    create_tasks,
+    finish_tasks,
+    cancel_tasks,
+    delete_tasks,
+    update_step,
+    update_steps,
+    enable_generation_cache,
+    disable_generation_cache,
+    get_generation_cache_stats,
+    find_similar_task,
+    enable_plan_reuse,
+    disable_plan_reuse,
+    create_plan_and_steps,
+    get_task_id,
+    get_last_created_task,
+    get_last_updated_task,
+    get_recent_tasks,
+    tasks_updated_since,
+    rebuild_recency_index,
+    rebuild_scheduler,
+    rebuild_keyword_index,
+    iter_tasks,
+    enable_status_partitions,
+    disable_status_partitions,
+    migrate_to_status_partitions,
+    archive_tasks,
+    load_archived_task,
+    search_archived_tasks,
+    enable_render_cache,
+    disable_render_cache,
+    get_render_cache_stats,
+    estimate_tokens,
+    transaction,
+    TaskConflictError,
+    claim_task,
+    renew_lease,
+    release_task,
+    ready_tasks,
+    next_task,
+    set_task_store,
+    get_task_store,
+    get_embedding_stats,
+    reset_embedding_stats,
+    enable_embedding_cache,
+    disable_embedding_cache,
+    get_embedding_cache_stats,
 )
-from agentagenda.main import get_next_step, get_task_as_formatted_string, list_tasks_as_formatted_string
+from agentagenda import aio, main
+from agentagenda.worker import WorkerPool, run_worker
+from agentagenda.archive import TaskArchive
+from agentagenda.cache import LRUCache, GenerationCache, EmbeddingCache
+from agentagenda.index import RecencyIndex, KeywordIndex
+from agentagenda.scheduler import TaskScheduler
+from agentagenda.steps import Step, StepIndex, normalize_step
+from agentagenda.store import AgentMemoryStore, InMemoryStore, SQLiteStore, TaskStore
+from agentagenda.task import Task
+from agentagenda.main import get_next_step, get_task_as_formatted_string, list_tasks_as_formatted_string, write_tasks_as_formatted_string
 
 goal = "Make a balogna sandwich"
 
@@ -63,6 +136,8 @@ steps = json.dumps(
 # Custom setup and teardown
 def setup():
     wipe_category("task")
+    wipe_category("task_current")
+    wipe_category("task_step")
     # get timestamp
     created_at = datetime.now()
     updated_at = datetime.now()
@@ -78,11 +153,21 @@ def setup():
 
     create_memory("task", goal, metadata=task)
     memory = get_memories("task", goal)[0]
+    rebuild_recency_index()
+    rebuild_scheduler()
+    rebuild_keyword_index()
     return memory
 
 
 def teardown():
     wipe_category("task")
+    wipe_category("task_current")
+    wipe_category("task_step")
+    for status in ("in_progress", "complete", "cancelled"):
+        wipe_category("task_{}".format(status))
+    rebuild_recency_index()
+    rebuild_scheduler()
+    rebuild_keyword_index()
 
 
 # Test cases
@@ -110,6 +195,14 @@ def test_list_tasks():
     teardown()
 
 
+def test_list_tasks_newest_first():
+    teardown()
+    created = [create_task("Task {}".format(i), plan=plan, steps=steps) for i in range(22)]
+    tasks = list_tasks()
+    assert [t["id"] for t in tasks] == [t["id"] for t in reversed(created)][:20]
+    teardown()
+
+
 def test_search_tasks():
     task = setup()
     search_result = search_tasks("Test")
@@ -127,6 +220,19 @@ def test_delete_task():
     assert task["document"] not in documents
 
 
+def test_delete_current_task():
+    teardown()
+    task = create_task(goal, plan=plan, steps=steps)
+    assert get_memory("task_current", "current")["metadata"]["task_id"] == task["id"]
+    delete_task(task)
+    assert get_memory("task_current", "current")["metadata"]["task_id"] == ""
+    other = create_task(goal, plan=plan, steps=steps)
+    delete_tasks([other["id"]])
+    assert get_memory("task_current", "current")["metadata"]["task_id"] == ""
+    assert get_current_task() is None
+    teardown()
+
+
 def test_finish_task():
     task = setup()
     finish_task(task)
@@ -278,3 +384,1323 @@ def test_list_tasks_as_formatted_string():
 
     # Teardown: Remove all tasks
     wipe_category("task")
+
+
+def test_lru_cache():
+    cache = LRUCache(max_size=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["size"] == 2
+
+
+def test_lru_cache_ttl():
+    cache = LRUCache(ttl=0)
+    cache.set("a", 1)
+    assert cache.get("a") is None
+
+
+def test_task_cache():
+    task = setup()
+    enable_task_cache()
+    finish_task(task)
+    assert get_task_by_id(task["id"])["metadata"]["status"] == "complete"
+    invalidate_task_cache(task)
+    assert get_task_by_id(task["id"])["metadata"]["status"] == "complete"
+    disable_task_cache()
+    teardown()
+
+
+def test_get_current_task():
+    teardown()
+    first = create_task("First goal", plan, steps)
+    second = create_task("Second goal", plan, steps)
+    assert get_current_task()["id"] == second["id"]
+    assert get_task_by_id(first["id"])["metadata"]["current"] == "False"
+    finish_task(second)
+    assert get_current_task() is None
+    teardown()
+
+
+def test_set_current_task():
+    teardown()
+    first = create_task("First goal", plan, steps)
+    second = create_task("Second goal", plan, steps)
+    set_current_task(first)
+    assert get_current_task()["id"] == first["id"]
+    assert get_task_by_id(second["id"])["metadata"]["current"] == "False"
+    teardown()
+
+
+def test_step():
+    step = Step("Step 1", task_id="1", ordinal=2)
+    assert step.id == "1:2"
+    assert step.to_dict() == {"content": "Step 1", "completed": False}
+    assert Step("Step 1").id is None
+
+
+def test_step_records():
+    teardown()
+    enable_step_records()
+    task = create_task(goal, plan, steps)
+    finish_step(task, "Prepare Bread")
+    add_step(task, "Eat the sandwich")
+    step_list = get_steps(task)
+    assert step_list[1].completed
+    assert step_list[-1].content == "Eat the sandwich"
+    updated_task = get_task_by_id(task["id"])
+    updated_steps = json.loads(updated_task["metadata"]["steps"])
+    assert updated_steps[1]["completed"] == True
+    assert len(updated_steps) == len(json.loads(steps)) + 1
+    disable_step_records()
+    teardown()
+
+
+def test_step_records_listed():
+    teardown()
+    enable_step_records()
+    try:
+        task = create_task(goal, plan, steps)
+        finish_step(task, "Prepare Bread")
+        listed = list_tasks()[0]
+        assert json.loads(listed["metadata"]["steps"])[1]["completed"]
+        assert list_tasks(fields=["steps"], limit=1)[0].steps[1]["completed"]
+        found = search_tasks(goal, n_results=1)[0]
+        assert json.loads(found["metadata"]["steps"])[1]["completed"]
+        walked = next(iter_tasks(sort_by="created_at"))
+        assert json.loads(walked["metadata"]["steps"])[1]["completed"]
+    finally:
+        disable_step_records()
+    teardown()
+
+
+def test_update_step_foreign_record():
+    teardown()
+    enable_step_records()
+    try:
+        task = create_task(goal, plan, steps)
+        other = create_task("Other goal", plan, steps)
+        # a step of another task only updates the steps with its content
+        foreign = get_steps(other)[0]
+        foreign.completed = True
+        update_step(task, foreign)
+        assert get_steps(task)[0].completed
+        assert not get_steps(other)[0].completed
+        assert get_next_step(get_task_by_id(task["id"]))["content"] == "Prepare Bread"
+        # so does a step whose record was removed
+        removed = get_steps(task)[1]
+        cancel_step(task, removed.content)
+        removed.completed = True
+        update_step(task, removed)
+        assert [s.content for s in get_steps(task)][1] != removed.content
+    finally:
+        disable_step_records()
+    teardown()
+
+
+def test_migrate_task_steps():
+    task = setup()
+    migrate_task_steps(task)
+    step_list = get_steps(task)
+    assert [step.content for step in step_list] == [
+        step["content"] for step in json.loads(steps)
+    ]
+    teardown()
+
+
+def test_get_next_step_cursor():
+    task = {
+        "metadata": {
+            "steps": json.dumps([{"content": "Step 1", "completed": True}]),
+            "next_step_index": 1,
+            "next_step": "Step 2",
+        }
+    }
+    assert get_next_step(task) == {"content": "Step 2", "completed": False}
+    task["metadata"]["next_step_index"] = -1
+    assert get_next_step(task) is None
+
+
+def test_get_task_progress():
+    task = {
+        "metadata": {
+            "steps": json.dumps(
+                [
+                    {"content": "Step 1", "completed": True},
+                    {"content": "Step 2", "completed": False},
+                ]
+            )
+        }
+    }
+    assert get_task_progress(task) == 50.0
+    task["metadata"]["completed_count"] = 3
+    task["metadata"]["step_count"] = 4
+    assert get_task_progress(task) == 75.0
+
+
+def test_step_cursor():
+    task = setup()
+    finish_step(task, "Gather Ingredients and Equipment")
+    updated_task = get_task_by_id(task["id"])
+    assert updated_task["metadata"]["next_step"] == "Prepare Bread"
+    assert updated_task["metadata"]["completed_count"] == 1
+    assert get_next_step(updated_task)["content"] == "Prepare Bread"
+    teardown()
+
+
+def test_create_tasks():
+    teardown()
+    results = create_tasks(
+        [
+            {"goal": "First goal", "plan": plan, "steps": steps},
+            {"goal": "Second goal", "plan": plan, "steps": steps},
+        ]
+    )
+    assert all(result["success"] for result in results)
+    assert get_task_by_id(results[1]["id"])["metadata"]["goal"] == "Second goal"
+    teardown()
+
+
+def test_finish_and_cancel_tasks():
+    teardown()
+    results = create_tasks(
+        [
+            {"goal": "First goal", "plan": plan, "steps": steps},
+            {"goal": "Second goal", "plan": plan, "steps": steps},
+        ]
+    )
+    first, second = [result["id"] for result in results]
+    finish_results = finish_tasks([first, "missing"])
+    assert finish_results[0]["success"] == True
+    assert finish_results[1]["success"] == False
+    cancel_tasks([second])
+    assert get_task_by_id(first)["metadata"]["status"] == "complete"
+    assert get_task_by_id(second)["metadata"]["status"] == "cancelled"
+    teardown()
+
+
+def test_delete_tasks():
+    teardown()
+    results = create_tasks([{"goal": "First goal", "plan": plan, "steps": steps}])
+    task_id = results[0]["id"]
+    delete_results = delete_tasks([task_id, "missing"])
+    assert [result["success"] for result in delete_results] == [True, False]
+    assert get_task_by_id(task_id) is None
+    teardown()
+
+
+def test_update_steps():
+    task = setup()
+    results = update_steps(
+        task,
+        [
+            {"content": "Prepare Bread", "completed": True},
+            {"content": "Missing step", "completed": True},
+        ],
+    )
+    assert [result["success"] for result in results] == [True, False]
+    updated_task = get_task_by_id(task["id"])
+    assert get_next_step(updated_task)["content"] == "Gather Ingredients and Equipment"
+    assert updated_task["metadata"]["completed_count"] == 1
+    teardown()
+
+
+def test_aio_get_next_step():
+    task = {
+        "metadata": {
+            "steps": json.dumps([{"content": "Step 1", "completed": False}])
+        }
+    }
+    next_step = asyncio.run(aio.get_next_step(task))
+    assert next_step == {"content": "Step 1", "completed": False}
+
+
+def test_aio_create_tasks():
+    teardown()
+    results = asyncio.run(
+        aio.create_tasks(
+            [
+                {"goal": "First goal", "plan": plan, "steps": steps},
+                {"goal": "Second goal", "plan": plan},
+            ]
+        )
+    )
+    assert all(result["success"] for result in results)
+    task = asyncio.run(aio.get_task_by_id(results[1]["id"]))
+    assert len(json.loads(task["metadata"]["steps"])) > 0
+    teardown()
+
+
+def test_aio_create_tasks_schedule():
+    teardown()
+    first = create_task(goal, plan=plan, steps=steps)
+    results = asyncio.run(
+        aio.create_tasks(
+            [{"goal": "Second goal", "plan": plan, "priority": 5, "depends_on": [first]}]
+        )
+    )
+    task = get_task_by_id(results[0]["id"])
+    assert task["metadata"]["priority"] == 5
+    assert json.loads(task["metadata"]["depends_on"]) == [first["id"]]
+    rebuild_scheduler()
+    assert [t["id"] for t in ready_tasks()] == [first["id"]]
+    teardown()
+
+
+def test_generation_cache():
+    cache = GenerationCache(max_size=2)
+    key = GenerationCache.key("prompt", "model")
+    assert key != GenerationCache.key("prompt", "other model")
+    assert cache.get(key) is None
+    cache.set(key, ["Step 1"])
+    assert cache.get(key) == ["Step 1"]
+    cache.set("b", "plan b")
+    cache.set("c", "plan c")
+    assert cache.stats() == {"hits": 1, "misses": 1, "size": 2}
+    assert cache.get(key) is None
+    assert cache.get("c") == "plan c"
+
+
+def test_generation_cache_max_age():
+    cache = GenerationCache(max_age=0)
+    cache.set("a", "plan a")
+    assert cache.get("a") is None
+
+
+def test_create_plan_cached():
+    enable_generation_cache(path=":memory:")
+    first = create_plan("Test goal")
+    second = create_plan("Test goal")
+    assert first == second
+    assert get_generation_cache_stats()["hits"] == 1
+    create_plan("Test goal", use_cache=False)
+    assert get_generation_cache_stats()["hits"] == 1
+    disable_generation_cache()
+
+
+def test_find_similar_task():
+    task = setup()
+    finish_task(task)
+    similar = find_similar_task(goal, max_distance=0.5)
+    assert similar["id"] == task["id"]
+    assert "distance" in similar
+    assert find_similar_task(goal, status="in_progress") is None
+    teardown()
+
+
+def test_plan_reuse():
+    task = setup()
+    finish_task(task)
+    enable_plan_reuse(max_distance=0.5)
+    new_task = create_task(goal)
+    assert new_task["metadata"]["plan"] == plan
+    assert json.loads(new_task["metadata"]["steps"]) == json.loads(steps)
+    disable_plan_reuse()
+    teardown()
+
+
+def test_aio_plan_reuse():
+    task = setup()
+    finish_task(task)
+    assert asyncio.run(aio.find_similar_task(goal, max_distance=0.5))["id"] == task["id"]
+    enable_plan_reuse(max_distance=0.5)
+    try:
+        new_task = asyncio.run(aio.create_task(goal))
+        assert new_task["metadata"]["plan"] == plan
+        results = asyncio.run(aio.create_tasks([goal]))
+        reused = get_task_by_id(results[0]["id"])
+        assert json.loads(reused["metadata"]["steps"]) == json.loads(steps)
+    finally:
+        disable_plan_reuse()
+    teardown()
+
+
+def test_create_plan_and_steps():
+    generation = create_plan_and_steps("Test goal")
+    assert isinstance(generation["plan"], str)
+    assert isinstance(generation["steps"], list)
+    assert len(generation["steps"]) > 0
+
+
+def test_create_task_pipeline():
+    teardown()
+    task = create_task(goal, pipeline=True)
+    assert task["metadata"]["plan_pending"] == "False"
+    assert len(task["metadata"]["plan"]) > 0
+    assert len(json.loads(task["metadata"]["steps"])) > 0
+    assert get_next_step(task) is not None
+    teardown()
+
+
+def test_create_task_pipeline_failure():
+    teardown()
+
+    def fail(**kwargs):
+        raise RuntimeError("model unavailable")
+
+    function_call = main.openai_function_call
+    main.openai_function_call = fail
+    try:
+        create_task("Plan a trip", pipeline=True, use_cache=False)
+        assert False
+    except RuntimeError:
+        pass
+    finally:
+        main.openai_function_call = function_call
+    task = get_current_task()
+    assert task["metadata"]["goal"] == "Plan a trip"
+    assert task["metadata"]["plan_pending"] == "False"
+    assert task["metadata"]["plan_error"] == "model unavailable"
+    teardown()
+
+
+def test_task_view():
+    memory = {
+        "id": "1",
+        "document": goal,
+        "metadata": {"goal": goal, "plan": plan, "steps": steps, "status": "in_progress"},
+    }
+    task = Task(memory, fields=["goal", "status"])
+    assert task.goal == goal
+    assert task.status == "in_progress"
+    assert task.plan is None
+    assert task["metadata"] == {"goal": goal, "status": "in_progress"}
+    assert get_task_id(task) == "1"
+
+    task = Task(memory)
+    assert task.steps == json.loads(steps)
+    assert get_next_step(task) == json.loads(steps)[0]
+
+
+def test_task_view_missing_fields():
+    teardown()
+    task = create_task(goal, plan=plan, steps=steps)
+    view = list_tasks(fields=["goal"], limit=1)[0]
+    assert "plan" not in view["metadata"]
+    assert get_task_as_formatted_string(view) == get_task_as_formatted_string(task)
+    assert get_next_step(view)["content"] == json.loads(steps)[0]["content"]
+    assert get_task_progress(view) == 0.0
+    assert len(get_steps(view)) == len(json.loads(steps))
+    delete_task(task)
+    try:
+        get_task_as_formatted_string(view)
+        assert False
+    except ValueError:
+        pass
+    teardown()
+
+
+def test_list_tasks_fields():
+    task = setup()
+    tasks = list_tasks(fields=["goal", "status"])
+    assert isinstance(tasks[0], Task)
+    assert tasks[0].id == task["id"]
+    assert "plan" not in tasks[0].metadata
+    assert get_last_created_task(fields=["goal"]).goal == goal
+    teardown()
+
+
+def test_recency_index():
+    index = RecencyIndex()
+    index.update("a", 1, 4)
+    index.update("b", 2, 2)
+    index.update("c", 3, 3)
+    assert index.latest(2, by="created_at") == ["c", "b"]
+    assert index.latest(2) == ["a", "c"]
+    assert index.since(2) == ["a", "c"]
+    index.update("b", 2, 5)
+    assert index.latest(1) == ["b"]
+    index.remove("b")
+    assert "b" not in index
+    assert len(index) == 2
+    assert index.since(0, by="created_at") == ["c", "a"]
+    index.update("d", 4, 4, status="complete")
+    index.update("e", 5, 5, status="in_progress")
+    index.update("f", 6, 6, status="in_progress")
+    assert list(index.pages(by="created_at", page_size=1, statuses=["in_progress"])) == [["f"], ["e"]]
+    assert list(index.pages(by="created_at", statuses=["complete", "in_progress"])) == [["f", "e", "d"]]
+    index.update("f", 6, 7, status="complete")
+    assert list(index.pages(by="created_at", descending=False, statuses=["complete"])) == [["d", "f"]]
+
+
+def test_get_recent_tasks():
+    teardown()
+    first = create_task(goal, plan=plan, steps=steps)
+    second = create_task("Make a grilled cheese", plan=plan, steps=steps)
+    assert get_last_created_task()["id"] == second["id"]
+    recent = get_recent_tasks(2, by="created_at")
+    assert [task["id"] for task in recent] == [second["id"], first["id"]]
+
+    since = second["metadata"]["updated_at"]
+    update_plan(first, "A new plan")
+    assert get_last_updated_task()["id"] == first["id"]
+    assert [task["id"] for task in tasks_updated_since(since)] == [first["id"]]
+
+    delete_task(first)
+    assert get_last_updated_task(fields=["goal"]).goal == "Make a grilled cheese"
+    teardown()
+
+
+def test_iter_tasks_sorted_reads_status():
+    teardown()
+    tasks = create_tasks(
+        [{"goal": "Task {}".format(i), "plan": plan, "steps": steps} for i in range(4)]
+    )
+    ids = [task["id"] for task in tasks]
+    finish_tasks(ids[:2])
+    read = []
+    read_tasks = main._read_tasks
+
+    def recording_read_tasks(task_ids):
+        read.extend(task_ids)
+        return read_tasks(task_ids)
+
+    main._read_tasks = recording_read_tasks
+    try:
+        walked = list(iter_tasks(sort_by="created_at", descending=False))
+    finally:
+        main._read_tasks = read_tasks
+    assert [task["id"] for task in walked] == ids[2:]
+    assert sorted(read) == sorted(ids[2:])
+    teardown()
+
+
+def test_list_tasks_pagination():
+    teardown()
+    tasks = create_tasks(
+        [{"goal": "Task {}".format(i), "plan": plan, "steps": steps} for i in range(5)]
+    )
+    ids = [task["id"] for task in tasks]
+    finish_task(ids[0])
+
+    page = list_tasks(limit=2, sort_by="created_at", descending=False)
+    assert [task["id"] for task in page] == ids[1:3]
+    page = list_tasks(limit=2, after=page[-1], sort_by="created_at", descending=False)
+    assert [task["id"] for task in page] == ids[3:5]
+    assert len(list_tasks(limit=2, offset=3)) == 1
+    assert len(list_tasks(status=None, limit=10)) == 5
+
+    walked = list(iter_tasks(status=None, sort_by="created_at", chunk_size=2))
+    assert [task["id"] for task in walked] == ids[::-1]
+    assert len(list(iter_tasks(chunk_size=2))) == 4
+    teardown()
+
+
+def test_write_tasks_as_formatted_string():
+    teardown()
+    create_tasks([{"goal": "Task {}".format(i), "plan": plan, "steps": steps} for i in range(3)])
+    file = io.StringIO()
+    assert write_tasks_as_formatted_string(file, chunk_size=2) == 3
+    output = file.getvalue()
+    assert output.count("Current Task: ") == 3
+    assert output.count("Steps: ") == 3
+    teardown()
+
+
+def test_status_partitions():
+    teardown()
+    enable_status_partitions()
+    try:
+        first = create_task(goal, plan=plan, steps=steps)
+        second = create_task("Make a grilled cheese", plan=plan, steps=steps)
+        assert len(get_memories("task_in_progress")) == 2
+        assert len(get_memories("task")) == 0
+
+        finish_task(first)
+        cancel_tasks([second])
+        assert len(get_memories("task_in_progress")) == 0
+        assert get_memories("task_complete")[0]["id"] == first["id"]
+        assert get_memories("task_cancelled")[0]["id"] == second["id"]
+        assert get_task_by_id(first["id"])["metadata"]["status"] == "complete"
+        assert list_tasks(status="complete")[0]["id"] == first["id"]
+        assert search_tasks(goal, status="complete")[0]["id"] == first["id"]
+        assert len(list_tasks(status=None, limit=10)) == 2
+
+        delete_task(first)
+        assert len(get_memories("task_complete")) == 0
+    finally:
+        disable_status_partitions()
+    teardown()
+
+
+def test_migrate_to_status_partitions():
+    teardown()
+    first = create_task(goal, plan=plan, steps=steps)
+    create_task("Make a grilled cheese", plan=plan, steps=steps)
+    finish_task(first)
+    assert migrate_to_status_partitions(chunk_size=1) == 2
+    assert len(get_memories("task")) == 0
+    assert get_memories("task_complete")[0]["id"] == first["id"]
+    assert len(get_memories("task_in_progress")) == 1
+    teardown()
+
+
+def test_task_archive():
+    path = os.path.join(tempfile.mkdtemp(), "archive.jsonl.gz")
+    archive = TaskArchive(path)
+    archive.append(
+        [
+            {"id": "1", "document": goal, "metadata": {"status": "complete", "updated_at": 1}},
+            {"id": "2", "document": goal, "metadata": {"status": "cancelled", "updated_at": 2}},
+        ]
+    )
+    archive.append(
+        [{"id": "3", "document": goal, "metadata": {"status": "complete", "updated_at": 3}}]
+    )
+    assert archive.get("2")["metadata"]["status"] == "cancelled"
+    assert archive.get("4") is None
+    assert [memory["id"] for memory in archive.search(start=2)] == ["3", "2"]
+    assert [memory["id"] for memory in archive.search(statuses=["complete"])] == ["3", "1"]
+
+    # the index is reloaded from disk
+    archive = TaskArchive(path)
+    assert len(archive) == 3
+    assert archive.get("1")["document"] == goal
+
+
+def test_archive_tasks():
+    teardown()
+    path = os.path.join(tempfile.mkdtemp(), "archive.jsonl.gz")
+    first = create_task(goal, plan=plan, steps=steps)
+    second = create_task("Make a grilled cheese", plan=plan, steps=steps)
+    finish_task(first)
+    assert archive_tasks(older_than=3600, path=path) == 0
+    assert archive_tasks(path=path) == 1
+    assert get_task_by_id(first["id"]) is None
+    assert get_task_by_id(second["id"]) is not None
+
+    archived = load_archived_task(first["id"], path=path)
+    assert archived["metadata"]["goal"] == goal
+    assert archived["metadata"]["status"] == "complete"
+    assert json.loads(archived["metadata"]["steps"]) == json.loads(steps)
+    assert search_archived_tasks(statuses=["complete"], path=path)[0]["id"] == first["id"]
+    teardown()
+
+
+def test_render_cache():
+    teardown()
+    enable_render_cache()
+    task = create_task(goal, plan=plan, steps=steps)
+    first = get_task_as_formatted_string(task)
+    assert get_task_as_formatted_string(get_task_by_id(task["id"])) == first
+    assert get_render_cache_stats()["hits"] == 1
+
+    finish_step(task, "Gather Ingredients and Equipment")
+    rendered = get_task_as_formatted_string(get_task_by_id(task["id"]))
+    assert "Current Step: Prepare Bread" in rendered
+    assert "Gather Ingredients and Equipment: Completed" in rendered
+    assert get_task_as_formatted_string(task, include_plan=False) != first
+
+    disable_render_cache()
+    assert get_task_as_formatted_string(get_task_by_id(task["id"])) == rendered
+    enable_render_cache()
+    teardown()
+
+
+def test_get_task_as_formatted_string_budget():
+    task = {
+        "metadata": {
+            "goal": goal,
+            "plan": plan,
+            "status": "in_progress",
+            "steps": json.dumps(
+                [{"content": "Gather Ingredients and Equipment", "completed": True}]
+                + json.loads(steps)[1:]
+            ),
+        }
+    }
+    full = get_task_as_formatted_string(task)
+    rendered = get_task_as_formatted_string(task, max_tokens=60)
+    assert estimate_tokens(rendered) <= 60
+    assert rendered.startswith("Current Task: " + goal)
+    assert "Current Step: Prepare Bread" in rendered
+    assert "Steps: 1 completed, Prepare Bread: Not completed" in rendered
+    assert "Gather Ingredients and Equipment" not in rendered
+    assert get_task_as_formatted_string(task, max_tokens=60) == rendered
+
+    rendered = get_task_as_formatted_string(task, max_chars=400)
+    assert len(rendered) <= 400
+    assert "Plan: Gather Ingredients" in rendered
+    assert rendered.count("...") >= 1
+    assert len(get_task_as_formatted_string(task, max_chars=len(full))) <= len(full)
+
+
+def test_step_index():
+    contents = [
+        "Gather Ingredients and Equipment",
+        "Prepare Bread",
+        "Add the Bologna",
+        "Prepare bread!",
+    ]
+    index = StepIndex([Step(content, ordinal=i) for i, content in enumerate(contents)])
+    assert normalize_step("Prepare  Bread!") == "prepare bread"
+    assert index.find("prepare bread") == [1, 3]
+    assert index.get(2).content == "Add the Bologna"
+    assert index.match("Prepare Bread") == (1, 1.0)
+    index.set_completed(1, True)
+    assert index.match("Prepare Bread") == (3, 1.0)
+    position, score = index.match("gather the ingredients")
+    assert position == 0 and 0.5 <= score < 1
+    assert index.match("Clean up the kitchen")[0] is None
+
+
+def test_finish_step_marks_one_step():
+    teardown()
+    task = create_task(
+        goal,
+        plan=plan,
+        steps=[
+            {"content": "Spread the mayonnaise", "completed": False},
+            {"content": "Spread the mustard", "completed": False},
+            {"content": "Spread the mayonnaise and mustard evenly", "completed": False},
+        ],
+    )
+    finish_step(task, "spread the mustard")
+    completed = [s["completed"] for s in json.loads(get_task_by_id(task["id"])["metadata"]["steps"])]
+    assert completed == [False, True, False]
+    finish_step(task, "Spread mayonnaise")
+    completed = [s["completed"] for s in json.loads(get_task_by_id(task["id"])["metadata"]["steps"])]
+    assert completed == [True, True, False]
+    assert get_next_step(get_task_by_id(task["id"]))["content"] == "Spread the mayonnaise and mustard evenly"
+    teardown()
+
+
+def test_task_versions():
+    teardown()
+    task = create_task(goal, plan=plan, steps=steps)
+    assert task["metadata"]["version"] == 0
+    update_plan(task, "Plan 2")
+    assert get_task_by_id(task["id"])["metadata"]["version"] == 1
+
+    # another writer bumps the version behind the task cache's back
+    enable_task_cache()
+    get_task_by_id(task["id"])
+    stored = get_memory("task", task["id"])
+    stored["metadata"]["version"] = 5
+    update_memory("task", task["id"], metadata=stored["metadata"])
+    finish_step(task, "Prepare Bread")
+    updated = get_memory("task", task["id"])
+    assert updated["metadata"]["version"] == 6
+    assert json.loads(updated["metadata"]["steps"])[1]["completed"] == True
+    disable_task_cache()
+    teardown()
+
+
+def test_writes_return_task():
+    teardown()
+    task = create_task(goal, plan=plan, steps=steps)
+    updated = finish_step(task, "Gather Ingredients and Equipment")
+    assert updated["id"] == task["id"]
+    assert updated["metadata"]["version"] == 1
+    assert get_next_step(updated)["content"] == "Prepare Bread"
+    assert finish_step(task, "Gather Ingredients and Equipment") is None
+    assert update_plan(task, "Plan 2")["metadata"]["version"] == 2
+    assert add_step(task, "Wash the dishes")["metadata"]["version"] == 3
+    finished = finish_task(task)
+    assert finished["metadata"]["status"] == "complete"
+    assert finished["metadata"]["version"] == 4
+    teardown()
+
+
+def test_concurrent_step_updates():
+    teardown()
+    contents = ["Step {}".format(i) for i in range(8)]
+    task = create_task(
+        goal, plan=plan, steps=[{"content": c, "completed": False} for c in contents]
+    )
+    threads = [
+        threading.Thread(target=finish_step, args=(task, content))
+        for content in contents
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    updated = json.loads(get_task_by_id(task["id"])["metadata"]["steps"])
+    assert all(step["completed"] for step in updated)
+    teardown()
+
+
+def test_transaction():
+    teardown()
+    task = create_task(goal, plan=plan, steps=steps)
+    with transaction(task) as t:
+        assert t.finish_step("Gather Ingredients and Equipment")
+        t.add_step("Wash the dishes")
+        t.cancel_step("Cutting (optional)")
+        t.update_plan("A new plan")
+    updated = get_task_by_id(task["id"])
+    assert updated["metadata"]["version"] == 1
+    assert updated["metadata"]["plan"] == "A new plan"
+    updated_steps = json.loads(updated["metadata"]["steps"])
+    assert updated_steps[0]["completed"] == True
+    assert updated_steps[-1]["content"] == "Wash the dishes"
+    assert "Cutting (optional)" not in [step["content"] for step in updated_steps]
+    assert get_next_step(updated)["content"] == "Prepare Bread"
+
+    try:
+        with transaction(task) as t:
+            t.update_plan("Not written")
+            stored = get_memory("task", task["id"])
+            stored["metadata"]["version"] = 10
+            update_memory("task", task["id"], metadata=stored["metadata"])
+        assert False
+    except TaskConflictError as error:
+        assert error.task_ids == [task["id"]]
+    assert get_memory("task", task["id"])["metadata"]["plan"] == "A new plan"
+    teardown()
+
+
+def test_task_leases():
+    teardown()
+    task = create_task(goal, plan=plan, steps=steps)
+    assert claim_task(task, "a", lease_seconds=60) is not None
+    assert claim_task(task, "b", lease_seconds=60) is None
+    assert renew_lease(task, "a")
+    assert not renew_lease(task, "b")
+    assert release_task(task, "a")
+    assert claim_task(task, "b", lease_seconds=-1) is not None
+    # an expired lease can be claimed by anyone
+    assert claim_task(task, "a") is not None
+    teardown()
+
+
+def test_worker_pool():
+    teardown()
+    results = create_tasks(
+        [{"goal": "Task {}".format(i), "plan": plan, "steps": steps} for i in range(3)]
+    )
+    handled = []
+    lock = threading.Lock()
+
+    def handler(task, step):
+        with lock:
+            handled.append((task["id"], step["content"]))
+
+    WorkerPool(handler, workers=2, lease_seconds=30).run()
+    assert len(handled) == 3 * len(json.loads(steps))
+    assert len(set(handled)) == len(handled)
+    for result in results:
+        task = get_task_by_id(result["id"])
+        assert task["metadata"]["status"] == "complete"
+        assert task["metadata"]["lease_owner"] == ""
+    teardown()
+
+
+def test_run_worker():
+    teardown()
+    task = create_task(goal, plan=plan, steps=steps)
+    handled = []
+
+    def handler(task, step):
+        handled.append(step["content"])
+
+    assert run_worker(handler, lease_seconds=60, drain=True) == len(json.loads(steps))
+    assert handled == [step["content"] for step in json.loads(steps)]
+    assert get_task_by_id(task["id"])["metadata"]["status"] == "complete"
+    teardown()
+
+
+def test_worker_repeated_steps():
+    teardown()
+    task = create_task(
+        goal,
+        plan=plan,
+        steps=[
+            {"content": "Stir the pot", "completed": False},
+            {"content": "Stir the pot", "completed": False},
+            {"content": "Serve", "completed": False},
+        ],
+    )
+    handled = []
+
+    def handler(task, step):
+        handled.append(step["content"])
+
+    assert run_worker(handler, lease_seconds=60, drain=True) == 3
+    assert handled == ["Stir the pot", "Stir the pot", "Serve"]
+    updated = get_task_by_id(task["id"])
+    assert updated["metadata"]["status"] == "complete"
+    assert updated["metadata"]["lease_owner"] == ""
+    teardown()
+
+
+def test_worker_retries_failed_step():
+    teardown()
+    task = create_task(goal, plan=plan, steps=steps)
+    calls = []
+
+    def handler(task, step):
+        calls.append(step["content"])
+        if len(calls) == 1:
+            raise RuntimeError("Step failed")
+
+    assert run_worker(handler, lease_seconds=1, drain=True) == 0
+    assert get_task_by_id(task["id"])["metadata"]["lease_owner"] != ""
+    assert run_worker(handler, lease_seconds=1, drain=True) == 0
+    assert claim_task(task, "other", lease_seconds=60) is None
+    # once the lease expires the task is claimed again and worked through
+    time.sleep(1.1)
+    assert run_worker(handler, lease_seconds=60, drain=True) == len(json.loads(steps))
+    assert get_task_by_id(task["id"])["metadata"]["status"] == "complete"
+    teardown()
+
+
+def test_worker_races_another_finisher():
+    teardown()
+    task = create_task(goal, plan=plan, steps=steps)
+    handled = []
+
+    def handler(task, step):
+        handled.append(step["content"])
+        # someone else finishes the step before the worker does
+        finish_step(task["id"], step["content"])
+
+    assert run_worker(handler, lease_seconds=60, drain=True) == 0
+    assert handled == [step["content"] for step in json.loads(steps)]
+    assert get_task_by_id(task["id"])["metadata"]["status"] == "complete"
+    teardown()
+
+
+def test_worker_stops_on_unfinishable_step():
+    teardown()
+    task = create_task(goal, plan=plan, steps=steps)
+    handled = []
+
+    def handler(task, step):
+        handled.append(step["content"])
+
+    finish = main.finish_step
+    # as if the step's text no longer matched
+    main.finish_step = lambda task, step, min_score=0.5: None
+    try:
+        assert run_worker(handler, lease_seconds=60, drain=True) == 0
+    finally:
+        main.finish_step = finish
+    assert len(handled) == 1
+    # the lease is kept, so the task is retried once it expires
+    assert claim_task(task, "other", lease_seconds=60) is None
+    teardown()
+
+
+def test_task_scheduler():
+    scheduler = TaskScheduler()
+    scheduler.update("low", TaskScheduler.key(0, None, 1))
+    scheduler.update("urgent", TaskScheduler.key(0, 100, 2))
+    scheduler.update("high", TaskScheduler.key(5, None, 3))
+    scheduler.update("after", TaskScheduler.key(9, None, 4), depends_on=["low"])
+    assert scheduler.ready(10) == ["high", "urgent", "low"]
+    scheduler.remove("low")
+    assert scheduler.ready(2) == ["after", "high"]
+    scheduler.update("high", None)
+    assert "high" not in scheduler
+    assert scheduler.ready(10) == ["after", "urgent"]
+    # a dependency the scheduler hasn't seen is waited on until it is removed
+    scheduler.update("blocked", TaskScheduler.key(10, None, 5), depends_on=["unseen"])
+    assert "blocked" not in scheduler.ready(10)
+    scheduler.remove("unseen")
+    assert scheduler.ready(1) == ["blocked"]
+
+
+def test_ready_tasks():
+    teardown()
+    first = create_task("First goal", plan, steps, priority=1)
+    second = create_task("Second goal", plan, steps, priority=3, depends_on=[first])
+    third = create_task("Third goal", plan, steps, priority=1, deadline=datetime.now())
+    assert [task["id"] for task in ready_tasks()] == [third["id"], first["id"]]
+    assert next_task()["id"] == third["id"]
+    cancel_task(third)
+    finish_task(first)
+    assert next_task()["id"] == second["id"]
+    # the scheduler is rebuilt with the same order from the stored metadata
+    rebuild_scheduler()
+    assert [task["id"] for task in ready_tasks()] == [second["id"]]
+    set_current_task()
+    assert get_current_task()["id"] == second["id"]
+    finish_task(second)
+    assert next_task() is None
+    assert set_current_task() is None
+    teardown()
+
+
+def test_ready_tasks_unseen_dependency():
+    teardown()
+    first = create_task("First goal", plan, steps)
+    rebuild_scheduler()
+    # written behind the scheduler's back, as by another process
+    stored = get_memory("task", first["id"])
+    stored["id"] = "unseen"
+    create_memory("task", stored["document"], metadata=stored["metadata"], id="unseen")
+    second = create_task("Second goal", plan, steps, priority=3, depends_on=["unseen"])
+    assert [task["id"] for task in ready_tasks()] == [first["id"]]
+    finish_task("unseen")
+    assert next_task()["id"] == second["id"]
+    # finished dependencies are dropped
+    third = create_task("Third goal", plan, steps, priority=5, depends_on=["unseen", first])
+    assert next_task()["id"] == second["id"]
+    finish_task(first)
+    assert next_task()["id"] == third["id"]
+    teardown()
+
+
+def embed(texts):
+    # one dimension per word, so goals sharing words are close
+    embeddings = []
+    for text in texts:
+        words = text.lower().split()
+        embedding = [0.0] * 32
+        for word in words:
+            embedding[sum(word.encode()) % 32] += 1.0 / len(words)
+        embeddings.append(embedding)
+    return embeddings
+
+
+def check_store(store):
+    store.upsert(
+        "task",
+        ["a", "b", "c"],
+        ["Make a sandwich", "Wash the car", "Make tea"],
+        [
+            {"status": "in_progress", "created_at": 1.0, "goal": "Make a sandwich"},
+            {"status": "complete", "created_at": 2.0, "goal": "Wash the car"},
+            {"status": "in_progress", "created_at": 3.0, "goal": "Make tea"},
+        ],
+    )
+    assert [m["id"] for m in store.get("task")] == ["a", "b", "c"]
+    assert [m["id"] for m in store.get("task", where={"status": "in_progress"})] == [
+        "a",
+        "c",
+    ]
+    where = {"$and": [{"status": "in_progress"}, {"created_at": {"$gt": 1.0}}]}
+    assert [m["id"] for m in store.get("task", where=where)] == ["c"]
+    where = {"goal": {"$in": ["Wash the car", "Make tea"]}}
+    assert [m["id"] for m in store.get("task", where=where)] == ["b", "c"]
+    assert [m["id"] for m in store.get("task", limit=1, offset=1)] == ["b"]
+    assert store.get("task", ids=["c", "x"])[0]["document"] == "Make tea"
+
+    store.update("task", ["a"], [{"status": "complete", "created_at": 1.0}])
+    assert store.get("task", ids=["a"])[0]["metadata"]["status"] == "complete"
+    # updates keep the store order
+    assert [m["id"] for m in store.get("task")] == ["a", "b", "c"]
+
+    assert store.update_if_version("task", ["a"], [{"status": "complete", "version": 1}], [0]) == []
+    assert store.update_if_version(
+        "task", ["a", "b"], [{"status": "cancelled"}, {"status": "cancelled"}], [0, 0]
+    ) == ["a"]
+    # nothing is written when any version doesn't match
+    assert store.get("task", ids=["b"])[0]["metadata"]["status"] == "complete"
+    assert store.update_if_version("task", ["x"], [{}], [0]) == ["x"]
+
+    results = store.search("task", "Make tea now", n_results=2, include_distances=True)
+    assert results[0]["id"] == "c"
+    assert results[0]["distance"] <= results[1]["distance"]
+    results = store.search("task", "Make tea", where={"status": "complete"})
+    assert [m["id"] for m in results] == ["a", "b"]
+    assert "distance" not in results[0]
+
+    store.delete("task", where={"status": "complete"})
+    assert [m["id"] for m in store.get("task")] == ["c"]
+    store.delete("task", ids=["c"])
+    assert store.get("task") == []
+
+
+def test_in_memory_store():
+    check_store(InMemoryStore(embedding_function=embed))
+
+
+def test_sqlite_store():
+    with tempfile.TemporaryDirectory() as directory:
+        store = SQLiteStore(
+            os.path.join(directory, "tasks.db"), embedding_function=embed
+        )
+        check_store(store)
+        journal_mode = store._connect().execute("PRAGMA journal_mode").fetchone()[0]
+        assert journal_mode == "wal"
+
+
+def test_sqlite_store_conditional_update():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "tasks.db")
+        # two stores on one file stand in for two processes
+        first = SQLiteStore(path, embedding_function=embed)
+        second = SQLiteStore(path, embedding_function=embed)
+        first.upsert("task", ["a"], [goal], [{"status": "in_progress", "version": 0}])
+        assert first.update_if_version("task", ["a"], [{"status": "complete", "version": 1}], [0]) == []
+        assert second.update_if_version("task", ["a"], [{"status": "cancelled", "version": 1}], [0]) == ["a"]
+        assert second.get("task", ids=["a"])[0]["metadata"]["status"] == "complete"
+
+
+def test_set_task_store():
+    previous = get_task_store()
+    with tempfile.TemporaryDirectory() as directory:
+        for store in (
+            InMemoryStore(embedding_function=embed),
+            SQLiteStore(os.path.join(directory, "tasks.db"), embedding_function=embed),
+        ):
+            set_task_store(store)
+            try:
+                task = create_task(goal, plan=plan, steps=steps)
+                other = create_task("Wash the car", plan=plan, steps=steps)
+                assert get_current_task()["id"] == other["id"]
+                assert len(list_tasks()) == 2
+                assert search_tasks("balogna sandwich", n_results=1)[0]["id"] == task["id"]
+                finish_step(task, "Prepare Bread")
+                assert get_task_progress(task["id"]) > 0
+                finish_task(task)
+                assert [t["id"] for t in list_tasks()] == [other["id"]]
+                assert list_tasks("complete")[0]["id"] == task["id"]
+                delete_task(other)
+                assert get_task_by_id(other["id"]) is None
+            finally:
+                set_task_store(previous)
+
+
+def test_metadata_writes_skip_embedding():
+    teardown()
+    first = create_task(goal, plan=plan, steps=steps)
+    reset_embedding_stats()
+    second = create_task("Wash the car", plan=plan, steps=steps)
+    # the goal is embedded, the current task pointer is not
+    assert get_embedding_stats() == {"upsert": 1, "total": 1}
+    reset_embedding_stats()
+    finish_step(first, "Prepare Bread")
+    update_plan(first, "A new plan")
+    set_current_task(first)
+    finish_task(second)
+    cancel_task(first)
+    assert get_embedding_stats()["total"] == 0
+    teardown()
+
+
+def test_task_store_is_abstract():
+    class PartialStore(TaskStore):
+        def get(self, category, ids=None, where=None, **kwargs):
+            return []
+
+    try:
+        PartialStore()
+        assert False
+    except TypeError:
+        pass
+
+
+def test_search_counts_query_embedding():
+    store = AgentMemoryStore()
+    wipe_category("task_search_count")
+    assert store.search("task_search_count", "Make tea") == []
+    assert store.get_embedding_stats() == {"search": 1, "total": 1}
+
+
+def test_local_store_embeds_on_search():
+    store = InMemoryStore(embedding_function=embed)
+    store.upsert("task", ["a", "b"], ["Make tea", "Wash the car"], [{}, {}])
+    store.search("task", "Make tea")
+    assert store.get_embedding_stats() == {"search": 3, "total": 3}
+    store.upsert("task", ["a"], ["Make tea"], [{"status": "complete"}])
+    store.search("task", "Make tea")
+    # only the query is embedded again
+    assert store.get_embedding_stats()["total"] == 4
+
+
+def test_embedding_cache_file():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "embeddings.f32")
+        cache = EmbeddingCache(max_size=1, path=path)
+        cache.set(EmbeddingCache.key("a", "m"), [1.0, 2.0])
+        cache.set(EmbeddingCache.key("b", "m"), [3.0, 4.0])
+        # evicted from memory but still on disk
+        assert cache.get(EmbeddingCache.key("a", "m")) == [1.0, 2.0]
+        assert cache.get(EmbeddingCache.key("a", "other model")) is None
+        assert cache.stats()["hit_rate"] == 0.5
+        reopened = EmbeddingCache(path=path)
+        assert reopened.get(EmbeddingCache.key("b", "m")) == [3.0, 4.0]
+        assert reopened.stats()["disk_size"] == 2
+
+
+def test_embedding_cache():
+    teardown()
+    task = create_task(goal, plan=plan, steps=steps)
+    expected = search_tasks(goal, include_distances=True)
+    enable_embedding_cache()
+    try:
+        create_task("Wash the car", plan=plan, steps=steps)
+        reset_embedding_stats()
+        assert search_tasks("Wash the car")[0]["metadata"]["goal"] == "Wash the car"
+        # the goal was embedded when the task was created
+        assert get_embedding_stats()["total"] == 0
+        results = search_tasks(goal, include_distances=True)
+        assert results[0]["id"] == task["id"]
+        assert abs(results[0]["distance"] - expected[0]["distance"]) < 1e-4
+        search_tasks(goal)
+        stats = get_embedding_cache_stats()
+        assert stats["hits"] == 2 and stats["misses"] == 2
+        assert get_embedding_stats()["total"] == 1
+    finally:
+        disable_embedding_cache()
+    teardown()
+
+
+def test_keyword_index():
+    index = KeywordIndex()
+    index.update("a", "in_progress", goal="Fix JIRA-123", plan="", steps="Reproduce")
+    index.update("b", "complete", goal="Write the docs", plan="Fix typos", steps="")
+    assert [task_id for task_id, _ in index.search("jira-123")] == ["a"]
+    # goal words count more than plan words
+    assert [task_id for task_id, _ in index.search("fix")] == ["a", "b"]
+    assert index.search("fix", statuses=["complete"])[0][0] == "b"
+    index.add_text("b", "steps", "Publish the docs")
+    assert index.search("publish")[0][0] == "b"
+    index.remove_text("b", "steps", "Publish the docs")
+    assert index.search("publish") == []
+    index.update("b", stamp=(1, 10.0), goal="Write the docs")
+    assert index.is_current("b", (1, 10.0))
+    assert not index.is_current("b", (2, 11.0))
+    index.remove("a")
+    assert index.search("jira") == []
+    assert not index.is_current("a", None)
+
+
+def test_keyword_search():
+    teardown()
+    task = create_task(goal, plan=plan, steps=steps)
+    other = create_task("Deploy release v2.3.1", plan="Tag and push", steps=["Tag it"])
+    results = search_tasks("balogna", mode="keyword")
+    assert [t["id"] for t in results] == [task["id"]]
+    assert results[0]["score"] > 0
+    assert search_tasks("v2.3.1", mode="keyword")[0]["id"] == other["id"]
+
+    update_plan(other, "Announce the sandwich")
+    add_step(other, "Notify the mailing list")
+    assert search_tasks("mailing", mode="keyword")[0]["id"] == other["id"]
+    assert len(search_tasks("sandwich", mode="keyword")) == 2
+    cancel_step(other, "Notify the mailing list")
+    assert search_tasks("mailing", mode="keyword") == []
+
+    results = search_tasks("balogna sandwich", mode="hybrid", include_distances=True)
+    assert results[0]["id"] == task["id"]
+    assert "distance" in results[0] and results[0]["score"] > 0
+
+    finish_task(other)
+    assert search_tasks("release", mode="keyword") == []
+    assert search_tasks("v2.3.1", status="complete", mode="keyword")[0]["id"] == other["id"]
+    delete_task(task)
+    assert search_tasks("balogna", mode="keyword") == []
+    teardown()
+
+
+def test_task_filter():
+    task_filter = TaskFilter(status=["in_progress", "blocked"], updated_since=10)
+    assert task_filter.where() == {
+        "$and": [
+            {"status": {"$in": ["in_progress", "blocked"]}},
+            {"updated_at": {"$gte": 10.0}},
+        ]
+    }
+    assert TaskFilter(status="complete").where() == {"status": "complete"}
+    assert TaskFilter().where() is None
+    assert TaskFilter(has_incomplete_steps=True).where() == {"next_step_index": {"$gte": 0}}
+
+    memory = {
+        "id": "1",
+        "document": "Ship v2",
+        "metadata": {"status": "blocked", "updated_at": 12, "next_step_index": -1},
+    }
+    assert task_filter.matches(memory)
+    assert not TaskFilter(updated_before=12).matches(memory)
+    assert not TaskFilter(has_incomplete_steps=True).matches(memory)
+    assert TaskFilter(goal_prefix="Ship").matches(memory)
+    assert not TaskFilter(goal_prefix="Fix").matches(memory)
+    assert TaskFilter(goal_prefix="Fix").has_residual
+    assert TaskFilter().with_status("complete").statuses == ["complete"]
+    assert task_filter.with_status("complete").statuses == ["in_progress", "blocked"]
+
+
+def check_task_filters():
+    first = create_task("Fix the login page", plan=plan, steps=steps)
+    second = create_task("Fix the signup page", plan=plan, steps=steps)
+    third = create_task(goal, plan=plan, steps=steps)
+    finish_task(first)
+    for step in json.loads(steps):
+        finish_step(second, step["content"])
+    since = get_task_by_id(second["id"])["metadata"]["updated_at"]
+
+    both = TaskFilter(status=["in_progress", "complete"])
+    assert len(list_tasks(task_filter=both)) == 3
+    assert len(list_tasks(status=["in_progress", "complete"], limit=10)) == 3
+    assert [t["id"] for t in list_tasks(status=None, task_filter=TaskFilter(updated_since=since))] == [
+        second["id"]
+    ]
+    assert [t["id"] for t in list_tasks(task_filter=TaskFilter(has_incomplete_steps=True))] == [
+        third["id"]
+    ]
+
+    fixes = TaskFilter(status=["in_progress", "complete"], goal_prefix="Fix")
+    assert len(list_tasks(task_filter=fixes, limit=10)) == 2
+    assert len(list_tasks(task_filter=fixes, limit=10, offset=1)) == 1
+    walked = list_tasks(task_filter=fixes, sort_by="created_at", descending=False)
+    assert [t["id"] for t in walked] == [first["id"], second["id"]]
+    created = get_task_by_id(second["id"])["metadata"]["created_at"]
+    walked = list_tasks(
+        status=None,
+        task_filter=TaskFilter(created_before=created),
+        sort_by="created_at",
+        limit=10,
+    )
+    assert [t["id"] for t in walked] == [first["id"]]
+
+    results = search_tasks("Fix the page", n_results=1, task_filter=fixes)
+    assert results[0]["id"] in (first["id"], second["id"])
+    results = search_tasks("page", n_results=5, task_filter=fixes, mode="keyword")
+    assert sorted(t["id"] for t in results) == sorted([first["id"], second["id"]])
+    results = search_tasks(goal, n_results=5, task_filter=fixes)
+    assert third["id"] not in [t["id"] for t in results]
+
+
+def test_task_filters():
+    teardown()
+    check_task_filters()
+    teardown()
+
+
+def test_task_filters_status_partitions():
+    teardown()
+    enable_status_partitions()
+    try:
+        check_task_filters()
+    finally:
+        disable_status_partitions()
+    teardown()
+
+
+def test_task_filters_local_stores():
+    previous = get_task_store()
+    with tempfile.TemporaryDirectory() as directory:
+        for store in (
+            InMemoryStore(embedding_function=embed),
+            SQLiteStore(os.path.join(directory, "tasks.db"), embedding_function=embed),
+        ):
+            set_task_store(store)
+            try:
+                check_task_filters()
+            finally:
+                set_task_store(previous)
+
+
+def test_keyword_search_step_records():
+    teardown()
+    enable_step_records()
+    try:
+        task = create_task(goal, plan=plan, steps=steps)
+        rebuild_keyword_index()
+        assert search_tasks("condiments", mode="keyword")[0]["id"] == task["id"]
+        add_step(task, "Wipe the counter")
+        assert search_tasks("counter", mode="keyword")[0]["id"] == task["id"]
+        cancel_step(task, "Wipe the counter")
+        assert search_tasks("counter", mode="keyword") == []
+    finally:
+        disable_step_records()
+    teardown()
@@ -0,0 +1,137 @@
+from .steps import Step, StepIndex
+
+
+class TaskTransaction:
+    """Plan and step changes to one task, written together at the end.
+
+    Transactions are opened with agentagenda.transaction(task); changes are
+    made to an in-memory copy of the task and written in one go when the
+    with block ends without an error.
+
+    Args:
+        memory (dict): The task, as read at the start of the transaction.
+        steps (list): Copies of the task's steps as Steps, in order.
+        records (bool, optional): Whether the task keeps its steps as step records. Defaults to False.
+    """
+
+    def __init__(self, memory, steps, records=False):
+        self.memory = memory
+        self.steps = steps
+        self.records = records
+        self.changed = {}
+        self.added = []
+        self.removed = []
+        self.dirty = False
+
+    @property
+    def id(self):
+        """str: The id of the task."""
+        return self.memory["id"]
+
+    @property
+    def metadata(self):
+        """dict: The task's metadata, including changes made so far."""
+        return self.memory["metadata"]
+
+    @property
+    def steps_changed(self):
+        """bool: Whether any step was changed, added or removed."""
+        return len(self.changed) + len(self.added) + len(self.removed) > 0
+
+    def _mark_changed(self, step):
+        # added steps are written whole when the transaction ends
+        if not any(step is added for added in self.added):
+            self.changed[step.ordinal] = step
+        self.dirty = True
+
+    def update_plan(self, plan):
+        """Replace the plan of the task.
+
+        Args:
+            plan (str): The new plan.
+        """
+        self.metadata["plan"] = plan
+        self.dirty = True
+
+    def add_step(self, content):
+        """Add a step to the end of the task.
+
+        Args:
+            content (str): The text of the step.
+
+        Returns:
+            Step: The new step.
+        """
+        if self.records:
+            ordinal = int(self.metadata["next_ordinal"])
+            self.metadata["next_ordinal"] = ordinal + 1
+        else:
+            ordinal = len(self.steps)
+        step = Step(content, False, task_id=self.id, ordinal=ordinal)
+        self.steps.append(step)
+        self.added.append(step)
+        self.dirty = True
+        return step
+
+    def finish_step(self, content, min_score=0.5):
+        """Complete the step that best matches a text, as finish_step does.
+
+        Args:
+            content (str): The step to complete.
+            min_score (float, optional): The lowest word overlap score accepted as a match. Defaults to 0.5.
+
+        Returns:
+            bool: Whether a step matched.
+        """
+        position, _ = StepIndex(self.steps).match(content, min_score=min_score)
+        if position is None:
+            return False
+        step = self.steps[position]
+        if not step.completed:
+            step.completed = True
+            self._mark_changed(step)
+        return True
+
+    def update_step(self, step):
+        """Set whether a step is completed, as update_step does.
+
+        Args:
+            step (dict or Step): A Step with an ordinal, or a dict with "content" and "completed" keys.
+
+        Returns:
+            bool: Whether a step matched.
+        """
+        if isinstance(step, Step) and step.ordinal is not None:
+            matches = [s for s in self.steps if s.ordinal == step.ordinal]
+            completed = step.completed
+        else:
+            if isinstance(step, Step):
+                step = step.to_dict()
+            matches = [s for s in self.steps if s.content == step["content"]]
+            completed = step["completed"]
+        for s in matches:
+            if s.completed != completed:
+                s.completed = completed
+                self._mark_changed(s)
+        return len(matches) > 0
+
+    def cancel_step(self, content):
+        """Remove every step with the given text, as cancel_step does.
+
+        Args:
+            content (str): The text of the steps to remove.
+
+        Returns:
+            bool: Whether a step was removed.
+        """
+        matches = [s for s in self.steps if s.content == content]
+        for step in matches:
+            if any(step is added for added in self.added):
+                self.added = [added for added in self.added if added is not step]
+            else:
+                self.changed.pop(step.ordinal, None)
+                self.removed.append(step)
+        self.steps = [s for s in self.steps if s.content != content]
+        if len(matches) > 0:
+            self.dirty = True
+        return len(matches) > 0
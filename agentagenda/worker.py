@@ -0,0 +1,263 @@
+"""A pool of workers that carry out the steps of in-progress tasks.
+
+Each worker claims a task with a lease, calls the handler for the task's
+next step until no steps are left, and marks each step done with
+finish_step. A heartbeat renews the lease while the worker runs, so the
+tasks of a worker that dies are claimed again once their lease expires.
+
+    from agentagenda.worker import WorkerPool
+
+    def handle(task, step):
+        ...  # carry out step["content"]
+
+    WorkerPool(handle, workers=4).run()
+"""
+
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+
+from agentlogger import log
+
+from . import main
+
+debug = os.environ.get("DEBUG", False)
+
+
+class _Heartbeat:
+    """Renews a lease in the background until stopped or the lease is lost."""
+
+    def __init__(self, task_id, owner, lease_seconds, interval):
+        self.lost = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run,
+            args=(task_id, owner, lease_seconds, interval),
+            daemon=True,
+        )
+        self._thread.start()
+
+    def _run(self, task_id, owner, lease_seconds, interval):
+        while not self._stopped.wait(interval):
+            try:
+                renewed = main.renew_lease(task_id, owner, lease_seconds=lease_seconds)
+            except Exception as error:
+                log("Failed to renew lease on {}: {}".format(task_id, error), log=debug)
+                renewed = False
+            if not renewed:
+                self.lost.set()
+                return
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+
+def work_on_task(
+    task, handler, owner, lease_seconds=60, heartbeat_interval=None, finish=True
+):
+    """Run the handler for each remaining step of a claimed task.
+
+    Stops early if the lease is lost or the task stops being in progress.
+    If the handler raises, the lease is kept until it expires, so the task
+    is retried after lease_seconds. The same happens when a step can't be
+    marked done and is still the next step afterwards, so the handler isn't
+    run for it over and over; a step someone else finished meanwhile is
+    skipped.
+
+    Args:
+        task (dict): The task, claimed by owner.
+        handler (callable): Called as handler(task, step) for each step.
+        owner (str): The owner of the task's lease.
+        lease_seconds (float, optional): How long the lease lasts without renewal. Defaults to 60.
+        heartbeat_interval (float, optional): Seconds between lease renewals. Defaults to a third of lease_seconds.
+        finish (bool, optional): Finish the task once all its steps are done. Defaults to True.
+
+    Returns:
+        int: The number of steps carried out.
+    """
+    task_id = task["id"]
+    if heartbeat_interval is None:
+        heartbeat_interval = lease_seconds / 3
+    heartbeat = _Heartbeat(task_id, owner, lease_seconds, heartbeat_interval)
+    done = 0
+    stalled = False
+    try:
+        while not heartbeat.lost.is_set():
+            task = main.get_task_by_id(task_id)
+            if task is None or task["metadata"]["status"] != "in_progress":
+                break
+            step = main.get_next_step(task)
+            if step is None:
+                if finish:
+                    main.finish_task(task_id)
+                break
+            position = task["metadata"].get("next_step_index")
+            handler(task, step)
+            if main.finish_step(task_id, step["content"]) is not None:
+                done += 1
+                continue
+            # nothing was completed: either another finisher got there
+            # first, and the cursor has moved on, or the step no longer
+            # matches its text and would be handled again forever
+            task = main.get_task_by_id(task_id)
+            if (
+                task is not None
+                and task["metadata"].get("next_step_index") == position
+                and main.get_next_step(task) == step
+            ):
+                log(
+                    "Step of task {} can't be finished: {}".format(
+                        task_id, step["content"]
+                    ),
+                    log=debug,
+                )
+                stalled = True
+                break
+    except Exception:
+        # keep the lease, so the task is retried once it expires rather
+        # than straight away
+        heartbeat.stop()
+        raise
+    heartbeat.stop()
+    if not stalled:
+        main.release_task(task_id, owner)
+    return done
+
+
+def run_worker(
+    handler,
+    owner=None,
+    stop=None,
+    lease_seconds=60,
+    heartbeat_interval=None,
+    poll_interval=1.0,
+    drain=False,
+    finish=True,
+):
+    """Claim and work on tasks until stopped.
+
+    Args:
+        handler (callable): Called as handler(task, step) for each step.
+        owner (str, optional): The name the worker leases tasks under. Defaults to a random name.
+        stop (Event, optional): Set to stop the worker after its current task. Defaults to None (never).
+        lease_seconds (float, optional): How long a lease lasts without renewal. Defaults to 60.
+        heartbeat_interval (float, optional): Seconds between lease renewals. Defaults to a third of lease_seconds.
+        poll_interval (float, optional): Seconds to wait when no task can be claimed. Defaults to 1.
+        drain (bool, optional): Return once no task can be claimed. Defaults to False.
+        finish (bool, optional): Finish tasks once all their steps are done. Defaults to True.
+
+    Returns:
+        int: The number of steps carried out.
+    """
+    owner = owner or "worker-{}".format(uuid.uuid4())
+    done = 0
+    while stop is None or not stop.is_set():
+        task = main.claim_next_task(owner, lease_seconds=lease_seconds)
+        if task is None:
+            if drain:
+                break
+            time.sleep(poll_interval)
+            continue
+        try:
+            done += work_on_task(
+                task,
+                handler,
+                owner,
+                lease_seconds=lease_seconds,
+                heartbeat_interval=heartbeat_interval,
+                finish=finish,
+            )
+        except Exception as error:
+            log("Step failed for task {}: {}".format(task["id"], error), log=debug)
+    return done
+
+
+class WorkerPool:
+    """A pool of threads or processes running run_worker.
+
+    Processes are started with multiprocessing, so the handler has to be
+    picklable, and settings such as enable_step_records have to be applied
+    in each process (by the handler's module, for example) when the start
+    method isn't "fork".
+
+    Args:
+        handler (callable): Called as handler(task, step) for each step.
+        workers (int, optional): How many workers to run. Defaults to 4.
+        processes (bool, optional): Run workers in processes instead of threads. Defaults to False.
+        lease_seconds (float, optional): How long a lease lasts without renewal. Defaults to 60.
+        heartbeat_interval (float, optional): Seconds between lease renewals. Defaults to a third of lease_seconds.
+        poll_interval (float, optional): Seconds to wait when no task can be claimed. Defaults to 1.
+        finish (bool, optional): Finish tasks once all their steps are done. Defaults to True.
+    """
+
+    def __init__(
+        self,
+        handler,
+        workers=4,
+        processes=False,
+        lease_seconds=60,
+        heartbeat_interval=None,
+        poll_interval=1.0,
+        finish=True,
+    ):
+        self.handler = handler
+        self.workers = workers
+        self.processes = processes
+        self.options = {
+            "lease_seconds": lease_seconds,
+            "heartbeat_interval": heartbeat_interval,
+            "poll_interval": poll_interval,
+            "finish": finish,
+        }
+        self._stop = multiprocessing.Event() if processes else threading.Event()
+        self._running = []
+
+    def start(self, drain=False):
+        """Start the workers.
+
+        Args:
+            drain (bool, optional): Stop each worker once no task can be claimed. Defaults to False.
+        """
+        self._stop.clear()
+        prefix = "worker-{}".format(uuid.uuid4())
+        for i in range(self.workers):
+            kwargs = dict(
+                self.options,
+                owner="{}-{}".format(prefix, i),
+                stop=self._stop,
+                drain=drain,
+            )
+            if self.processes:
+                worker = multiprocessing.Process(
+                    target=run_worker, args=(self.handler,), kwargs=kwargs
+                )
+            else:
+                worker = threading.Thread(
+                    target=run_worker, args=(self.handler,), kwargs=kwargs
+                )
+            worker.start()
+            self._running.append(worker)
+
+    def stop(self, wait=True):
+        """Stop the workers once they finish their current task.
+
+        Args:
+            wait (bool, optional): Wait for the workers to stop. Defaults to True.
+        """
+        self._stop.set()
+        if wait:
+            self.join()
+
+    def join(self):
+        """Wait for every worker to stop."""
+        for worker in self._running:
+            worker.join()
+        self._running = []
+
+    def run(self):
+        """Work until no in-progress task can be claimed, then return."""
+        self.start(drain=True)
+        self.join()